@@ -0,0 +1,209 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Load benchmark of ParaDropAPIClient against the fake API server (or any server given with --url).
+    Runs a mix of client calls from many threads and reports the throughput and latency percentiles.
+        Example:
+            python -m bench.clientbench --calls 5000 --concurrency 16 --latency 0.002 --error-rate 0.01
+"""
+
+import sys, time, json, argparse, threading, itertools
+
+from lib.paradrop import *
+from lib.paradrop import FakeOutput
+from lib.paradrop.api.client import ParaDropAPIClient
+from lib.paradrop.api.pool import HTTPConnectionPool
+from lib.paradrop.api.retry import RetryPolicy, NO_RETRY
+from lib.paradrop.api.localserver import LocalAPIServer
+from lib.paradrop.api.fakeapi import FakeParaDropAPI
+
+BENCH_USER = 'bench'
+BENCH_PASSWD = 'bench'
+
+# Client call: kind of guid it takes ('ap', 'chute' or None)
+OPS = {
+    'getApList': None,
+    'getApInfo': 'ap',
+    'getAPStatus': 'ap',
+    'listChutes': 'ap',
+    'getChuteInfo': 'chute',
+    'getChuteData': 'chute',
+    'getChuteStatus': 'chute',
+    'listChuteFiles': 'chute',
+}
+DEFAULT_MIX = 'getChuteInfo,getChuteStatus,listChutes,getChuteData'
+
+def setupArgParse():
+    p = argparse.ArgumentParser(description='Load benchmark of the ParaDrop API client')
+    p.add_argument('-n', '--calls', help='Number of calls to make', type=int, default=2000)
+    p.add_argument('-c', '--concurrency', help='Number of threads making calls', type=int, default=8)
+    p.add_argument('-m', '--mix', help='Comma separated client calls to cycle through (%s)' % ', '.join(sorted(OPS.keys())),
+            type=str, default=DEFAULT_MIX)
+    p.add_argument('--aps', help='Number of APs on the fake server', type=int, default=10)
+    p.add_argument('--chutes', help='Number of chutes per AP on the fake server', type=int, default=5)
+    p.add_argument('--latency', help='Seconds of latency the fake server adds to each call', type=float, default=0.0)
+    p.add_argument('--jitter', help='Up to this many more seconds of latency per call', type=float, default=0.0)
+    p.add_argument('--error-rate', help='Fraction of calls the fake server fails with ERR_DBISSUE', type=float, default=0.0)
+    p.add_argument('--no-retry', help='Disable the client retry policy', action='store_true')
+    p.add_argument('--url', help='Benchmark this API server instead of the fake one (needs --user/--passwd)', type=str)
+    p.add_argument('--user', help='Username for --url', type=str, default=BENCH_USER)
+    p.add_argument('--passwd', help='Password for --url', type=str, default=BENCH_PASSWD)
+    p.add_argument('--json', help='Print the results as JSON', action='store_true')
+    p.add_argument('-v', '--verbose', help='Show the client errors', action='store_true')
+    return p
+
+def percentile(values, q):
+    """The @q (0-1) percentile of the sorted list @values."""
+    if(not values):
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+class BenchResult:
+    """Latencies and errors of a benchmark run."""
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.elapsed = 0.0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "<BenchResult %d calls %d errors>" % (len(self.latencies), self.errors)
+
+    def add(self, latency, failed):
+        with self.lock:
+            self.latencies.append(latency)
+            if(failed):
+                self.errors += 1
+
+    def summary(self):
+        l = sorted(self.latencies)
+        n = len(l)
+        return {'calls': n, 'errors': self.errors, 'elapsed': self.elapsed,
+                'throughput': n / self.elapsed if self.elapsed else None,
+                'mean': sum(l) / n if n else None,
+                'p50': percentile(l, 0.5), 'p90': percentile(l, 0.9), 'p99': percentile(l, 0.99),
+                'max': l[-1] if n else None}
+
+def runBench(clt, work, concurrency):
+    """
+        Make every (name, arg) call of @work on the client from @concurrency threads.
+        A call fails if it raises or returns None/True, the way the client reports errors.
+        Returns a dict of name: BenchResult, with the overall result under None.
+    """
+    results = dict([(name, BenchResult()) for name, arg in work])
+    results[None] = BenchResult()
+    it = iter(work)
+    lock = threading.Lock()
+
+    def worker():
+        while(True):
+            with lock:
+                try:
+                    name, arg = next(it)
+                except StopIteration:
+                    return
+            func = getattr(clt, name)
+            t = time.time()
+            try:
+                if(arg is None):
+                    r = func()
+                else:
+                    r = func(arg)
+                failed = (r is None or r is True)
+            except Exception:
+                failed = True
+            dt = time.time() - t
+            results[name].add(dt, failed)
+            results[None].add(dt, failed)
+
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    start = time.time()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    elapsed = time.time() - start
+    for r in results.values():
+        r.elapsed = elapsed
+    return results
+
+def buildWork(mix, calls, apids, chids):
+    """The list of (call, guid) to make, cycling through the calls of @mix and the targets of each."""
+    aps = itertools.cycle(apids or [None])
+    chutes = itertools.cycle(chids or [None])
+    work = []
+    for name in itertools.islice(itertools.cycle(mix), calls):
+        kind = OPS[name]
+        if(kind == 'ap'):
+            work.append((name, next(aps)))
+        elif(kind == 'chute'):
+            work.append((name, next(chutes)))
+        else:
+            work.append((name, None))
+    return work
+
+def printResults(results, theOut=sys.stdout):
+    fmt = '%-16s %7s %7s %10s %9s %9s %9s %9s\n'
+    theOut.write(fmt % ('call', 'calls', 'errors', 'calls/s', 'mean ms', 'p50 ms', 'p99 ms', 'max ms'))
+    ms = lambda v: '%.2f' % (v * 1000) if v is not None else '-'
+    for name in sorted([k for k in results.keys() if k]) + [None]:
+        s = results[name].summary()
+        theOut.write(fmt % (name or 'TOTAL', s['calls'], s['errors'], '%.1f' % (s['throughput'] or 0),
+                ms(s['mean']), ms(s['p50']), ms(s['p99']), ms(s['max'])))
+
+def main(argv=None):
+    args = setupArgParse().parse_args(argv)
+    mix = [m.strip() for m in args.mix.split(',') if m.strip()]
+    for m in mix:
+        if(m not in OPS):
+            sys.stderr.write('Unknown call %s\n' % m)
+            return 1
+
+    if(not args.verbose):
+        out.err = FakeOutput()
+        out.warn = FakeOutput()
+
+    srv = None
+    url = args.url
+    if(not url):
+        api = FakeParaDropAPI()
+        api.addUser(args.user, args.passwd)
+        api.populate(args.aps, args.chutes)
+        if(args.latency or args.jitter or args.error_rate):
+            api.inject(latency=args.latency, jitter=args.jitter, errorRate=args.error_rate)
+        srv = LocalAPIServer(api)
+        url = srv.start()
+
+    retry = RetryPolicy()
+    if(args.no_retry):
+        retry = NO_RETRY
+    clt = ParaDropAPIClient(args.user, args.passwd, url=url, pool=HTTPConnectionPool(args.concurrency), retry=retry)
+    try:
+        if(not clt.signin()):
+            sys.stderr.write('Unable to signin to %s\n' % url)
+            return 1
+
+        # Find the targets the same way a user of the client would
+        apids = [a.guid for a in clt.getApList()]
+        chids = []
+        for apid in apids:
+            chids += [c.guid for c in clt.listChutes(apid)]
+        clt.metrics.reset()
+
+        results = runBench(clt, buildWork(mix, args.calls, apids, chids), args.concurrency)
+        if(args.json):
+            d = dict([(k or 'TOTAL', v.summary()) for k, v in results.items()])
+            sys.stdout.write(json.dumps({'results': d, 'endpoints': clt.stats()}, sort_keys=True) + '\n')
+        else:
+            printResults(results)
+    finally:
+        clt.close()
+        if(srv):
+            srv.stop()
+    return 0
+
+if(__name__ == "__main__"):
+    sys.exit(main())
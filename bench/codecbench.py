@@ -0,0 +1,135 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Compares json2str/str2json against the original three pass implementation (kept here) on large
+    listChutes/getChuteData sized payloads, and checks that both give the same results.
+        Example:
+            python -m bench.codecbench --chutes 5000
+"""
+
+import sys, time, json, urllib, argparse
+
+from lib.paradrop import *
+
+###############################################################################
+# The original codec
+def legacyConvertUnicode(elem):
+    if isinstance(elem, dict):
+        return {legacyConvertUnicode(key): legacyConvertUnicode(value) for key, value in elem.iteritems()}
+    elif isinstance(elem, list):
+        return [legacyConvertUnicode(element) for element in elem]
+    elif isinstance(elem, unicode):
+        return elem.encode('utf-8')
+    elif(elem == 'null'):
+        return None
+    else:
+        return elem
+
+def legacyUrlEncode(elem, safe=' '):
+    if isinstance(elem, dict):
+        return {legacyUrlEncode(key, safe): legacyUrlEncode(value, safe) for key, value in elem.iteritems()}
+    elif isinstance(elem, list):
+        return [legacyUrlEncode(element, safe) for element in elem]
+    elif isinstance(elem, str):
+        return urllib.quote(elem, safe)
+    else:
+        return elem
+
+def legacyUrlDecode(elem):
+    if isinstance(elem, dict):
+        return {legacyUrlDecode(key): legacyUrlDecode(value) for key, value in elem.iteritems()}
+    elif isinstance(elem, list):
+        return [legacyUrlDecode(element) for element in elem]
+    elif isinstance(elem, str):
+        return urllib.unquote(elem)
+    else:
+        return elem
+
+def legacyJson2str(j):
+    return json.dumps(legacyUrlEncode(j), separators=(',', ':'))
+
+def legacyStr2json(s):
+    t = json.loads(s, object_hook=legacyConvertUnicode)
+    if(isinstance(t, list)):
+        t = [legacyConvertUnicode(i) for i in t]
+    return legacyUrlDecode(t)
+
+###############################################################################
+def makeChute(i):
+    """A chute as getChuteData returns it, modeled on examples/seccam.py."""
+    return {
+        'name': 'seccam%d' % i, 'guid': '8d5c1b9e-4c2e-4a43-9a5e-%012d' % i, 'apid': '0b1c7e11-1b9d-4b4e-8a52-5d1e2c3a4b5c',
+        'state': 'running', 'contact': 'dev@paradrop.org', 'internalid': i, 'devinfo': {'version': '1.0', 'note': 'null'},
+        'struct': {'net': {'wifi': {'type': 'wifi', 'intfName': 'wlan0', 'ssid': 'Security Camera %d' % i,
+                                     'key': 'p@ssw0rd/%d' % i, 'netmask': '255.255.255.0', 'ipaddr': '192.168.%d.1' % (i % 250)}}},
+        'runtime': [{'name': 'webhosting', 'program': 'uhttpd', 'args': '-p 80 -i .php=/usr/bin/php-cgi -h /srv/www'},
+                    {'name': 'seccam', 'program': 'python', 'args': '/root/seccam.py -m_sec 2 -m_sensitivity 50'}],
+        'traffic': [{'type': 'redirect', 'from': '@net.wifi', 'to': '*:80'}, {'type': 'allow', 'from': '*', 'to': '@net.wifi'}],
+        'resource': {'cpu': 10, 'memory': 16384, 'disk': 1.5, 'enabled': True},
+        'files': [{'name': 'www', 'path': '/srv/www', 'location': '@paradrop.server(seccam/srv.tar.gz)',
+                   'sha1': '526bb8cb52458aad4043c56980cd238551b46b7e', 'todo': 'EXTRACT'},
+                  {'name': 'root', 'path': '/root', 'location': '@paradrop.server(seccam/seccam.py)',
+                   'sha1': '1633ea1d6351929cc2c8717d1611dcb41681b585'}],
+    }
+
+def same(a, b):
+    """Deep equality that also requires the same types (str vs unicode) at every level."""
+    if(type(a) is not type(b)):
+        return False
+    if(type(a) is dict):
+        if(len(a) != len(b)):
+            return False
+        for k in a:
+            if(k not in b or not [x for x in b if x == k and type(x) is type(k)] or not same(a[k], b[k])):
+                return False
+        return True
+    if(type(a) is list):
+        return len(a) == len(b) and all([same(x, y) for x, y in zip(a, b)])
+    return a == b
+
+def best(func, arg, repeat):
+    """Fastest of @repeat runs of func(arg), in seconds."""
+    times = []
+    for i in range(repeat):
+        t = time.time()
+        func(arg)
+        times.append(time.time() - t)
+    return min(times)
+
+def setupArgParse():
+    p = argparse.ArgumentParser(description='Benchmark of the JSON codec used on the API payloads')
+    p.add_argument('-c', '--chutes', help='Number of chutes in the payload', type=int, default=5000)
+    p.add_argument('-r', '--repeat', help='Runs of each, the fastest is reported', type=int, default=5)
+    return p
+
+def main(argv=None):
+    args = setupArgParse().parse_args(argv)
+    obj = {'response': 'OK', 'data': [makeChute(i) for i in range(args.chutes)]}
+    # A top level list is decoded differently, make sure that path is covered too
+    lst = obj['data']
+
+    for o in (obj, lst):
+        s = legacyJson2str(o)
+        if(json2str(o) != s):
+            sys.stderr.write('json2str output differs from the original\n')
+            return 1
+        if(not same(legacyStr2json(s), str2json(s))):
+            sys.stderr.write('str2json output differs from the original\n')
+            return 1
+
+    s = legacyJson2str(obj)
+    mb = len(s) / (1024.0 * 1024.0)
+    sys.stdout.write('payload: %d chutes, %.2f MB\n' % (args.chutes, mb))
+    fmt = '%-9s %10s %10s %10s %8s\n'
+    sys.stdout.write(fmt % ('', 'legacy s', 'fused s', 'MB/s', 'speedup'))
+    for name, old, new, arg in (('str2json', legacyStr2json, str2json, s), ('json2str', legacyJson2str, json2str, obj)):
+        to = best(old, arg, args.repeat)
+        tn = best(new, arg, args.repeat)
+        sys.stdout.write(fmt % (name, '%.3f' % to, '%.3f' % tn, '%.1f' % (mb / tn), '%.2fx' % (to / tn)))
+    return 0
+
+if(__name__ == "__main__"):
+    sys.exit(main())
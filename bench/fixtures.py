@@ -0,0 +1,93 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Synthetic fleets for the benchmarks: APs and chutes as the API server returns them,
+    with struct/runtime/traffic/resource/files shaped like examples/seccam.py and examples/virtrouter.py.
+    Everything is generated from a seed so runs compare like with like.
+"""
+
+import copy, random, uuid
+
+from lib.paradrop import *
+from lib.paradrop.chute import STATE_RUNNING, STATE_STOPPED, STATE_FROZEN
+from examples import seccam, virtrouter
+
+# The example chutes the fleet is made of, and how often each appears
+TEMPLATES = [
+    ('seccam', seccam.seccamChute.getAPIDataFormat(), 0.5),
+    ('virtrouter', virtrouter.virtRouter.getAPIDataFormat(), 0.5),
+]
+STATES = [(STATE_RUNNING, 0.8), (STATE_STOPPED, 0.15), (STATE_FROZEN, 0.05)]
+
+def _pick(rnd, choices):
+    """Weighted choice from the list of (value, ..., weight) tuples @choices."""
+    r = rnd.random() * sum([c[-1] for c in choices])
+    for c in choices:
+        r -= c[-1]
+        if(r <= 0):
+            return c
+    return choices[-1]
+
+def _guid(rnd):
+    return str(uuid.UUID(int=rnd.getrandbits(128)))
+
+def makeAP(i, rnd, devid=None):
+    """The descriptor of AP number @i, as ap/list returns it."""
+    return {'name': 'ap%04d' % i, 'guid': _guid(rnd), 'contact': 'dev%d@paradrop.org' % (i % 7),
+            'devinfo': {'model': 'PCEngines ALIX', 'firmware': '1.%d.%d' % (i % 3, i % 10), 'devid': devid}}
+
+def makeChute(i, rnd, apid=None):
+    """
+        The descriptor of chute number @i on @apid, as listChutes/getChuteData return it.
+        One of the TEMPLATES with its names, addresses, keys and rules made unique to the chute.
+    """
+    kind, tmpl, w = _pick(rnd, TEMPLATES)
+    d = copy.deepcopy(tmpl)
+    net = (i % 250) + 1
+    d['name'] = '%s%d' % (kind, i)
+    d['guid'] = _guid(rnd)
+    d['apid'] = apid or _guid(rnd)
+    d['internalid'] = '%04d' % (i % 10000)
+    d['state'] = _pick(rnd, STATES)[0]
+    d['contact'] = 'dev%d@paradrop.org' % (i % 7)
+    d['devinfo'] = {'description': 'Synthetic %s chute %d' % (kind, i), 'version': '1.%d' % (i % 5)}
+
+    for name, intf in d['struct'].get('net', {}).items():
+        intf['ipaddr'] = '10.%d.%d.1' % (net, 10 + len(name))
+        if(intf.get('type') == 'wifi'):
+            intf['ssid'] = d['name']
+            intf['key'] = 'k%08x' % rnd.getrandbits(32)
+    d['struct'].setdefault('disk', {})['size'] = rnd.randint(1, 64) * 1024
+    for t in d['traffic']:
+        t['rule'] = t['rule'].replace('10.100.13.1', '10.%d.16.1' % net)
+    for f in d['files']:
+        f['location'] = f['location'].replace('seccam/', '%s/' % d['name'])
+        f['sha1'] = '%040x' % rnd.getrandbits(160)
+    for k in ('wan', 'wifi'):
+        if(k in d['resource']):
+            d['resource'][k] = {'down': rnd.choice([10000, 25000, 50000]), 'up': rnd.choice([5000, 10000, 25000])}
+    return d
+
+def makeFleet(numAPs, chutesPerAP, seed=0, devid=None):
+    """Returns a list of (AP descriptor, [chute descriptors]) for @numAPs APs with @chutesPerAP chutes each."""
+    rnd = random.Random(seed)
+    fleet = []
+    n = 0
+    for i in range(numAPs):
+        ap = makeAP(i, rnd, devid)
+        chutes = []
+        for j in range(chutesPerAP):
+            chutes.append(makeChute(n, rnd, ap['guid']))
+            n += 1
+        fleet.append((ap, chutes))
+    return fleet
+
+def allChutes(fleet):
+    return [c for ap, chutes in fleet for c in chutes]
+
+def listChutesPayload(chutes):
+    """The response to ap/<apid>/list for @chutes."""
+    return {'response': 'OK', 'data': chutes}
@@ -0,0 +1,239 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Micro-benchmarks of the codec and the Chute model on a synthetic fleet (see bench.fixtures).
+    Results can be saved as a baseline and later runs compared against it to catch regressions.
+        Example:
+            python -m bench.modelbench --aps 50 --chutes 20 --save
+            python -m bench.modelbench --aps 50 --chutes 20 --compare
+"""
+
+import os, sys, time, json, shutil, tempfile, platform, argparse
+
+from lib.paradrop import *
+from lib.paradrop import FakeOutput
+from lib.paradrop import chute
+from lib.paradrop.chute import Chute
+from lib.paradrop.utils import pdutils
+from bench import fixtures
+
+# Kept out of the source tree so a run can't leave it to be committed
+DEFAULT_BASELINE = os.path.join(os.path.expanduser('~'), '.paradrop', 'bench-baseline.json')
+BASELINE_VERSION = 1
+
+###############################################################################
+# The cases, each takes the list of chute descriptors and the args and returns
+# (function to time, number of items it handles per call)
+def caseJson2str(chutes, args):
+    payload = fixtures.listChutesPayload(chutes)
+    return lambda: json2str(payload), len(chutes)
+
+def caseStr2json(chutes, args):
+    s = json2str(fixtures.listChutesPayload(chutes))
+    return lambda: str2json(s), len(chutes)
+
+def caseChuteDescriptor(chutes, args):
+    return lambda: [Chute(descriptor=d) for d in chutes], len(chutes)
+
+def caseChuteMerge(chutes, args):
+    objs = [Chute() for d in chutes]
+    pairs = zip(objs, chutes)
+    def run():
+        for c, d in pairs:
+            c.merge(d)
+    return run, len(chutes)
+
+def caseGetAPIDataFormat(chutes, args):
+    objs = [Chute(descriptor=d) for d in chutes]
+    return lambda: [c.getAPIDataFormat() for c in objs], len(chutes)
+
+def caseStoreManifest(chutes, args):
+    objs = [Chute(descriptor=d) for d in chutes[:args.manifests]]
+    paths = [os.path.join(args.tmpdir, 'store%d.chute' % i) for i in range(len(objs))]
+    pairs = zip(objs, paths)
+    def run():
+        for c, p in pairs:
+            chute.storeManifest(c, p)
+    return run, len(objs)
+
+def caseLoadManifest(chutes, args):
+    paths = []
+    for i, d in enumerate(chutes[:args.manifests]):
+        p = os.path.join(args.tmpdir, 'load%d.chute' % i)
+        chute.storeManifest(Chute(descriptor=d), p)
+        paths.append(p)
+    return lambda: [chute.loadManifest(p, None) for p in paths], len(paths)
+
+def caseIterManifest(chutes, args):
+    # All the chutes in one JSON lines manifest
+    p = os.path.join(args.tmpdir, 'fleet.chutes')
+    chute.storeManifests([Chute(descriptor=d) for d in chutes], p)
+    return lambda: list(chute.iterManifest(p)), len(chutes)
+
+def casePdutilsCheck(chutes, args):
+    # The checks the client makes on each response
+    resp = fixtures.listChutesPayload(chutes)
+    def run():
+        pdutils.check(resp, dict, ["data"], valMatches={"response": "OK"})
+        for d in chutes:
+            pdutils.check(d, dict, ["name", "guid", "state"], valMatches={"struct": dict, "runtime": list})
+    return run, len(chutes) + 1
+
+CASES = [
+    ('json2str', caseJson2str),
+    ('str2json', caseStr2json),
+    ('Chute(descriptor)', caseChuteDescriptor),
+    ('Chute.merge', caseChuteMerge),
+    ('getAPIDataFormat', caseGetAPIDataFormat),
+    ('storeManifest', caseStoreManifest),
+    ('loadManifest', caseLoadManifest),
+    ('iterManifest', caseIterManifest),
+    ('pdutils.check', casePdutilsCheck),
+]
+
+###############################################################################
+def best(func, repeat):
+    """Fastest of @repeat runs of func(), in seconds."""
+    times = []
+    for i in range(repeat):
+        t = time.time()
+        func()
+        times.append(time.time() - t)
+    return min(times)
+
+def runCases(chutes, args, names=None):
+    """Returns a dict of case name: {'seconds', 'items', 'usPerItem'} for the cases in @names (all if None)."""
+    results = {}
+    for name, case in CASES:
+        if(names and name not in names):
+            continue
+        func, items = case(chutes, args)
+        s = best(func, args.repeat)
+        results[name] = {'seconds': s, 'items': items, 'usPerItem': s * 1e6 / items if items else None}
+    return results
+
+def fleetArgs(args):
+    """The args that change the work done, a comparison is only fair if these match."""
+    return {'aps': args.aps, 'chutes': args.chutes, 'seed': args.seed, 'manifests': args.manifests}
+
+def saveBaseline(path, results, args):
+    d = {'version': BASELINE_VERSION, 'time': time.time(), 'python': platform.python_version(),
+         'platform': platform.platform(), 'fleet': fleetArgs(args), 'results': results}
+    dirname = os.path.dirname(os.path.abspath(path))
+    if(not os.path.isdir(dirname)):
+        os.makedirs(dirname)
+    with open(path, 'w') as fd:
+        json.dump(d, fd, sort_keys=True, indent=4, separators=(',', ': '))
+        fd.write('\n')
+
+def loadBaseline(path):
+    """Returns the baseline dict saved at @path, None if missing or unreadable."""
+    try:
+        with open(path, 'r') as fd:
+            d = json.load(fd)
+    except (IOError, ValueError) as e:
+        out.err('!! %s Unable to load baseline %s: %s\n' % (logPrefix(), path, str(e)))
+        return None
+    if(d.get('version', None) != BASELINE_VERSION):
+        out.err('!! %s Baseline %s has version %s, expected %d\n' % (logPrefix(), path, d.get('version', None), BASELINE_VERSION))
+        return None
+    return d
+
+def compare(results, baseline, tolerance):
+    """
+        Compares the per item times of @results to @baseline.
+        Returns a list of (name, baseline us, current us, ratio, regressed) for the cases in both.
+    """
+    rows = []
+    base = baseline['results']
+    for name, case in CASES:
+        if(name not in results or name not in base):
+            continue
+        old = base[name]['usPerItem']
+        new = results[name]['usPerItem']
+        if(not old or new is None):
+            continue
+        ratio = new / old
+        rows.append((name, old, new, ratio, ratio > 1.0 + tolerance))
+    return rows
+
+def printResults(results, theOut=sys.stdout):
+    fmt = '%-18s %8s %10s %12s\n'
+    theOut.write(fmt % ('case', 'items', 'best s', 'us/item'))
+    for name, case in CASES:
+        if(name in results):
+            r = results[name]
+            theOut.write(fmt % (name, r['items'], '%.4f' % r['seconds'], '%.2f' % r['usPerItem']))
+
+def printComparison(rows, theOut=sys.stdout):
+    fmt = '%-18s %12s %12s %8s %s\n'
+    theOut.write(fmt % ('case', 'base us/item', 'now us/item', 'ratio', ''))
+    for name, old, new, ratio, regressed in rows:
+        if(regressed):
+            flag = 'REGRESSION'
+        else:
+            flag = ''
+        theOut.write(fmt % (name, '%.2f' % old, '%.2f' % new, '%.2fx' % ratio, flag))
+
+def setupArgParse():
+    p = argparse.ArgumentParser(description='Benchmarks of the JSON codec and the Chute model on a synthetic fleet')
+    p.add_argument('--aps', help='Number of APs in the fleet', type=int, default=50)
+    p.add_argument('--chutes', help='Number of chutes per AP', type=int, default=20)
+    p.add_argument('--seed', help='Seed the fleet is generated from', type=int, default=0)
+    p.add_argument('--manifests', help='Number of chutes to store/load manifests of', type=int, default=200)
+    p.add_argument('-r', '--repeat', help='Runs of each case, the fastest is reported', type=int, default=5)
+    p.add_argument('-k', '--case', help='Only run this case (can be given more than once)', action='append',
+            choices=[name for name, case in CASES])
+    p.add_argument('--baseline', help='Baseline file (default %(default)s)', type=str, default=DEFAULT_BASELINE)
+    p.add_argument('--save', help='Save the results as the baseline', action='store_true')
+    p.add_argument('--compare', help='Compare the results to the baseline, exit 1 on a regression', action='store_true')
+    p.add_argument('--tolerance', help='Fraction slower than the baseline a case may be before it counts as a regression',
+            type=float, default=0.25)
+    p.add_argument('--json', help='Print the results as JSON', action='store_true')
+    return p
+
+def main(argv=None):
+    args = setupArgParse().parse_args(argv)
+    # storeManifest talks about every file it overwrites
+    out.info = FakeOutput()
+
+    baseline = None
+    if(args.compare):
+        baseline = loadBaseline(args.baseline)
+        if(not baseline):
+            return 1
+        if(baseline['fleet'] != fleetArgs(args)):
+            out.warn('** %s Baseline was made with %s, not %s\n' % (logPrefix(), json.dumps(baseline['fleet'], sort_keys=True),
+                    json.dumps(fleetArgs(args), sort_keys=True)))
+
+    chutes = fixtures.allChutes(fixtures.makeFleet(args.aps, args.chutes, args.seed))
+    args.tmpdir = tempfile.mkdtemp(prefix='pdbench')
+    try:
+        results = runCases(chutes, args, args.case)
+    finally:
+        shutil.rmtree(args.tmpdir, True)
+
+    rows = []
+    if(baseline):
+        rows = compare(results, baseline, args.tolerance)
+    if(args.json):
+        sys.stdout.write(json.dumps({'fleet': fleetArgs(args), 'results': results,
+                'comparison': [dict(zip(('case', 'baseline', 'current', 'ratio', 'regressed'), r)) for r in rows]},
+                sort_keys=True) + '\n')
+    else:
+        sys.stdout.write('fleet: %d APs, %d chutes\n' % (args.aps, len(chutes)))
+        printResults(results)
+        if(rows):
+            printComparison(rows)
+
+    if(args.save):
+        saveBaseline(args.baseline, results, args)
+    if([r for r in rows if r[4]]):
+        return 1
+    return 0
+
+if(__name__ == "__main__"):
+    sys.exit(main())
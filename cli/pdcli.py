@@ -5,15 +5,25 @@
 
 import sys, argparse, re, traceback, collections, os, pickle
 from lib.paradrop import *
+from lib.paradrop import MSGPACK
 from lib.paradrop import chute
 from lib.paradrop import ap
 from lib.paradrop.api import client
+from lib.paradrop.api import upload
+from lib.paradrop.api import fleet
+from lib.paradrop.api import watcher
+from lib.paradrop.api import metrics
+from lib.paradrop.utils import pdperf
 
 def setupArgParse():
     p = argparse.ArgumentParser(description='Daemon for the ParaDrop Framework Control program which runs on routers')
     p.add_argument('-a', '--addr', help='Address to connect to', type=str, default='paradrop.org')
     p.add_argument('-p', '--port', help='Port to connect to', type=int, default=10000)
     p.add_argument('-g', '--guid', help='Developer GUID', type=str)
+    p.add_argument('--perf', help='Print timings of the commands and API calls every this many seconds', type=float, default=0)
+    p.add_argument('--events', help='File the last log messages are dumped to on a fatal error or crash (default: one in the temp dir)',
+            type=str, default=None)
+    p.add_argument('--events-size', help='Number of log messages kept for the dump, 0 to keep none', type=int, default=4096)
     return p
 
 def breakdown(a):
@@ -98,11 +108,9 @@ class PDCLI(object):
             for r, f, h, a in zip(self.regexes, self.funcs, self.helps, self.auths):
                 m = r.match(line)
                 if(m):
-                    if(a and self.loggedIn):
-                        return f(self.cmd, *m.groups())
-                    elif(a and not self.loggedIn):
+                    if(a and not self.loggedIn):
                         return self.cmd.outfd('Must be logged in to use this function\n')
-                    else:
+                    with pdperf.timer('cli.%s' % f.__name__):
                         return f(self.cmd, *m.groups())
         
             else:
@@ -150,6 +158,9 @@ class PDCommands:
         self.log = collections.deque([], 20)
         pdcli.cmd = self
         self.loggedIn = False
+        # Created on first use by fleetCall and the *WaitUpdate commands
+        self.fleetExec = None
+        self.watcher = None
         # These are the active objects which are manipulated to set new data
         # If a new chute is created, it is automatically loaded into the active chute
         # Otherwise, loaded from the list of aps/chutes in self.var
@@ -593,7 +604,7 @@ class PDCommands:
         else:
             self.outfd('Unable to determine extension type, supported: chute, py\n')
     
-    @pdcli.register('^chuteSave(.*)', help="Stores the chute definition to a local manifest file\n")
+    @pdcli.register('^chuteSave(.*)', help="Stores the chute definition to a local manifest file, add 'msgpack' to store it in binary\n")
     def chuteSave(self, chPath=None):
         if(not chPath):
             self.outfd('No path specified, please provide the path\n')
@@ -603,8 +614,16 @@ class PDCommands:
                 self.outfd('No Chute provided, define using "set activeChute"\n')
                 return
                 
-            chPath = chPath.lstrip()
-            if(chute.storeManifest(self.var['activeChute'], chPath)):
+            args = chPath.split()
+            chPath = args[0]
+            ser = None
+            if(len(args) > 1):
+                if(args[1] == 'msgpack'):
+                    ser = MSGPACK
+                elif(args[1] != 'json'):
+                    self.outfd('Unknown manifest format %s, supported: json, msgpack\n' % args[1])
+                    return
+            if(chute.storeManifest(self.var['activeChute'], chPath, ser)):
                 self.outfd('Error saving chute\n')
             else:
                 self.outfd('Saved\n')
@@ -719,6 +738,38 @@ class PDCommands:
         else:
             self.outfd('No Chute provided, define using "set activeChute"\n')
     
+    @pdcli.register('^chuteWaitUpdate(.*)', True, help="chuteWaitUpdate [seconds] - Wait for the pending update of the chute to finish\n")
+    def chuteWaitUpdate(self, timeout=None):
+        if('activeChute' in self.var):
+            self.waitUpdate(self.getWatcher().watchChute(self.var['activeChute'], timeout=self.parseTimeout(timeout)))
+        else:
+            self.outfd('No Chute provided, define using "set activeChute"\n')
+
+    @pdcli.register('^apWaitUpdate(.*)', True, help="apWaitUpdate [seconds] - Wait for the pending update of the AP to finish\n")
+    def apWaitUpdate(self, timeout=None):
+        if('activeAP' in self.var):
+            self.waitUpdate(self.getWatcher().watchAP(self.var['activeAP'], timeout=self.parseTimeout(timeout)))
+        else:
+            self.outfd('No AP provided, define using "set activeAP"\n')
+
+    def getWatcher(self):
+        if(not self.watcher):
+            self.watcher = watcher.UpdateWatcher(self.clt)
+        return self.watcher
+
+    def parseTimeout(self, timeout):
+        try:
+            return float(timeout)
+        except (TypeError, ValueError):
+            return None
+
+    def waitUpdate(self, f):
+        self.outfd('Waiting for update...\n')
+        try:
+            self.outfd('%s\n' % f.result())
+        except Exception as e:
+            self.outfd('Update did not finish: %s\n' % str(e))
+
     @pdcli.register('^sendFile (.*)', True, help="Transmit a file to the API server\n")
     def sendFile(self, name):
         if('activeChute' in self.var):
@@ -730,6 +781,44 @@ class PDCommands:
         else:
             self.outfd('No Chute provided, define using "set activeChute"\n')
 
+    @pdcli.register('^syncDir (.*)', True, help="Transmit only the files of a directory that changed since they were last sent\n")
+    def syncDir(self, path):
+        if('activeChute' in self.var):
+            results = self.clt.syncChuteDir(self.var['activeChute'], path.strip())
+            for name in sorted(results.keys()):
+                self.outfd('%s : %s\n' % (name, results[name]))
+        else:
+            self.outfd('No Chute provided, define using "set activeChute"\n')
+
+    @pdcli.register('^putDir (\S+) ?(\S*)$', True, help="putDir <dir> [destPath] - Stream a directory as a tar archive to the API server and add it to the files of the chute\n")
+    def putDir(self, path, destPath):
+        if('activeChute' in self.var):
+            ch = self.var['activeChute']
+            entries = self.clt.putChuteDir(ch, path, destPath or None, progress=upload.progressPrinter(path, self.outfd))
+            if(entries == True):
+                self.outfd('\nUnable to send directory\n')
+                return
+            self.outfd('\n')
+            for e in entries:
+                self.outfd('%s\n' % e)
+            # Keep the manifest of the chute in step with what was sent
+            if(isinstance(ch, chute.Chute)):
+                names = set([e['name'] for e in entries])
+                ch.files = [f for f in ch.files if f.get('name', None) not in names] + entries
+        else:
+            self.outfd('No Chute provided, define using "set activeChute"\n')
+
+    @pdcli.register('^getFile (\S+) (\S+)$', True, help="getFile <name> <localPath> - Download a file of the chute, resuming a partial download and checking its sha1\n")
+    def getFile(self, name, path):
+        if('activeChute' in self.var):
+            retVal = self.clt.getChuteFile(self.var['activeChute'], name, path, progress=upload.progressPrinter(name, self.outfd))
+            if(retVal == True):
+                self.outfd('\nUnable to get file\n')
+            else:
+                self.outfd('\nSaved "%s" to %s (%d bytes, sha1 %s)\n' % (name, retVal['path'], retVal['size'], retVal['sha1']))
+        else:
+            self.outfd('No Chute provided, define using "set activeChute"\n')
+
     @pdcli.register('^delFile (.*)', True, help="Delete a file from the API server\n")
     def delFile(self, name):
         if('activeChute' in self.var):
@@ -765,6 +854,54 @@ class PDCommands:
             self.outfd('No Chute provided, define using "set activeChute"\n')
     
  
+    @pdcli.register('^apiStats ?(\S*)$', False, help="apiStats [file] - Show the latency and errors of each API endpoint, or write them to file (.jsonl for JSON lines, otherwise Prometheus text)\n")
+    def apiStats(self, path):
+        if(path):
+            if(path.endswith('.jsonl')):
+                failed = metrics.appendJSONLines(self.clt.metrics, path)
+            else:
+                failed = metrics.writePrometheus(self.clt.metrics, path)
+            if(failed):
+                self.outfd('Unable to write stats to %s\n' % path)
+            return
+        stats = self.clt.stats()
+        for family in sorted(stats.keys()):
+            s = stats[family]
+            total = s['phases']['total']
+            p50 = (total['p50'] or 0) * 1000
+            p99 = (total['p99'] or 0) * 1000
+            self.outfd('%-24s calls: %5d  cached: %5d  p50: %8.2fms  p99: %8.2fms  codes: %s  errors: %s\n' %
+                    (family, s['calls'], s['cacheHits'], p50, p99, s['codes'], s['errors']))
+
+    @pdcli.register('^perfStats ?(\S*)$', False, help="perfStats [reset] - Show the time spent in each CLI command, client call and manifest load/store, or reset it\n")
+    def perfStats(self, arg):
+        if(arg == 'reset'):
+            pdperf.registry.reset()
+            return
+        snap = pdperf.registry.snapshot()
+        if(not snap):
+            self.outfd('Nothing timed yet\n')
+            return
+        self.outfd(pdperf.formatSummary(snap))
+
+    @pdcli.register('^fleetCall (\w+) (\w+)$', True, help="fleetCall <method> <var> - Call the client method for every AP/Chute in the list variable at once, stored to variable: results\n")
+    def fleetCall(self, method, name):
+        if(not isinstance(self.var.get(name, None), list)):
+            self.outfd('%s is not a list, use "apList" or "chuteList" to get one\n' % name)
+            return
+        if(not self.fleetExec):
+            self.fleetExec = fleet.FleetExecutor(self.clt)
+        
+        # Print each one as it comes back, but keep them in the original order
+        results = [None] * len(self.var[name])
+        for r in self.fleetExec.map(method, self.var[name]):
+            results[r.index] = r
+            if(r.error):
+                self.outfd('%r : Error %s\n' % (r.target, str(r.error)))
+            else:
+                self.outfd('%r : %s\n' % (r.target, r.result))
+        self.var['results'] = results
+
     #
     # Catch anything not matching anything else
     #
@@ -780,6 +917,12 @@ addr = args.addr
 port = args.port
 guid = args.guid
 
+# Keep the last messages of every stream in memory, written out on out.fatal or an uncaught exception
+if(args.events_size > 0):
+    ring = EventRing(args.events_size, args.events)
+    ring.attach()
+    ring.installExcepthook()
+
 if(not guid):
     if('DEVID' in os.environ):
         guid = os.environ['DEVID']
@@ -794,8 +937,10 @@ if(not guid):
 ###############################################################################
 url = 'http://%s:%s/v1/' % (addr, port)
 out.info('Connecting to API server: %s\n' % url)
-clt = client.ParaDropAPIClient(devid=guid, url=url)
+clt = client.ParaDropAPIClient(devid=guid, url=url, uploadRecord=upload.UploadRecord(upload.defaultRecordPath()))
 out.prompt = Stdout()
 pdcmd = PDCommands(sys.stdin, out.prompt, clt)
+if(args.perf):
+    pdperf.PerfReporter(interval=args.perf).start()
 
 pdcmd.run()
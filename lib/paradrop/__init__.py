@@ -7,11 +7,11 @@
     Primary entry point into the ParaDrop framework.
 """
 
-import sys, time, urllib, json
+import sys, time, urllib, json, re, threading, atexit, itertools, thread, tempfile, weakref
 import os as origOS
 import traceback
 
-__all__ = ['out', 'verbose', 'timeflt', 'timeint', 'logPrefix', 'Colors', 'Output', 'convertUnicode', 'Stdout', 'Stderr', 'urlEncodeMe', 'urlDecodeMe', 'json2str', 'str2json']
+__all__ = ['out', 'verbose', 'timeflt', 'timeint', 'logPrefix', 'Colors', 'Output', 'convertUnicode', 'LOGPREFIX', 'Stdout', 'Stderr', 'BufferedOutput', 'EventRing', 'RingOutput', 'urlEncodeMe', 'urlDecodeMe', 'json2str', 'str2json']
 
 timeflt = lambda: time.time()
 timeint = lambda: int(time.time())
@@ -21,17 +21,35 @@ def install(theOut):
     """Install a new out module."""
     __builtins__.out = theOut
 
+# The "MODULE.function" part of the logPrefix of each code object that has asked for one
+_prefixes = {}
+
+def _codeName(code):
+    """The "MODULE.function" of logPrefix() for @code."""
+    name = _prefixes.get(code, None)
+    if(name is None):
+        name = '%s.%s' % (origOS.path.basename(code.co_filename).split('.')[0].upper(), code.co_name)
+        _prefixes[code] = name
+    return name
+
+def _framePrefix(frame):
+    """logPrefix() for the function running in @frame."""
+    name = _codeName(frame.f_code)
+    if(verbose):
+        return '[%s(%d) @ %.2f]' % (name, frame.f_lineno, timeflt())
+    return '[%s @ %.2f]' % (name, timeflt())
+
 def logPrefix():
     """Setup a default logPrefix for any function that doesn't overwrite it."""
     # Who called us?
-    funcName = sys._getframe(1).f_code.co_name
-    modName = origOS.path.basename(sys._getframe(1).f_code.co_filename).split('.')[0].upper()
-    if(verbose):
-        line = "(%d)" % sys._getframe(1).f_lineno
-    else:
-        line = ""
-    
-    return '[%s.%s%s @ %.2f]' % (modName, funcName, line, timeflt())
+    return _framePrefix(sys._getframe(1))
+
+class _LogPrefix:
+    """Placeholder for the logPrefix() of the caller in the args of Output.lazy()."""
+    def __repr__(self):
+        return "<LOGPREFIX>"
+
+LOGPREFIX = _LogPrefix()
 
 def convertUnicode(elem):
     """Converts all unicode strings back into UTF-8 (str) so everything works.
@@ -85,21 +103,147 @@ def urlDecodeMe(elem):
     else:
         return elem
 
+# Anything urllib.quote(s, ' ') would change
+_needsQuote = re.compile('[^A-Za-z0-9_.\\- ]').search
+
+def _toJson(elem):
+    """urlEncodeMe(elem) for json2str, skipping the strings that need no quoting."""
+    t = type(elem)
+    if(t is str):
+        if(_needsQuote(elem)):
+            return urllib.quote(elem, ' ')
+        return elem
+    if(t is dict):
+        # Same keys inserted in the same order as urlEncodeMe so json.dumps writes them in the same order
+        return {_toJson(k): _toJson(v) for k, v in elem.iteritems()}
+    if(t is list):
+        return [_toJson(e) for e in elem]
+    if(isinstance(elem, (str, dict, list))):
+        return urlEncodeMe(elem)
+    return elem
+
+def _fromJson(elem, level):
+    """
+        Does the work of convertUnicode and urlDecodeMe for str2json in a single walk.
+        @level is how many convertUnicode passes the old str2json made over @elem, capped at 2: one per
+        enclosing dict plus one if the top level is a list. The first pass turns unicode into str, only a
+        later pass turns the str 'null' into None, and a top level unicode string was left alone.
+    """
+    t = type(elem)
+    if(t is dict):
+        if(level < 2):
+            level += 1
+        d = {}
+        for k, v in elem.iteritems():
+            d[_fromJson(k, level)] = _fromJson(v, level)
+        return d
+    if(t is list):
+        return [_fromJson(e, level) for e in elem]
+    if(t is unicode):
+        if(not level):
+            return elem
+        s = elem.encode('utf-8')
+        if(level > 1 and s == 'null'):
+            return None
+    elif(t is str):
+        s = elem
+        if(level and s == 'null'):
+            return None
+    else:
+        return elem
+    if('%' in s):
+        return urllib.unquote(s)
+    return s
+
 def json2str(j):
     """
         Properly converts and encodes all data related to the JSON object into a string format
         that can be transmitted through a network and stored properly in a database.
     """
-    return json.dumps(urlEncodeMe(j), separators=(',', ':'))
+    return json.dumps(_toJson(j), separators=(',', ':'))
 
 def str2json(s):
-    t = json.loads(s, object_hook=convertUnicode)
-    # If t is a list, object_hook was never called (by design of json.loads)
-    # deal with that situation here
-    if(isinstance(t, list)):
-        t = [convertUnicode(i) for i in t]
-    # Make sure to still decode any strings
-    return urlDecodeMe(t)
+    """
+        Decodes a string made by json2str, all unicode strings come back as UTF-8 (str) and are percent-decoded.
+        Same result as json.loads(s, object_hook=convertUnicode) followed by urlDecodeMe, in one pass.
+    """
+    return _fromJsonDoc(json.loads(s))
+
+def _fromJsonDoc(t):
+    """The str2json conversion of the already parsed JSON document @t, a top level list starts a level deeper."""
+    if(type(t) is list):
+        return _fromJson(t, 1)
+    return _fromJson(t, 0)
+
+class Serializer:
+    """
+        Interface class of an encoding for the API payloads and manifests, registered by the content type it is sent as.
+        dumps(obj) returns the encoded str, loads(s) decodes one. @binary is True if the encoded str is not text.
+    """
+    contentType = None
+    binary = False
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.contentType)
+
+    def dumps(self, obj):
+        pass
+
+    def loads(self, s):
+        pass
+
+class JSONSerializer(Serializer):
+    """The default, json2str/str2json."""
+    contentType = 'application/json'
+
+    def dumps(self, obj):
+        return json2str(obj)
+
+    def loads(self, s):
+        return str2json(s)
+
+class MsgPackSerializer(Serializer):
+    """Compact binary encoding, see utils.pdpack (imported on first use, it is not needed to load the package)."""
+    contentType = 'application/x-msgpack'
+    binary = True
+
+    def dumps(self, obj):
+        from lib.paradrop.utils import pdpack
+        return pdpack.packb(obj)
+
+    def loads(self, s):
+        from lib.paradrop.utils import pdpack
+        return pdpack.unpackb(s)
+
+    def isPacked(self, data):
+        from lib.paradrop.utils import pdpack
+        return pdpack.isPacked(data)
+
+_serializers = {}
+
+def registerSerializer(ser):
+    """Make the Serializer @ser available to getSerializer() under its content type."""
+    _serializers[ser.contentType] = ser
+
+def getSerializer(contentType=None):
+    """
+        Returns the Serializer for the @contentType header value (parameters like charset are ignored),
+        the JSON one if @contentType is None, or None if nothing is registered for it.
+    """
+    if(not contentType):
+        return JSON
+    return _serializers.get(contentType.split(';')[0].strip().lower(), None)
+
+def sniffSerializer(data):
+    """Returns the Serializer @data (a dict or list) was encoded with, for files that don't say."""
+    if(MSGPACK.isPacked(data)):
+        return MSGPACK
+    return JSON
+
+JSON = JSONSerializer()
+MSGPACK = MsgPackSerializer()
+registerSerializer(JSON)
+registerSerializer(MSGPACK)
 
 def printme(*args):
     funcName = sys._getframe(1).f_code.co_name
@@ -197,10 +341,305 @@ class Stderr(IOutput):
                 obj = item 
                 obj(args)
 
+# Every BufferedOutput still in use, one exit hook writes out what they have queued
+_bufferedOutputs = weakref.WeakSet()
+
+def _closeBufferedOutputs():
+    for b in list(_bufferedOutputs):
+        b.close()
+
+atexit.register(_closeBufferedOutputs)
+
+def _wake(cond):
+    with cond:
+        cond.notify_all()
+
+def _runBufferedOutput(ref, cond):
+    """Writer thread of a BufferedOutput, it only holds on to it while there is something to write."""
+    while(True):
+        with cond:
+            while(True):
+                b = ref()
+                if(b is None):
+                    return
+                if(b._queue or b._closed):
+                    break
+                # Let go of it while idle so it can be freed
+                b = None
+                cond.wait()
+        if(not b._writeBatch()):
+            return
+        b = None
+
+class BufferedOutput(IOutput):
+    """
+        Like Stdout/Stderr, but the messages are queued and a background thread writes them in batches,
+        so the caller never waits on the terminal or pipe. Everything still queued is written by close() or at exit.
+        Arguments:
+            @theFile         : file object written to, sys.stdout if None
+            @color           : same as Stdout
+            @other_out_types : same as Stdout, they are called from the writer thread
+            @maxBuffer       : most messages held at once
+            @block           : when @maxBuffer are held, True makes the caller wait for room,
+                               False drops the message (counted in @dropped and reported in the output)
+            @flushSize       : bytes held before they are written without waiting for @flushInterval
+            @flushInterval   : seconds the first message of a batch waits for others to join it
+    """
+    def __init__(self, theFile=None, color=None, other_out_types=None, maxBuffer=10000, block=False,
+            flushSize=64 * 1024, flushInterval=0.1):
+        self.theFile = theFile or sys.stdout
+        self.color = color
+        if(other_out_types and type(other_out_types) is not list):
+            other_out_types = [other_out_types]
+        self.other_out = other_out_types
+        self.maxBuffer = maxBuffer
+        self.block = block
+        self.flushSize = flushSize
+        self.flushInterval = flushInterval
+        self.dropped = 0
+        self._reported = 0
+        self._queue = []
+        self._pending = 0
+        self._queued = 0
+        self._written = 0
+        self._flushNow = False
+        self._closed = False
+        self._cond = threading.Condition()
+        # The thread only gets a weak reference, the callback wakes it to exit once this is freed
+        ref = weakref.ref(self, lambda r, cond=self._cond: _wake(cond))
+        self._thread = threading.Thread(target=_runBufferedOutput, args=(ref, self._cond), name="pdoutput")
+        self._thread.daemon = True
+        self._thread.start()
+        _bufferedOutputs.add(self)
+
+    def __repr__(self):
+        return "<BufferedOutput %s %d queued %d dropped>" % (getattr(self.theFile, 'name', '?'), len(self._queue), self.dropped)
+
+    def __call__(self, args):
+        # Make sure args is a str type
+        if(not isinstance(args, str)):
+            args = str(args)
+        with self._cond:
+            if(not self._closed):
+                while(len(self._queue) >= self.maxBuffer and not self._closed):
+                    if(not self.block):
+                        self.dropped += 1
+                        return
+                    self._cond.wait()
+            if(not self._closed):
+                self._queue.append(args)
+                self._queued += 1
+                self._pending += len(args)
+                if(self._pending >= self.flushSize or len(self._queue) == 1):
+                    self._cond.notify_all()
+                return
+        # Once closed there is no thread left to write it
+        self._write([args])
+
+    def _write(self, batch):
+        if(self.color):
+            s = ''.join([self.color + m + Colors.END for m in batch])
+        else:
+            s = ''.join(batch)
+        try:
+            self.theFile.write(s)
+            self.theFile.flush()
+        except (IOError, ValueError):
+            # Nowhere left to report it
+            pass
+        if(self.other_out):
+            for m in batch:
+                for item in self.other_out:
+                    item(m)
+
+    def _writeBatch(self):
+        """Write out what is queued, returns False once closed and there is nothing more to write."""
+        with self._cond:
+            # Let the batch fill up unless it is big enough or someone is waiting on it
+            deadline = time.time() + self.flushInterval
+            while(self._pending < self.flushSize and not self._flushNow and not self._closed):
+                left = deadline - time.time()
+                if(left <= 0):
+                    break
+                self._cond.wait(left)
+            batch = self._queue
+            self._queue = []
+            self._pending = 0
+            self._flushNow = False
+            closed = self._closed
+            dropped = self.dropped - self._reported
+            self._reported = self.dropped
+            # There is room again for callers waiting on a full buffer
+            self._cond.notify_all()
+
+        if(dropped):
+            batch.append('** %d messages dropped, output buffer full\n' % dropped)
+        if(batch):
+            self._write(batch)
+        with self._cond:
+            self._written += len(batch) - bool(dropped)
+            self._cond.notify_all()
+        return not closed
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far has been written, returns False if @timeout seconds passed first."""
+        if(threading.current_thread() is self._thread):
+            return True
+        end = None
+        if(timeout is not None):
+            end = time.time() + timeout
+        with self._cond:
+            target = self._queued
+            self._flushNow = True
+            self._cond.notify_all()
+            while(self._written < target and self._thread.is_alive()):
+                if(end is None):
+                    self._cond.wait()
+                else:
+                    left = end - time.time()
+                    if(left <= 0):
+                        return False
+                    self._cond.wait(left)
+        return True
+
+    def close(self):
+        """Write everything still queued and stop the writer thread, later messages are written as they come."""
+        with self._cond:
+            if(self._closed):
+                return
+            self._closed = True
+            self._cond.notify_all()
+        _bufferedOutputs.discard(self)
+        if(threading.current_thread() is not self._thread):
+            self._thread.join()
+
+# So the output classes can find the code that called out.<stream>() past our own frames
+_THIS_FILE = sys._getframe().f_code.co_filename
+
+class EventRing:
+    """
+        Keeps the last @size messages sent to its RingOutput streams as structured events in memory,
+        to be written out as JSON lines with dump() when something goes wrong.
+        The slots are allocated up front and filled without a lock, recording an event does no I/O.
+            Arguments:
+                @size : number of events kept, older ones are overwritten
+                @path : file dump() writes to by default, a file in the temp dir named after the pid if None
+    """
+    def __init__(self, size=4096, path=None):
+        self.size = size
+        if(not path):
+            path = origOS.path.join(tempfile.gettempdir(), 'paradrop-%d.events.jsonl' % origOS.getpid())
+        self.path = path
+        self._events = [None] * size
+        self._counter = itertools.count()
+        self._dumpLock = threading.Lock()
+        self._prevHook = None
+
+    def __repr__(self):
+        return "<EventRing %d slots -> %s>" % (self.size, self.path)
+
+    def record(self, stream, msg, where=None):
+        """Add an event for @msg sent to @stream by the function @where ("MODULE.function")."""
+        # next() on a count is atomic, so every thread gets its own slot
+        n = next(self._counter)
+        self._events[n % self.size] = (n, timeflt(), thread.get_ident(), stream, where, msg)
+
+    def events(self):
+        """The events held, oldest first, as dicts."""
+        evs = sorted([e for e in list(self._events) if e is not None])
+        return [{'seq': n, 'time': t, 'thread': tid, 'stream': st, 'where': w, 'msg': m} for n, t, tid, st, w, m in evs]
+
+    def dump(self, path=None):
+        """
+            Write the events held to @path (or @path given to the ring) as JSON lines, replacing what is there.
+            Returns the path written, None in failure.
+        """
+        path = path or self.path
+        with self._dumpLock:
+            try:
+                with open(path, 'w') as fd:
+                    for e in self.events():
+                        if(isinstance(e['msg'], str)):
+                            e['msg'] = e['msg'].decode('utf-8', 'replace')
+                        fd.write(json.dumps(e, sort_keys=True) + '\n')
+                return path
+            except (IOError, OSError) as e:
+                sys.stderr.write('!! Unable to dump events to %s: %s\n' % (path, str(e)))
+                return None
+
+    def stream(self, name, other_out_types=None, dump=False):
+        """Returns a RingOutput recording into this ring as the @name stream."""
+        return RingOutput(self, name, other_out_types, dump)
+
+    def attach(self, theOut=None, dumpOn=('fatal',), disabled=False):
+        """
+            Record every stream defined on @theOut (out if None) into this ring, the messages still go
+            to the original streams too. The ring is dumped after each message to a stream in @dumpOn.
+            Streams that throw their messages away are left alone so Output.lazy() still skips them,
+            unless @disabled is True to record them as well.
+        """
+        if(theOut is None):
+            theOut = out
+        for name, stream in theOut.__dict__.items():
+            if(not isinstance(stream, IOutput) or isinstance(stream, RingOutput)):
+                continue
+            if(isinstance(stream, FakeOutput)):
+                if(not disabled):
+                    continue
+                other = None
+            else:
+                other = [stream]
+            setattr(theOut, name, self.stream(name, other, name in dumpOn))
+
+    def installExcepthook(self):
+        """Record and dump the traceback of an uncaught exception before the previous sys.excepthook runs."""
+        self._prevHook = sys.excepthook
+        def _hook(etype, value, tb):
+            try:
+                self.record('crash', ''.join(traceback.format_exception(etype, value, tb)))
+                self.dump()
+            finally:
+                self._prevHook(etype, value, tb)
+        sys.excepthook = _hook
+
+class RingOutput(IOutput):
+    """
+        Records each message into the EventRing @ring as an event of the @name stream, along with the
+        time, thread and the MODULE.function that sent it, then passes it on to @other_out_types as Stdout does.
+        If @dump is set the ring is dumped after every message, meant for out.fatal.
+    """
+    def __init__(self, ring, name, other_out_types=None, dump=False):
+        self.ring = ring
+        self.name = name
+        if(other_out_types and type(other_out_types) is not list):
+            other_out_types = [other_out_types]
+        self.other_out = other_out_types
+        self.dump = dump
+
+    def __repr__(self):
+        return "<RingOutput %s>" % self.name
+
+    def __call__(self, args):
+        if(not isinstance(args, str)):
+            args = str(args)
+        # Skip Output.lazy() and any Stdout/Stderr passing it on to find who sent it
+        f = sys._getframe(1)
+        while(f.f_back and f.f_code.co_filename == _THIS_FILE):
+            f = f.f_back
+        self.ring.record(self.name, args, _codeName(f.f_code))
+        if self.other_out:
+            for item in self.other_out:
+                item(args)
+        if(self.dump):
+            self.ring.dump()
+
 class FakeOutput(IOutput):
     def __call__(self, args):
         pass
 
+# Every stream nobody defined is this one, so checking for it is cheap
+FAKE_OUTPUT = FakeOutput()
+
 class Output():
     """
         Class that allows stdout/stderr trickery.
@@ -229,6 +668,10 @@ class Output():
         Currently these are the choices for Output classes:
             - StdoutOutput() : output sent to sys.stdout
             - StderrOutput() : output sent to sys.stderr
+
+        Building a message for a stream that throws it away still costs the formatting and the logPrefix,
+        in hot code use lazy() which only does that work if the stream is live:
+            out.lazy('verbose', '-- %s Merged %d keys of %s\n', LOGPREFIX, len(d), ch)
     """
             
     def __init__(self, **kwargs):
@@ -239,7 +682,27 @@ class Output():
     def __getattr__(self, name):
         """Catch attribute access attempts that were not defined in __init__
             by default throw them out."""
-        return FakeOutput()
+        return FAKE_OUTPUT
+
+    def isLive(self, name):
+        """False if the @name stream throws its messages away, so the caller can skip building them."""
+        return not isinstance(self.__dict__.get(name, FAKE_OUTPUT), FakeOutput)
+
+    def lazy(self, name, fmt, *args):
+        """
+            Send fmt % args to the @name stream, the formatting is only done if the stream is live.
+            Any LOGPREFIX in @args is replaced by the logPrefix() of the caller.
+        """
+        stream = self.__dict__.get(name, FAKE_OUTPUT)
+        if(isinstance(stream, FakeOutput)):
+            return
+        if([a for a in args if a is LOGPREFIX]):
+            prefix = _framePrefix(sys._getframe(1))
+            args = tuple([prefix if a is LOGPREFIX else a for a in args])
+        if(args):
+            stream(fmt % args)
+        else:
+            stream(fmt)
 
     def __setattr__(self, name, val):
         """Allow the program to add new output streams on the fly."""
@@ -251,7 +714,7 @@ class Output():
 # Create a standard out module to be used if no one overrides it
 out = Output(
             header=Stdout(Colors.HEADER),
-            verbose=FakeOutput(),
+            verbose=FAKE_OUTPUT,
             info=Stdout(Colors.INFO),
             perf=Stdout(Colors.PERF),
             warn=Stdout(Colors.WARN),
@@ -11,15 +11,19 @@ from lib.paradrop.pderror import PDError
 REQUIRED_AP_KEYS = ["name", "guid"]
 
 
-class AP:
+class AP(object):
     """
         Wrapper class for AP objects.
+        Uses slots rather than a __dict__, like Chute.
     """
+    __slots__ = ('name', 'guid', 'contact', 'devinfo')
 
-    def __init__(self, name="", guid="", contact="", devinfo={}, descriptor=None):
+    def __init__(self, name="", guid="", contact="", devinfo=None, descriptor=None):
         self.name = name
         self.guid = guid
         self.contact = contact
+        if(devinfo is None):
+            devinfo = {}
         self.devinfo = devinfo
         
         if(descriptor):
@@ -28,6 +32,14 @@ class AP:
             self.setObject('contact', descriptor)
             self.setObject('devinfo', descriptor, dict)
     
+    def __getstate__(self):
+        return dict([(k, getattr(self, k)) for k in self.__slots__ if hasattr(self, k)])
+
+    def __setstate__(self, state):
+        for k, v in state.iteritems():
+            if(k in self.__slots__):
+                setattr(self, k, v)
+
     def setObject(self, attr, data, jsonize=None):
         if(attr in data.keys()):
             d = data[attr]
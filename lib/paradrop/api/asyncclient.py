@@ -0,0 +1,85 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Non-blocking front end to the ParaDropAPIClient.
+
+    Every API call returns a Future right away and runs on a bounded pool of worker threads,
+    so calls against many APs and chutes are in flight at the same time instead of one after the other.
+"""
+
+import time
+
+from lib.paradrop import *
+from lib.paradrop.api.client import ParaDropAPIClient, API_CALLS
+from lib.paradrop.api.pool import HTTPConnectionPool, DEFAULT_IDLE_TIMEOUT
+from lib.paradrop.utils.pdfuture import WorkerPool, asCompleted, gather
+
+DEFAULT_CONCURRENCY = 8
+
+class AsyncParaDropAPIClient:
+    """
+        Future based client with the same calls as ParaDropAPIClient.
+        Each call takes the same arguments as the blocking version plus an optional @timeout keyword,
+        and returns a Future whose result() is what the blocking call would have returned (or raises what it raised).
+            Arguments:
+                @concurrency : maximum number of calls in flight at once
+                @timeout     : default seconds before a call times out, also used as the socket timeout, None to wait forever
+                @client      : an existing ParaDropAPIClient to share (session, connections), if None one is created
+                               using @clientArgs with a connection pool large enough for @concurrency
+    """
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, timeout=None, client=None, **clientArgs):
+        self.timeout = timeout
+        if(client):
+            self.client = client
+        else:
+            if('pool' not in clientArgs):
+                clientArgs['pool'] = HTTPConnectionPool(concurrency, clientArgs.pop('idleTimeout', DEFAULT_IDLE_TIMEOUT), timeout)
+            self.client = ParaDropAPIClient(**clientArgs)
+        self.workers = WorkerPool(concurrency, "pdasync")
+        self._pending = set()
+
+    def __repr__(self):
+        return "<AsyncParaDropAPIClient %d pending, %r>" % (len(self._pending), self.workers)
+
+    def call(self, name, *args, **kwargs):
+        """
+            Run the ParaDropAPIClient method @name on the worker pool, returns a Future.
+            The keyword @timeout overrides the default timeout for this call.
+        """
+        timeout = kwargs.pop('timeout', self.timeout)
+        if(timeout is not None):
+            kwargs['_deadline'] = time.time() + timeout
+        f = self.workers.submit(getattr(self.client, name), *args, **kwargs)
+        self._pending.add(f)
+        f.addDoneCallback(self._pending.discard)
+        return f
+
+    def cancelAll(self):
+        """Cancel every call that has not started running yet, returns how many were cancelled."""
+        return len([f for f in list(self._pending) if f.cancel()])
+
+    def asCompleted(self, futures, timeout=None):
+        """Yields the futures as each one finishes."""
+        return asCompleted(futures, timeout)
+
+    def gather(self, futures, timeout=None):
+        """Wait for all the futures, returns a list of their results in the same order."""
+        return gather(futures, timeout)
+
+    def close(self, wait=True):
+        """Stop the workers once the queued calls are done and close the connections."""
+        self.workers.shutdown(wait)
+        self.client.close()
+
+def _asyncMethod(name):
+    def _call(self, *args, **kwargs):
+        return self.call(name, *args, **kwargs)
+    _call.__name__ = name
+    _call.__doc__ = "Future returning version of ParaDropAPIClient.%s:\n%s" % (name, getattr(ParaDropAPIClient, name).__doc__)
+    return _call
+
+for _name in API_CALLS:
+    setattr(AsyncParaDropAPIClient, _name, _asyncMethod(_name))
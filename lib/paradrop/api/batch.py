@@ -0,0 +1,185 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Client side batching of API calls.
+
+    Calls made through a BatchQueue are collected and sent to the server as a single batch envelope,
+    the per call responses (and pdapi error codes) are handed back to each caller from the envelope response.
+        Request:  {"requests": [{"id": .., "method": .., "httpMethod": .., "body": ..}, ...]}
+        Response: {"response": "OK", "data": [{"id": .., "code": .., "msg": .., "body": ..}, ...]}
+"""
+
+import time, threading, itertools
+
+from lib.paradrop import *
+from lib.paradrop.api import pdapi
+from lib.paradrop.api.pdapi import PDAPIError
+from lib.paradrop.utils import pdutils
+from lib.paradrop.utils.pdfuture import Future, WorkerPool
+
+BATCH_METHOD = "batch"
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_BATCH_DELAY = 0.05
+
+class BatchQueue:
+    """
+        Queues API calls and sends them in batch envelopes.
+        An envelope is sent once @maxSize calls are waiting or the oldest one has waited @maxDelay seconds.
+        Any ParaDropAPIClient call can be made on the queue (ie queue.enableChute(ch)), it returns a Future of what
+        the client call returns. Use it as a context manager, or call close(), to send whatever is left.
+            Arguments:
+                @client   : the ParaDropAPIClient whose session and connections are used
+                @maxSize  : most calls put in one envelope
+                @maxDelay : most seconds a call waits for others to join its envelope
+                @workers  : number of client calls which can wait on envelopes at once, defaults to @maxSize
+    """
+    def __init__(self, client, maxSize=DEFAULT_BATCH_SIZE, maxDelay=DEFAULT_BATCH_DELAY, workers=None):
+        self.client = client
+        self.maxSize = maxSize
+        self.maxDelay = maxDelay
+        self.workers = WorkerPool(workers or maxSize, "pdbatch")
+        self.senders = WorkerPool(2, "pdbatch-send")
+        self._cond = threading.Condition()
+        self._items = []
+        self._first = None
+        self._ids = itertools.count()
+        self._thread = None
+        self._closed = False
+        self.envelopes = 0
+        self.calls = 0
+
+    def __repr__(self):
+        return "<BatchQueue %d calls in %d envelopes, %d waiting>" % (self.calls, self.envelopes, len(self._items))
+
+    def __getattr__(self, name):
+        """Client calls made on the queue are submitted to it."""
+        client = self.__dict__.get('client', None)
+        if(name.startswith('_') or not callable(getattr(client, name, None))):
+            raise AttributeError(name)
+        def _call(*args, **kwargs):
+            return self.submit(name, *args, **kwargs)
+        _call.__name__ = name
+        return _call
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, value, tb):
+        self.close()
+        return False
+
+    def submit(self, name, *args, **kwargs):
+        """Run client.name(*args, **kwargs) with its request batched, returns a Future of its result."""
+        return self.workers.submit(self._runCall, name, args, kwargs)
+
+    def _runCall(self, name, args, kwargs):
+        # sendRequest looks for the queue on the client, per thread, to know it should batch
+        self.client._batch.queue = self
+        try:
+            return getattr(self.client, name)(*args, **kwargs)
+        finally:
+            self.client._batch.queue = None
+
+    def enqueue(self, method, body, httpMethod=None):
+        """Queue a single request for the next envelope, returns a Future of (code, msg, response object)."""
+        f = Future()
+        item = {'id': next(self._ids), 'method': method, 'httpMethod': httpMethod, 'body': body}
+        with self._cond:
+            if(self._closed):
+                raise PDAPIError(method, "Batch queue has been closed")
+            if(not self._items):
+                self._first = time.time()
+            self._items.append((item, f))
+            self.calls += 1
+            if(not self._thread):
+                self._thread = threading.Thread(target=self._run, name="pdbatch-flush")
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+        return f
+
+    def _take(self):
+        """Take the next envelope worth of calls off the queue (caller holds the lock)."""
+        batch = self._items[:self.maxSize]
+        self._items = self._items[self.maxSize:]
+        if(self._items):
+            self._first = time.time()
+        else:
+            self._first = None
+        return batch
+
+    def _run(self):
+        """Flush thread, sends an envelope once it is full or its oldest call has waited long enough."""
+        while(True):
+            with self._cond:
+                while(not self._closed and (not self._items or
+                        (len(self._items) < self.maxSize and time.time() - self._first < self.maxDelay))):
+                    if(self._items):
+                        self._cond.wait(self.maxDelay - (time.time() - self._first))
+                    else:
+                        self._cond.wait(60)
+                if(not self._items):
+                    return
+                batch = self._take()
+            self.senders.submit(self._send, batch)
+
+    def flush(self):
+        """Send everything queued right now from this thread."""
+        with self._cond:
+            batches = []
+            while(self._items):
+                batches.append(self._take())
+        for batch in batches:
+            self._send(batch)
+
+    def _send(self, batch):
+        """Send one envelope and hand each response back to the Future of its call."""
+        start = time.time()
+        try:
+            envelope = {'requests': [item for item, f in batch]}
+            try:
+                body, headers = self.client.encodeBody(envelope, self.client.buildHeaders())
+                resp = self.client._transport(BATCH_METHOD, 'POST', self.client.baseUrl + BATCH_METHOD, body, headers, True)
+            except Exception as e:
+                for item, f in batch:
+                    f.setException(e)
+                return
+            self.envelopes += 1
+
+            # The envelope as a whole failed, so does every call in it
+            if(resp.status < 200 or resp.status >= 300):
+                for item, f in batch:
+                    f.setResult((resp.status, resp.reason, None))
+                return
+
+            try:
+                data = self.client.decodeResponse(resp.headers, resp.data)
+            except Exception as e:
+                data = None
+            res = pdutils.check(data, dict, ["data"])
+            if(res or not isinstance(data['data'], list)):
+                for item, f in batch:
+                    f.setResult((pdapi.ERR_BADFORMAT, "Bad batch response", None))
+                return
+
+            byId = dict([(r.get('id', None), r) for r in data['data'] if isinstance(r, dict)])
+            for item, f in batch:
+                r = byId.get(item['id'], None)
+                if(r is None):
+                    f.setResult((pdapi.ERR_CONTACTPD, "Missing from batch response", None))
+                else:
+                    f.setResult((r.get('code', pdapi.ERR_CONTACTPD), r.get('msg', None), r.get('body', None)))
+        finally:
+            self.client.metrics.call(BATCH_METHOD, time.time() - start)
+
+    def close(self):
+        """Wait for the submitted calls to finish, sending the envelopes they are waiting on, then stop."""
+        self.workers.shutdown(True)
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+        self.senders.shutdown(True)
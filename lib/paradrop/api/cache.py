@@ -0,0 +1,114 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Client side cache of the responses to the read only API calls.
+"""
+
+import time, threading, collections
+
+from lib.paradrop import *
+from lib.paradrop.api import pdapi
+
+DEFAULT_CACHE_SIZE = 256
+
+# Seconds each endpoint family stays cached, anything not listed is never cached
+DEFAULT_TTLS = {
+    "ap/*/info": 30,
+    "ap/*/list": 10,
+    "chute/*/info": 30,
+    "chute/*/data": 10,
+    "chute/*/files": 10,
+}
+
+class ResponseCache:
+    """
+        Bounded LRU cache of raw response bodies keyed by the API method path.
+        The raw body is kept (not the decoded object) so every hit hands out a fresh copy the caller is free to change.
+            Arguments:
+                @maxSize : maximum number of responses held, the least recently used is evicted first
+                @ttls    : dict of endpoint family (see pdapi.endpointFamily) to seconds, defaults to DEFAULT_TTLS
+    """
+    def __init__(self, maxSize=DEFAULT_CACHE_SIZE, ttls=None):
+        self.maxSize = maxSize
+        if(ttls is None):
+            ttls = DEFAULT_TTLS
+        self.ttls = dict(ttls)
+        self._lock = threading.Lock()
+        # Maps method to (expires, body) with the most recently used at the end
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __repr__(self):
+        return "<ResponseCache %d/%d entries, %d hits, %d misses>" % (len(self._entries), self.maxSize, self.hits, self.misses)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def isCacheable(self, method):
+        """Returns True if responses for @method have a TTL."""
+        return pdapi.endpointFamily(method) in self.ttls
+
+    def get(self, method):
+        """Returns the cached body for @method or None if missing or expired."""
+        with self._lock:
+            e = self._entries.pop(method, None)
+            if(e is None):
+                self.misses += 1
+                return None
+            expires, body = e
+            if(time.time() > expires):
+                self.misses += 1
+                return None
+            # Put it back at the end as the most recently used
+            self._entries[method] = e
+            self.hits += 1
+            return body
+
+    def put(self, method, body):
+        """Store the body for @method if its endpoint family has a TTL."""
+        ttl = self.ttls.get(pdapi.endpointFamily(method), None)
+        if(not ttl):
+            return
+        with self._lock:
+            self._entries.pop(method, None)
+            self._entries[method] = (time.time() + ttl, body)
+            while(len(self._entries) > self.maxSize):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _drop(self, match):
+        """Remove every entry where match(method) is True (caller holds the lock)."""
+        for k in [k for k in self._entries.keys() if match(k)]:
+            del(self._entries[k])
+            self.invalidations += 1
+
+    def invalidate(self, method):
+        """
+            Called for a mutating API call, drops every cached response it could have changed:
+                - sign in/out drops everything since the responses belong to the old session
+                - a chute call drops everything about that chute, plus the AP chute lists it shows up in
+                - an AP call drops everything about that AP
+        """
+        kind, guid, action = pdapi.splitMethod(method)
+        with self._lock:
+            if(kind == 'auth' or not guid):
+                self._drop(lambda k: True)
+            elif(kind == 'chute'):
+                self._drop(lambda k: guid in k or pdapi.endpointFamily(k) == 'ap/*/list')
+            else:
+                self._drop(lambda k: guid in k)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns a dict of the cache counters."""
+        return {'size': len(self._entries), 'maxSize': self.maxSize, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'invalidations': self.invalidations}
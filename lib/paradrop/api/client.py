@@ -3,32 +3,135 @@
 # Authors: The Paradrop Team
 ###################################################################
 
-import urllib2, sys, time, json, base64, mmap, os, md5
+import urllib2, httplib, socket, threading, sys, time, json, base64, mmap, os, md5, hashlib, email.utils
 
 from lib.paradrop import *
+from lib.paradrop import JSON, MSGPACK, getSerializer, sniffSerializer
 from lib.paradrop.ap import AP
 from lib.paradrop.chute import Chute
 from lib.paradrop.utils import pdutils
+from lib.paradrop.utils import pdperf
 from lib.paradrop.api import pdapi
 from lib.paradrop.api.pdapi import PDAPIError
+from lib.paradrop.api.pool import HTTPConnectionPool, DEFAULT_POOL_SIZE, DEFAULT_IDLE_TIMEOUT
+from lib.paradrop.api.upload import FileBodyStream, Base64BodyStream, TarBodyStream, UploadRecord, DEFAULT_BLOCK_SIZE
+from lib.paradrop.utils.pdfuture import WorkerPool
+from lib.paradrop.api.retry import NO_RETRY
+from lib.paradrop.api.batch import BatchQueue, DEFAULT_BATCH_SIZE, DEFAULT_BATCH_DELAY
+from lib.paradrop.api.metrics import APIMetrics, errorName
+from lib.paradrop.api.compress import gzipCompress, CompressionStats, DEFAULT_COMPRESS_THRESHOLD
+from lib.paradrop.api.jsonstream import JSONArrayStream
 
 APISERVER = 'http://paradrop.org:10000/v1/'
 
+# The public API calls of ParaDropAPIClient, used by the wrappers that run them in other ways
+API_CALLS = [
+    'signin', 'signout',
+    'getApList', 'setApInfo', 'getApInfo', 'getAPStatus', 'getAPUpdate', 'resetAP', 'listChutes', 'createChute',
+    'deleteChute', 'getChuteInfo', 'getChuteData', 'setChuteData', 'setChuteInfo', 'enableChute', 'disableChute',
+    'freezeChute', 'unfreezeChute', 'getChuteStatus', 'getChuteUpdate',
+    'putChuteFile', 'putChuteDir', 'getChuteFile', 'deleteChuteFile', 'getStatsChuteFile', 'listChuteFiles', 'syncChuteDir',
+]
+
 class ParaDropAPIClient:
     """
         Stub class to gain access to ParaDrop API server.
+        Out of the box it sends the same requests a client without the retry, gzip, MessagePack and PATCH support
+        would, so an older server or a proxy in between sees no change, each of those has to be turned on.
             Arguments:
                 @uname:        username of the developer
                 @passwd:       cleartext password of the developer
                 @devid:        UUID associated with developers account, if unknown it is looked up via API
                 @sessionToken: the most recent sessionToken for this user, if None then one is Authorized via API
+                @pool:         HTTPConnectionPool to send requests through, if None then the client creates its own
+                @poolSize:     number of keep-alive connections held per host when creating our own pool
+                @idleTimeout:  seconds before an idle keep-alive connection is evicted when creating our own pool
+                @uploadRecord: UploadRecord of the files sent to each chute, if None one is kept in memory
+                @cache:        ResponseCache to serve repeated read only calls from, None (default) to always ask the server
+                @retry:        RetryPolicy for failed requests, None (default) is retry.NO_RETRY, RetryPolicy() for the usual one
+                @breakers:     CircuitBreakers to fail fast on endpoints that keep failing, None (default) to always send
+                @compress:     ask the server for gzip encoded responses, False (default) to not
+                @compressThreshold: request bodies at least this many bytes are gzip encoded
+                @compressRequests:  True/False to always/never gzip request bodies, None (default) only once the
+                                    server has sent us a gzip response, so we know it understands gzip
+                @metrics:      APIMetrics to record the latency, sizes and codes of each call in, None for our own
+                @binary:       True/False (default) to always/never send and accept MessagePack instead of JSON, None
+                               accepts it and sends it once the server has answered with it
+                @patch:        setChuteData sends only the sections changed since the chute was read, as a PATCH,
+                               this is turned off by itself if the server turns out not to support it (default False)
     """
-    def __init__(self, uname='', passwd='', devid=None, sessionToken=None, url=APISERVER):
+    def __init__(self, uname='', passwd='', devid=None, sessionToken=None, url=APISERVER, pool=None,
+            poolSize=DEFAULT_POOL_SIZE, idleTimeout=DEFAULT_IDLE_TIMEOUT, uploadRecord=None, cache=None,
+            retry=None, breakers=None, compress=False, compressThreshold=DEFAULT_COMPRESS_THRESHOLD,
+            compressRequests=None, metrics=None, binary=False, patch=False):
         self.uname = uname
         self.passwd = md5.new(passwd).hexdigest()
         self.devid = devid
         self.tok = sessionToken
         self.baseUrl = url
+        # The pool can be shared between clients and threads, it handles its own locking
+        if(pool):
+            self.pool = pool
+        else:
+            self.pool = HTTPConnectionPool(poolSize, idleTimeout)
+        if(uploadRecord):
+            self.uploads = uploadRecord
+        else:
+            self.uploads = UploadRecord()
+        self.cache = cache
+        if(retry):
+            self.retry = retry
+        else:
+            self.retry = NO_RETRY
+        self.breakers = breakers
+        self.compress = compress
+        self.compressThreshold = compressThreshold
+        self.compressRequests = compressRequests
+        self.compression = CompressionStats()
+        if(metrics is not None):
+            self.metrics = metrics
+        else:
+            self.metrics = APIMetrics()
+        self.binary = binary
+        self._peerBinary = False
+        self.patch = patch
+        # When a change was last sent for each (kind, guid), so a watch can tell its update from an older one
+        self._changes = {}
+        # The Date header of the last response and when it arrived, parsed only if clockOffset() is asked for
+        self._serverDate = None
+        # Set per thread by BatchQueue while it runs a call
+        self._batch = threading.local()
+
+    def close(self):
+        """Close any idle keep-alive connections this client is holding."""
+        self.pool.close()
+
+    def clockOffset(self):
+        """
+            Seconds the server clock is ahead of ours (negative if behind) going by the Date header of the last
+            response, 0 if there hasn't been one. The Date only has whole seconds so neither is this.
+        """
+        d = self._serverDate
+        if(not d):
+            return 0.0
+        t = email.utils.parsedate_tz(d[0])
+        if(not t):
+            return 0.0
+        return email.utils.mktime_tz(t) - d[1]
+
+    def lastChange(self, kind, guid):
+        """Returns when this client last sent a change to the 'chute' or 'ap' @guid, None if it hasn't."""
+        return self._changes.get((kind, guid), None)
+
+    def batch(self, maxSize=DEFAULT_BATCH_SIZE, maxDelay=DEFAULT_BATCH_DELAY):
+        """
+            Returns a BatchQueue which has the same calls as this client, but each returns a Future and
+            the requests are sent together in batch envelopes of up to @maxSize calls, or after @maxDelay seconds.
+            Example:
+                with clt.batch() as b:
+                    futures = [b.enableChute(ch) for ch in chutes]
+        """
+        return BatchQueue(self, maxSize, maxDelay)
 
     def buildHeaders(self, fileName="", c_size=0):
         """Uses the member variables of this object to build the correct header.
@@ -41,27 +144,187 @@ class ParaDropAPIClient:
         else:
             h = {'Accept': 'application/json', 'Content-Type':'application/json'}
         
+        if(self.binary is not False):
+            h['Accept'] = '%s, application/json' % MSGPACK.contentType
+        if(self.compress):
+            h['Accept-Encoding'] = 'gzip'
         if(self.devid):
             h['devid'] = self.devid
         if(self.tok):
             h['sessionToken'] = self.tok
         return h
 
-    def sendRequest(self, method, body, header, httpMethod=None):
-        """Wrap the call to URL open so that we can catch exceptions it might throw."""
+    def _compressBody(self, body, header):
+        """Gzip @body if it is worth it and the server can take it, returns the (body, header) to send."""
+        if(not isinstance(body, str)):
+            return body, header
+        raw = len(body)
+        if(self.compressRequests is not False and raw >= self.compressThreshold and
+                (self.compressRequests or self.compression.compressedResponses)):
+            z = gzipCompress(body)
+            if(len(z) < raw):
+                body = z
+                header = dict(header)
+                header['Content-Encoding'] = 'gzip'
+        self.compression.sent(raw, len(body))
+        return body, header
+
+    def serializer(self):
+        """The Serializer request bodies are sent with."""
+        if(self.binary or (self.binary is None and self._peerBinary)):
+            return MSGPACK
+        return JSON
+
+    def encodeBody(self, body, header):
+        """Serialize @body for the wire, returns the (str, header) to send.
+            JSON bodies keep the Content-Type of @header as it was, so by default the requests are the same as always."""
+        ser = self.serializer()
+        if(ser is not JSON and header.get('Content-Type', None) != ser.contentType):
+            header = dict(header)
+            header['Content-Type'] = ser.contentType
+        return ser.dumps(body), header
+
+    def decodeResponse(self, headers, data):
+        """Decode the response body @data with the Serializer its Content-Type names, JSON if it names none we know."""
+        ser = getSerializer(headers.get('content-type', None)) or JSON
+        if(ser.binary):
+            self._peerBinary = True
+        return ser.loads(data)
+
+    def stats(self):
+        """
+            Returns a snapshot of the metrics of each endpoint family: per phase latency histograms
+            (connect, send, wait, read, decode, total), request/response body sizes and the count of each status code.
+            Use metrics.prometheusText() or metrics.jsonLines() to format it.
+        """
+        return self.metrics.snapshot()
+
+    def compressionStats(self):
+        """Returns a dict of the bytes sent and received before and after gzip, and the total bytes saved."""
+        return self.compression.snapshot()
+
+    def _transport(self, method, httpMethod, url, body, header, mutating):
+        """
+            Send the request through the pool, retrying according to the RetryPolicy and
+            keeping the circuit breaker for this endpoint up to date.
+            Returns the PooledResponse, which may hold an error status.
+        """
+        body, header = self._compressBody(body, header)
+        if(self.breakers):
+            breaker = self.breakers.get(method)
+        else:
+            breaker = None
+        # Streamed bodies are consumed as they are sent, only resend the ones that can start over
+        canResend = (body is None or isinstance(body, str) or hasattr(body, 'rewind'))
+        
+        attempt = 0
+        while(True):
+            if(breaker and not breaker.allow()):
+                raise PDAPIError(method, "Circuit open for %s after repeated failures" % pdapi.endpointFamily(method))
+            try:
+                # The pool may send it again on a fresh connection, only let it do what the RetryPolicy would
+                resp = self.pool.urlopen(httpMethod, url, body, header, not mutating)
+                self.compression.received(len(resp.data), resp.wireSize)
+                self.metrics.record(method, resp.timings, resp.sentSize, resp.wireSize, resp.status)
+            except (socket.error, httplib.HTTPException) as e:
+                self.metrics.record(method, error=errorName(e))
+                if(breaker):
+                    breaker.failure()
+                if(not canResend or not self.retry.shouldRetry(attempt, mutating)):
+                    raise
+                out.lazy('warn', '** %s Retrying %s: %s\n', LOGPREFIX, method, e)
+            except:
+                # Anything else (ie a bad gzip body) still counts against the endpoint, or a trial
+                # request let through a half open circuit would leave it half open for good
+                self.metrics.record(method, error=errorName(sys.exc_info()[1]))
+                if(breaker):
+                    breaker.failure()
+                raise
+            else:
+                if(resp.status not in self.retry.retryCodes):
+                    if(breaker):
+                        breaker.success()
+                    return resp
+                if(breaker):
+                    breaker.failure()
+                if(not canResend or not self.retry.shouldRetry(attempt, mutating, resp.status)):
+                    return resp
+                out.lazy('warn', '** %s Retrying %s: %s %s\n', LOGPREFIX, method, resp.status, resp.reason)
+            
+            time.sleep(self.retry.delay(attempt))
+            attempt += 1
+            if(hasattr(body, 'rewind')):
+                body.rewind()
+
+    def sendRequest(self, method, body, header, httpMethod=None, stream=None, raiseCodes=()):
+        """Wrap the call to the connection pool so that we can catch exceptions it might throw.
+            If @stream is provided it is sent block by block as the body instead of encoding @body.
+            A PD error whose code is in @raiseCodes is raised as the HTTPError for the caller to handle instead of logged."""
+        # The call is counted and timed however it ends
+        start = time.time()
+        cached = False
         try:
-            if(body):
+            if(stream is not None):
+                b = stream
+            elif(body):
                 # Encode the string so it won't have database issues
-                b = json2str(body)
+                b, header = self.encodeBody(body, header)
             else:
                 b = None
-            req = urllib2.Request(self.baseUrl + method, b, header)
-            if(httpMethod):
-                req.get_method = lambda: httpMethod
-            resp = urllib2.urlopen(req).read()
+            # Same default urllib2 uses, POST if there is something to send
+            if(not httpMethod):
+                if(b is None):
+                    httpMethod = 'GET'
+                else:
+                    httpMethod = 'POST'
+            url = self.baseUrl + method
+
+            # Read only calls can be answered by the cache, anything that changes data drops what it touches
+            mutating = pdapi.isMutating(method, b is not None, httpMethod)
+            if(mutating):
+                kind, guid, action = pdapi.splitMethod(method)
+                if(guid):
+                    self._changes[(kind, guid)] = start
+            if(self.cache is not None):
+                if(mutating):
+                    self.cache.invalidate(method)
+                elif(self.cache.isCacheable(method)):
+                    data = self.cache.get(method)
+                    if(data is not None):
+                        cached = True
+                        return sniffSerializer(data).loads(data)
+
+            # Inside a BatchQueue call the request goes out as part of the next batch envelope
+            queue = getattr(self._batch, 'queue', None)
+            if(queue and stream is None):
+                if(b is None):
+                    body = None
+                code, msg, data = queue.enqueue(method, body, httpMethod).result()
+                self.metrics.record(method, code=code)
+                if(self.cache is not None and mutating):
+                    self.cache.invalidate(method)
+                if(code < 200 or code >= 300):
+                    raise urllib2.HTTPError(url, code, msg, {}, None)
+                return data
+
+            resp = self._transport(method, httpMethod, url, b, header, mutating)
+            date = resp.headers.get('date', None)
+            if(date):
+                self._serverDate = (date, time.time())
+            if(self.cache is not None and mutating):
+                # Again, in case another thread read it back while the call was being made
+                self.cache.invalidate(method)
+            if(resp.status < 200 or resp.status >= 300):
+                raise urllib2.HTTPError(url, resp.status, resp.reason, resp.headers, None)
             
+            if(self.cache is not None and not mutating):
+                self.cache.put(method, resp.data)
+
             # Decode any message returning that may have touched the database
-            return str2json(resp)
+            t = time.time()
+            data = self.decodeResponse(resp.headers, resp.data)
+            self.metrics.record(method, {'decode': time.time() - t})
+            return data
         
         except urllib2.HTTPError as httpe:
             #Get the HTTP error data
@@ -69,19 +332,25 @@ class ParaDropAPIClient:
             msg = httpe.msg
             
             # Not ours, don't know what to do
-            if(not pdapi.isPDError(code)):
+            if(not pdapi.isPDError(code) or code in raiseCodes):
                 raise httpe
             
             # Check if sessionToken has expired, if so relogin
             if(code == pdapi.ERR_TOKEXPIRE):
                 out.warn("** Please signin to API server again\n")
             else:
-                out.err('!! %s PDAPIError %s: %s\n' % (logPrefix(), code, msg))
+                out.lazy('err', '!! %s PDAPIError %s: %s\n', LOGPREFIX, code, msg)
+            return None
+        
+        except PDAPIError as e:
+            out.lazy('err', '!! %s %s\n', LOGPREFIX, e)
             return None
             
         except Exception as e:
-            out.err('!! %s Unknown exception %s\n' % (logPrefix(), str(e)))
+            out.lazy('err', '!! %s Unknown exception %s\n', LOGPREFIX, e)
             return None
+        finally:
+            self.metrics.call(method, time.time() - start, cached)
             
     def signin(self, uname=None, passwd=None):
         """Uses the signin API to get the sessionToken and devid of the developer."""
@@ -274,7 +543,73 @@ class ParaDropAPIClient:
        
         #Convert the response into a list of Chute() objects and return
         return [Chute(descriptor=l) for l in resp['data']]
-    
+
+    def _iterList(self, method, key, cls):
+        """
+            Generator of cls(descriptor=...) for each element of the list in the response to @method,
+            decoded as it is read off the socket so only one element is in memory at a time.
+            The list is the whole response if @key is None, otherwise the @key value of the response dict.
+            Errors are handled as sendRequest does: logged, and the generator just ends.
+            Raises PDAPIError if the response does not hold the list or is not "OK",
+            in which case the objects already yielded should not be trusted.
+        """
+        # The call is counted and timed however it ends, even if the caller stops early
+        start = time.time()
+        try:
+            headers = self.buildHeaders()
+            # Only JSON can be decoded as it streams in
+            headers['Accept'] = JSON.contentType
+            try:
+                resp = self.pool.stream('GET', self.baseUrl + method, None, headers)
+            except (socket.error, httplib.HTTPException) as e:
+                self.metrics.record(method, error=errorName(e))
+                out.lazy('err', '!! %s Unable to get %s: %s\n', LOGPREFIX, method, e)
+                return
+
+            with resp:
+                if(resp.status < 200 or resp.status >= 300):
+                    resp.read()
+                    self.metrics.record(method, resp.timings, resp.sentSize, resp.wireSize, resp.status)
+                    if(resp.status == pdapi.ERR_TOKEXPIRE):
+                        out.warn("** Please signin to API server again\n")
+                    elif(pdapi.isPDError(resp.status)):
+                        out.lazy('err', '!! %s PDAPIError %s: %s\n', LOGPREFIX, resp.status, resp.reason)
+                    else:
+                        out.lazy('err', '!! %s HTTP error %s: %s\n', LOGPREFIX, resp.status, resp.reason)
+                    return
+
+                stream = JSONArrayStream(resp.blocks(), key)
+                try:
+                    for l in stream:
+                        # Check as soon as we can, the response may come before or after the list
+                        if(key and stream.fields.get('response', 'OK') != 'OK'):
+                            break
+                        yield cls(descriptor=l)
+                except ValueError as e:
+                    raise PDAPIError(method, "Bad response from API server: %s" % str(e))
+
+                self.metrics.record(method, resp.timings, resp.sentSize, resp.wireSize, resp.status)
+
+            if(key and (not stream.found or stream.fields.get('response', None) != 'OK')):
+                raise PDAPIError(method, "API server error getting %s" % method)
+        finally:
+            self.metrics.call(method, time.time() - start)
+
+    def iterChutes(self, ap):
+        """
+            Same as listChutes, but a generator of the Chute objects which are created as the response streams in,
+            so the memory used doesn't grow with the number of chutes on the AP.
+        """
+        if(isinstance(ap, AP)):
+            method = "ap/%s/list" % ap.guid
+        else:
+            method = "ap/%s/list" % ap
+        return self._iterList(method, 'data', Chute)
+
+    def iterApList(self):
+        """Same as getApList, but a generator of the AP objects which are created as the response streams in."""
+        return self._iterList("ap/list", None, AP)
+
     def createChute(self, ap):
         """Request a new chute for this AP.
             @returns a chute object or None on error."""
@@ -371,12 +706,15 @@ class ParaDropAPIClient:
         if(res):
             raise PDAPIError(method, "API server error getting Chute info")
         
-        # Return False meaning success
-        return Chute(descriptor=resp['data'])
+        # What the server has now, so setChuteData can send only what changes
+        ch = Chute(descriptor=resp['data'])
+        ch.markSynced()
+        return ch
     
-    def setChuteData(self, chute):
+    def setChuteData(self, chute, full=False):
         """Set the data for this chute.
-            All data will be sent:
+            If the chute came from getChuteData (or was sent before) only the sections changed since are sent
+            as a PATCH, otherwise or if @full all data will be sent:
                 - struct
                 - runtime
                 - traffic
@@ -386,12 +724,30 @@ class ParaDropAPIClient:
         
         # Verify argument
         if(not isinstance(chute, Chute)):
-            raise PDAPIError(method, "Chute object required")
+            raise PDAPIError("chute/data", "Chute object required")
         
         method = "chute/%s/data" % chute.guid
         
+        diff = None
+        if(self.patch and not full):
+            diff = chute.diffSections()
+            # Nothing changed, nothing to send
+            if(diff == {}):
+                return False
+        
         # Send request
-        resp = self.sendRequest(method, chute.getAPIDataFormat(), self.buildHeaders())
+        resp = None
+        if(diff):
+            try:
+                resp = self.sendRequest(method, diff, self.buildHeaders(), 'PATCH', raiseCodes=pdapi.PATCH_UNSUPPORTED)
+            except urllib2.HTTPError as e:
+                if(e.code not in pdapi.PATCH_UNSUPPORTED):
+                    raise
+                out.lazy('warn', '** %s Server does not support PATCH (%s), sending whole chutes from now on\n', LOGPREFIX, e.code)
+                self.patch = False
+                diff = None
+        if(not diff):
+            resp = self.sendRequest(method, chute.getAPIDataFormat(), self.buildHeaders())
         
         if(not resp):
             return True
@@ -401,6 +757,7 @@ class ParaDropAPIClient:
         if(res):
             return True
         
+        chute.markSynced()
         # Return False meaning success
         return False
 
@@ -561,8 +918,23 @@ class ParaDropAPIClient:
         else:
             return resp['data']
     
-    def putChuteFile(self, ch, filePath):
-        """Transmit a file to the server"""
+    def putChuteFile(self, ch, filePath, stream=False, blockSize=DEFAULT_BLOCK_SIZE, progress=None, encoding='raw',
+            skipUnchanged=False, fileName=None):
+        """
+            Transmit a file to the server.
+            Arguments:
+                @ch        : the Chute object or chute guid
+                @filePath  : the local file to send
+                @stream    : if True the file is read and sent in blocks of @blockSize rather than buffered in memory
+                @progress  : function called as progress(sentBytes, totalBytes) while streaming
+                @encoding  : when streaming, 'raw' sends the bytes as application/octet-stream,
+                             'base64' sends the same encoded body as the buffered upload using chunked transfer encoding
+                @skipUnchanged : hash the file first and don't send it if the server already has the same content,
+                                 in that case the response has 'skipped' set to True
+                @fileName  : name of the file on the server, defaults to the name of the local file
+            Returns:
+                The server response, with 'sha1' set to the hash of the file sent
+        """
         if(isinstance(ch, Chute)):
             chid = ch.guid
         else:
@@ -577,28 +949,357 @@ class ParaDropAPIClient:
             size_resp = "File size exceeded max limit (100MB). Please Re-try"
             return size_resp
 
-        fileObj = open(filePath, 'rb')
-        reqSize = os.stat(filePath).st_size 
-        fileName = filePath.split('/')[-1]
+        st = os.stat(filePath)
+        reqSize = st.st_size 
+        if(not fileName):
+            fileName = filePath.split('/')[-1]
         method = "chute/%s/file/%s" % (chid, fileName)
-        mmapFileObj = mmap.mmap(fileObj.fileno(), 0, access=mmap.ACCESS_READ)
 
-        # Send request
-        encFileObj = base64.b64encode(mmapFileObj.read(mmapFileObj.size()))
-        resp = self.sendRequest(method, encFileObj, self.buildHeaders(fileName, reqSize), httpMethod='PUT')
+        # Compare against what we know is on the server before sending anything
+        digest = None
+        if(skipUnchanged):
+            digest = self.uploads.localSha1(chid, fileName, filePath)
+            if(self.isChuteFileCurrent(chid, fileName, digest)):
+                self.uploads.set(chid, fileName, digest, st.st_size, st.st_mtime)
+                return {'response': 'OK', 'sha1': digest, 'skipped': True}
+
+        if(stream):
+            if(encoding == 'base64'):
+                body = Base64BodyStream(filePath, blockSize, progress)
+            elif(encoding == 'raw'):
+                body = FileBodyStream(filePath, blockSize, progress)
+            else:
+                raise PDAPIError(method, "Unknown upload encoding %s" % encoding)
+            headers = self.buildHeaders(fileName, reqSize)
+            headers['Content-Type'] = body.contentType
+            if(body.getLength() is not None):
+                headers['Content-Length'] = body.getLength()
+            
+            # Send request
+            resp = self.sendRequest(method, None, headers, httpMethod='PUT', stream=body)
+        else:
+            fileObj = open(filePath, 'rb')
+            mmapFileObj = mmap.mmap(fileObj.fileno(), 0, access=mmap.ACCESS_READ)
 
-        mmapFileObj.close()
-        fileObj.close()
+            # Send request
+            data = mmapFileObj.read(mmapFileObj.size())
+            if(not digest):
+                digest = hashlib.sha1(data).hexdigest()
+            encFileObj = base64.b64encode(data)
+            resp = self.sendRequest(method, encFileObj, self.buildHeaders(fileName, reqSize), httpMethod='PUT')
 
-        if(not resp):
+            mmapFileObj.close()
+            fileObj.close()
+
+        # Verify response
+        if(not resp or pdutils.check(resp, dict, ["response"])):
+            # We no longer know what the server holds, don't let the record say otherwise
+            self.uploads.remove(chid, fileName)
             return True
         
-        # Verify response
-        res = pdutils.check(resp, dict, ["response"])
-        if(res):
+        # The streamed bodies hash the file as they send it
+        if(not digest):
+            digest = body.hexdigest()
+        self.uploads.set(chid, fileName, digest, st.st_size, st.st_mtime)
+        resp.setdefault('sha1', digest)
+        return resp 
+
+    def putChuteDir(self, ch, dirPath, destPath=None, mode='tar', workers=4, blockSize=DEFAULT_BLOCK_SIZE,
+            progress=None, archiveName=None):
+        """
+            Transmit a directory to the server and build the Chute.files entries which describe it.
+            Arguments:
+                @ch        : the Chute object or chute guid
+                @dirPath   : the local directory to send
+                @destPath  : where the contents end up inside the chute, defaults to /srv/<directory name>
+                @mode      : 'tar' streams the directory as a single gzipped tar archive built on the fly (no temp file),
+                             the entry returned has todo EXTRACT so it gets unpacked into @destPath
+                             'files' streams each file on its own, up to @workers at a time, one entry per file
+                @workers   : number of files uploaded at once in 'files' mode
+                @progress  : function called as progress(sentBytes, totalBytes) while streaming, totalBytes is None for 'tar'
+                @archiveName : name of the archive on the server in 'tar' mode, defaults to <directory name>.tar.gz
+            Returns:
+                The list of Chute.files entries (the sha1 values computed while sending), True on failure.
+        """
+        if(isinstance(ch, Chute)):
+            chid = ch.guid
+            chname = ch.name or ch.guid
+        else:
+            chid = ch
+            chname = ch
+
+        dirPath = dirPath.rstrip('/')
+        if(not os.path.isdir(dirPath)):
+            raise PDAPIError("putChuteDir", "%s is not a directory" % dirPath)
+        base = os.path.basename(dirPath)
+        if(not destPath):
+            destPath = "/srv/%s" % base
+
+        if(mode == 'tar'):
+            if(not archiveName):
+                archiveName = "%s.tar.gz" % base
+            body = TarBodyStream(dirPath, blockSize, progress)
+            headers = self.buildHeaders(archiveName, 0)
+            headers['Content-Type'] = body.contentType
+            resp = self.sendRequest("chute/%s/file/%s" % (chid, archiveName), None, headers, httpMethod='PUT', stream=body)
+            if(not resp or pdutils.check(resp, dict, ["response"])):
+                return True
+            return [{'name': base, 'path': destPath, 'location': '@paradrop.server(%s/%s)' % (chname, archiveName),
+                     'sha1': body.hexdigest(), 'todo': 'EXTRACT'}]
+
+        elif(mode == 'files'):
+            names = []
+            for root, dirs, files in os.walk(dirPath):
+                dirs.sort()
+                for name in sorted(files):
+                    names.append(os.path.relpath(os.path.join(root, name), dirPath))
+
+            pool = WorkerPool(workers, "pdputdir")
+            try:
+                futures = [pool.submit(self.putChuteFile, chid, os.path.join(dirPath, name), True, blockSize,
+                        progress, fileName=name) for name in names]
+                entries = []
+                failed = []
+                for name, f in zip(names, futures):
+                    try:
+                        resp = f.result()
+                    except Exception as e:
+                        out.lazy('err', '!! %s Unable to send %s: %s\n', LOGPREFIX, name, e)
+                        resp = None
+                    if(not isinstance(resp, dict)):
+                        failed.append(name)
+                        continue
+                    entries.append({'name': name, 'path': os.path.join(destPath, os.path.dirname(name)).rstrip('/'),
+                                    'location': '@paradrop.server(%s/%s)' % (chname, name), 'sha1': resp['sha1']})
+            finally:
+                pool.shutdown(False)
+            self.uploads.save()
+            if(failed):
+                out.lazy('err', '!! %s Failed to send %s\n', LOGPREFIX, ', '.join(failed))
+                return True
+            return entries
+
+        else:
+            raise PDAPIError("putChuteDir", "Unknown mode %s" % mode)
+
+    def isChuteFileCurrent(self, ch, fileName, sha1):
+        """
+            Returns True if the server already holds @fileName for the chute with the @sha1 provided.
+            The local upload record is checked first, the server file stats are only requested if we don't know.
+        """
+        if(isinstance(ch, Chute)):
+            chid = ch.guid
+        else:
+            chid = ch
+
+        r = self.uploads.get(chid, fileName)
+        if(r and r['sha1'] == sha1):
             return True
+
+        stats = self.getStatsChuteFile(chid, fileName)
+        if(not isinstance(stats, dict)):
+            return False
+        # Depending on the call the stats might be wrapped in a data object
+        if(isinstance(stats.get('data', None), dict)):
+            stats = stats['data']
+        return stats.get('sha1', None) == sha1
+
+    def syncChuteDir(self, ch, dirPath, stream=True, progress=None):
+        """
+            Upload every file in the directory that differs from what the server already has.
+            Returns a dict of fileName: 'uploaded', 'unchanged' or 'failed'.
+        """
+        if(not os.path.isdir(dirPath)):
+            raise PDAPIError("syncChuteDir", "%s is not a directory" % dirPath)
+
+        results = {}
+        for fileName in sorted(os.listdir(dirPath)):
+            filePath = os.path.join(dirPath, fileName)
+            if(not os.path.isfile(filePath)):
+                out.lazy('warn', '** %s Skipping %s, not a file\n', LOGPREFIX, filePath)
+                continue
+            resp = self.putChuteFile(ch, filePath, stream=stream, progress=progress, skipUnchanged=True)
+            if(not isinstance(resp, dict)):
+                results[fileName] = 'failed'
+            elif(resp.get('skipped', False)):
+                results[fileName] = 'unchanged'
+            else:
+                results[fileName] = 'uploaded'
+        
+        self.uploads.save()
+        return results
+
+    def manifestSha1(self, ch, fileName):
+        """The sha1 the files manifest of the Chute @ch lists for @fileName, None if it has none."""
+        if(not isinstance(ch, Chute)):
+            return None
+        for f in ch.files:
+            if(not isinstance(f, dict)):
+                continue
+            loc = f.get('location', '')
+            if(f.get('name', None) == fileName or loc.endswith('/%s)' % fileName) or loc.endswith('(%s)' % fileName)):
+                return f.get('sha1', None)
+        return None
+
+    def getChuteFile(self, ch, fileName, destPath, sha1=None, resume=True, useMmap=False, blockSize=DEFAULT_BLOCK_SIZE,
+            progress=None):
+        """
+            Download a file of the chute, it is written to disk as it streams in and never held in memory.
+            The data goes to @destPath.part until it is complete and its sha1 checks out, then it is renamed to @destPath.
+            Arguments:
+                @ch       : the Chute object or chute guid
+                @fileName : the name of the file on the server
+                @destPath : where to write the file
+                @sha1     : sha1 the file must have, if None and @ch is a Chute the one from its files manifest is used
+                @resume   : continue from an earlier partial download of @destPath.part with an HTTP Range request
+                @useMmap  : preallocate the file to its full size and write the blocks into it through a memory map
+                @progress : function called as progress(receivedBytes, totalBytes) after each block
+            Returns:
+                dict of 'path', 'size', 'sha1' and 'resumed' (bytes kept from an earlier attempt), True on failure.
+        """
+        if(isinstance(ch, Chute)):
+            chid = ch.guid
         else:
-            return resp 
+            chid = ch
+        if(not sha1):
+            sha1 = self.manifestSha1(ch, fileName)
+        method = "chute/%s/file/%s" % (chid, fileName)
+        partPath = "%s.part" % destPath
+
+        # Pick up where an earlier attempt left off, the sha1 has to cover those bytes too
+        h = hashlib.sha1()
+        offset = 0
+        if(resume and os.path.exists(partPath)):
+            with open(partPath, 'rb') as fd:
+                while(True):
+                    block = fd.read(blockSize)
+                    if(not block):
+                        break
+                    h.update(block)
+                    offset += len(block)
+
+        headers = self.buildHeaders(fileName)
+        headers['Accept'] = 'application/octet-stream'
+        # Ranges are over the file bytes, so don't let the server compress them
+        headers['Accept-Encoding'] = 'identity'
+        if(offset):
+            headers['Range'] = 'bytes=%d-' % offset
+
+        # The call is counted and timed however it ends, unless it starts over as a new call
+        start = time.time()
+        restarted = False
+        try:
+            try:
+                resp = self.pool.stream('GET', self.baseUrl + method, None, headers)
+            except (socket.error, httplib.HTTPException) as e:
+                self.metrics.record(method, error=errorName(e))
+                out.lazy('err', '!! %s Unable to get %s: %s\n', LOGPREFIX, method, e)
+                return True
+
+            with resp:
+                if(resp.status == 416 and offset):
+                    # What we have doesn't fit the file on the server anymore, start over
+                    resp.close()
+                    os.remove(partPath)
+                    restarted = True
+                    return self.getChuteFile(ch, fileName, destPath, sha1, False, useMmap, blockSize, progress)
+                if(resp.status not in (200, 206)):
+                    resp.read()
+                    self.metrics.record(method, resp.timings, 0, resp.wireSize, resp.status)
+                    out.lazy('err', '!! %s PDAPIError %s: %s\n', LOGPREFIX, resp.status, resp.reason)
+                    return True
+                if(resp.headers.get('content-type', '').startswith('application/json')):
+                    resp.read()
+                    out.lazy('err', '!! %s Server did not send the contents of %s\n', LOGPREFIX, method)
+                    return True
+
+                total = None
+                if(resp.status == 206):
+                    # Content-Range: bytes first-last/total
+                    try:
+                        rng, size = resp.headers.get('content-range', '').split(' ', 1)[1].split('/')
+                        if(int(rng.split('-')[0]) != offset):
+                            raise ValueError(rng)
+                        total = int(size)
+                    except (IndexError, ValueError):
+                        out.lazy('err', '!! %s Bad Content-Range for %s\n', LOGPREFIX, method)
+                        return True
+                else:
+                    # The server sent the whole file
+                    if(offset):
+                        h = hashlib.sha1()
+                        offset = 0
+                    if(resp.length is not None):
+                        total = resp.length
+                resumed = offset
+
+                pos = offset
+                try:
+                    if(useMmap and total):
+                        with open(partPath, 'a+b') as fd:
+                            fd.truncate(total)
+                            mm = mmap.mmap(fd.fileno(), total)
+                            try:
+                                for block in resp.blocks(blockSize):
+                                    n = len(block)
+                                    mm[pos:pos + n] = block
+                                    h.update(block)
+                                    pos += n
+                                    if(progress):
+                                        progress(pos, total)
+                                mm.flush()
+                            finally:
+                                mm.close()
+                    else:
+                        if(offset):
+                            mode = 'ab'
+                        else:
+                            mode = 'wb'
+                        with open(partPath, mode) as fd:
+                            if(resp.headers.get('content-encoding', '').lower() == 'gzip'):
+                                for block in resp.blocks(blockSize):
+                                    fd.write(block)
+                                    h.update(block)
+                                    pos += len(block)
+                                    if(progress):
+                                        progress(pos, total)
+                            else:
+                                # One buffer reused for every block of the download
+                                buf = bytearray(blockSize)
+                                while(True):
+                                    n = resp.readinto(buf)
+                                    if(not n):
+                                        break
+                                    view = buffer(buf, 0, n)
+                                    fd.write(view)
+                                    h.update(view)
+                                    pos += n
+                                    if(progress):
+                                        progress(pos, total)
+                except (socket.error, httplib.HTTPException) as e:
+                    self.metrics.record(method, error=errorName(e))
+                    out.lazy('err', '!! %s Download of %s interrupted at %d bytes: %s\n', LOGPREFIX, method, pos, e)
+                    if(useMmap and total):
+                        # The preallocated tail is not data, keep only what arrived so it can be resumed
+                        with open(partPath, 'r+b') as fd:
+                            fd.truncate(pos)
+                    return True
+
+            self.metrics.record(method, resp.timings, 0, resp.wireSize, resp.status)
+
+            if(total is not None and pos != total):
+                out.lazy('err', '!! %s Download of %s incomplete, %d of %d bytes\n', LOGPREFIX, method, pos, total)
+                return True
+            digest = h.hexdigest()
+            if(sha1 and digest != sha1):
+                os.remove(partPath)
+                out.lazy('err', '!! %s sha1 of %s is %s, expected %s\n', LOGPREFIX, method, digest, sha1)
+                return True
+            os.rename(partPath, destPath)
+            return {'path': destPath, 'size': pos, 'sha1': digest, 'resumed': resumed}
+        finally:
+            if(not restarted):
+                self.metrics.call(method, time.time() - start)
 
     def deleteChuteFile(self, ch, fileName):
         """Delete a file from the server"""
@@ -619,6 +1320,7 @@ class ParaDropAPIClient:
         if(res):
             return True #Failed checks
         else:
+            self.uploads.remove(chid, fileName)
             return resp #Passed checks
 
     def getStatsChuteFile(self, ch, fileName):
@@ -662,5 +1364,6 @@ class ParaDropAPIClient:
         else:
             return resp
 
-
-
+# Time every public call on the out.perf stream, see utils.pdperf
+for _name in API_CALLS:
+    setattr(ParaDropAPIClient, _name, pdperf.timed('client.%s' % _name)(ParaDropAPIClient.__dict__[_name]))
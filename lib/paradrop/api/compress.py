@@ -0,0 +1,86 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    gzip helpers for the Accept-Encoding/Content-Encoding negotiation between the client and API server.
+"""
+
+import zlib, threading
+
+from lib.paradrop import *
+
+# Bodies smaller than this are not worth compressing
+DEFAULT_COMPRESS_THRESHOLD = 1024
+# Tells zlib to read/write the gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+def gzipCompress(s, level=6):
+    """Returns @s compressed in gzip format."""
+    c = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return c.compress(s) + c.flush()
+
+def gzipDecompress(s):
+    """Returns the gzip data in @s decompressed."""
+    return zlib.decompress(s, GZIP_WBITS)
+
+class GzipDecoder:
+    """Decompresses a gzip stream one block at a time as it arrives."""
+    def __init__(self):
+        self._d = zlib.decompressobj(GZIP_WBITS)
+
+    def decompress(self, block):
+        return self._d.decompress(block)
+
+    def flush(self):
+        return self._d.flush()
+
+class CompressionStats:
+    """
+        Counts the bytes before and after compression for everything sent and received.
+            Members:
+                @rawSent, @wireSent         : request body bytes before compression and on the wire
+                @rawReceived, @wireReceived : response body bytes after decompression and on the wire
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __repr__(self):
+        return "<CompressionStats %d bytes saved>" % self.saved()
+
+    def reset(self):
+        with self._lock:
+            self.rawSent = 0
+            self.wireSent = 0
+            self.rawReceived = 0
+            self.wireReceived = 0
+            self.compressedRequests = 0
+            self.compressedResponses = 0
+
+    def sent(self, raw, wire):
+        with self._lock:
+            self.rawSent += raw
+            self.wireSent += wire
+            if(wire != raw):
+                self.compressedRequests += 1
+
+    def received(self, raw, wire):
+        with self._lock:
+            self.rawReceived += raw
+            self.wireReceived += wire
+            if(wire != raw):
+                self.compressedResponses += 1
+
+    def saved(self):
+        """Total bytes compression kept off the wire."""
+        return (self.rawSent - self.wireSent) + (self.rawReceived - self.wireReceived)
+
+    def snapshot(self):
+        """Returns a dict of the counters."""
+        with self._lock:
+            return {'rawSent': self.rawSent, 'wireSent': self.wireSent, 'rawReceived': self.rawReceived,
+                    'wireReceived': self.wireReceived, 'compressedRequests': self.compressedRequests,
+                    'compressedResponses': self.compressedResponses,
+                    'bytesSaved': (self.rawSent - self.wireSent) + (self.rawReceived - self.wireReceived)}
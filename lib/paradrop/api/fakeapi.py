@@ -0,0 +1,420 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    In memory fake of the v1 ParaDrop API (auth, ap, chute and file calls) to run the client against offline,
+    with latency and errors that can be injected per call to see how the client copes.
+        Example:
+            api = FakeParaDropAPI()
+            api.addUser('dev', 'secret')
+            api.populate(10, 5)
+            srv = LocalAPIServer(api)
+            clt = ParaDropAPIClient('dev', 'secret', url=srv.start())
+"""
+
+import re, time, json, random, base64, urllib, hashlib, threading, md5
+
+from lib.paradrop import *
+from lib.paradrop.api import pdapi
+from lib.paradrop.api.localserver import LocalAPI, RawBody, BATCH_METHOD
+from lib.paradrop.utils import pdutils
+
+# Actions on a chute and the state they move it to
+CHUTE_ACTIONS = {'enable': 'running', 'disable': 'disabled', 'freeze': 'frozen', 'unfreeze': 'running'}
+
+class Fault:
+    """
+        Latency and errors injected into the calls whose method matches @regex (None matches all).
+            Arguments:
+                @latency   : seconds added to each call
+                @jitter    : up to this many more seconds, picked at random per call
+                @errorRate : fraction (0-1) of the calls that fail
+                @errorCode : pdapi code the failed calls get
+    """
+    def __init__(self, regex=None, latency=0.0, jitter=0.0, errorRate=0.0, errorCode=pdapi.ERR_DBISSUE):
+        self.regex = regex and re.compile(regex)
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.errorCode = errorCode
+
+    def __repr__(self):
+        return "<Fault %s %.3fs+%.3fs %d%% %d>" % (self.regex and self.regex.pattern, self.latency, self.jitter,
+                self.errorRate * 100, self.errorCode)
+
+    def matches(self, method):
+        return self.regex is None or self.regex.match(method) is not None
+
+class FakeParaDropAPI(LocalAPI):
+    """
+        Keeps developers, APs, chutes and chute files in memory and answers the v1 API calls with the
+        same responses and pdapi codes as the API server.
+            Arguments:
+                @requireAuth : calls other than auth/signin need the sessionToken given out by signin
+                @supportsPatch : answer PATCH chute/<guid>/data, if False it is a bad method like an older server
+    """
+    def __init__(self, requireAuth=True, supportsPatch=True):
+        LocalAPI.__init__(self)
+        self.requireAuth = requireAuth
+        self.lock = threading.RLock()
+        self.faults = []
+        self.users = {}
+        self.sessions = {}
+        self.aps = {}
+        self.chutes = {}
+        self.files = {}
+        self.updates = {}
+
+        self.route(None, '^auth/signin$', self.signin)
+        self.route(None, '^auth/signout$', self.signout)
+        self.route('GET', '^ap/list$', self.apList)
+        self.route('GET', '^ap/([^/]+)/info$', self.apGetInfo)
+        self.route('POST', '^ap/([^/]+)/info$', self.apSetInfo)
+        self.route('GET', '^ap/([^/]+)/status$', self.apStatus)
+        self.route('GET', '^ap/([^/]+)/update$', self.apUpdate)
+        self.route(None, '^ap/([^/]+)/reset$', self.apReset)
+        self.route('GET', '^ap/([^/]+)/list$', self.apChutes)
+        self.route(None, '^ap/([^/]+)/newchute$', self.newChute)
+        self.route(None, '^chute/([^/]+)/delete$', self.deleteChute)
+        self.route('GET', '^chute/([^/]+)/info$', self.chuteGetInfo)
+        self.route('POST', '^chute/([^/]+)/info$', self.chuteSetInfo)
+        self.route('GET', '^chute/([^/]+)/data$', self.chuteGetData)
+        self.route('POST', '^chute/([^/]+)/data$', self.chuteSetData)
+        if(supportsPatch):
+            self.route('PATCH', '^chute/([^/]+)/data$', self.chutePatchData)
+        self.route(None, '^chute/([^/]+)/(enable|disable|freeze|unfreeze)$', self.chuteAction)
+        self.route('GET', '^chute/([^/]+)/status$', self.chuteStatus)
+        self.route('GET', '^chute/([^/]+)/update$', self.chuteUpdate)
+        self.route('GET', '^chute/([^/]+)/files$', self.chuteFiles)
+        self.route('PUT', '^chute/([^/]+)/file/(.+)$', self.putFile)
+        self.route('GET', '^chute/([^/]+)/file/(.+)$', self.statFile)
+        self.route('DELETE', '^chute/([^/]+)/file/(.+)$', self.deleteFile)
+
+    def __repr__(self):
+        return "<FakeParaDropAPI %d users, %d aps, %d chutes, %d calls>" % (len(self.users), len(self.aps),
+                len(self.chutes), self.calls)
+
+    ###########################################################################
+    # Setup
+    def addUser(self, uname, passwd, devid=None):
+        """Add a developer, @passwd is the cleartext password, returns the devid."""
+        devid = devid or pdutils.getNewGuid()
+        with self.lock:
+            self.users[uname] = {'password': md5.new(passwd).hexdigest(), 'devid': devid}
+        return devid
+
+    def addAP(self, name, devid=None, guid=None, contact='', devinfo=None):
+        """Add an AP owned by @devid, returns its guid."""
+        guid = guid or pdutils.getNewGuid()
+        with self.lock:
+            self.aps[guid] = {'name': name, 'guid': guid, 'contact': contact, 'devinfo': devinfo or {}, 'devid': devid,
+                              'status': {'online': True, 'uptime': 0}}
+        return guid
+
+    def addChute(self, apid, name='', state='stopped', **data):
+        """Add a chute to the AP, @data holds any of the struct, runtime, traffic, resource and files sections. Returns its guid."""
+        guid = data.pop('guid', None) or pdutils.getNewGuid()
+        with self.lock:
+            internalid = len(self.chutes) + 1
+            ch = {'name': name or 'c%04d' % internalid, 'guid': guid, 'apid': apid, 'contact': '', 'state': state,
+                  'internalid': internalid, 'devinfo': {}, 'struct': {}, 'runtime': [], 'traffic': [], 'resource': {},
+                  'files': []}
+            ch.update(data)
+            self.chutes[guid] = ch
+            self.files[guid] = {}
+        return guid
+
+    def addFile(self, chid, name, data):
+        """Store a file for the chute as if it had been uploaded."""
+        with self.lock:
+            self.files.setdefault(chid, {})[name] = {'data': data, 'size': len(data),
+                                                      'sha1': hashlib.sha1(data).hexdigest(), 'mtime': time.time()}
+
+    def populate(self, numAPs, chutesPerAP, devid=None):
+        """Create @numAPs APs each with @chutesPerAP chutes, for every developer if @devid is None. Returns the AP guids."""
+        if(devid is None):
+            devids = [u['devid'] for u in self.users.values()] or [None]
+        else:
+            devids = [devid]
+        guids = []
+        for d in devids:
+            for i in range(numAPs):
+                apid = self.addAP('ap%03d' % i, d)
+                guids.append(apid)
+                for j in range(chutesPerAP):
+                    chid = self.addChute(apid, state='running', runtime=[{'name': 'app', 'program': '/usr/bin/app'}],
+                            resource={'cpu': 10, 'memory': 16384})
+                    self.addFile(chid, 'app.conf', 'option enabled 1\n')
+        return guids
+
+    def inject(self, regex=None, latency=0.0, jitter=0.0, errorRate=0.0, errorCode=pdapi.ERR_DBISSUE):
+        """Add a Fault to the calls matching @regex, returns it so it can be removed with clearFaults(fault)."""
+        f = Fault(regex, latency, jitter, errorRate, errorCode)
+        with self.lock:
+            self.faults.append(f)
+        return f
+
+    def clearFaults(self, fault=None):
+        with self.lock:
+            if(fault):
+                self.faults = [f for f in self.faults if f is not fault]
+            else:
+                self.faults = []
+
+    ###########################################################################
+    # Dispatch
+    def dispatch(self, httpMethod, method, body, headers):
+        if(method == BATCH_METHOD):
+            return LocalAPI.dispatch(self, httpMethod, method, body, headers)
+
+        for f in list(self.faults):
+            if(not f.matches(method)):
+                continue
+            delay = f.latency + random.uniform(0, f.jitter)
+            if(delay > 0):
+                time.sleep(delay)
+            if(f.errorRate and random.random() < f.errorRate):
+                self.calls += 1
+                return f.errorCode, None
+
+        if(self.requireAuth and method != 'auth/signin'):
+            if(self.devid(headers) is None):
+                self.calls += 1
+                return pdapi.ERR_TOKEXPIRE, None
+        return LocalAPI.dispatch(self, httpMethod, method, body, headers)
+
+    def devid(self, headers):
+        """The devid of the session the request belongs to, None if it has no valid session."""
+        return self.sessions.get(headers.get('sessionToken', None), None)
+
+    def ok(self, data=None):
+        if(data is None):
+            return pdapi.OK, {'response': 'OK'}
+        return pdapi.OK, {'response': 'OK', 'data': data}
+
+    def getAP(self, guid):
+        return self.aps.get(guid, None)
+
+    def getChute(self, guid):
+        return self.chutes.get(guid, None)
+
+    def chuteDesc(self, ch, sections=False):
+        """The chute as the API returns it, with all of its data sections if @sections."""
+        keys = ['name', 'guid', 'apid', 'contact', 'state', 'internalid', 'devinfo']
+        if(sections):
+            keys += ['struct', 'runtime', 'traffic', 'resource', 'files']
+        return dict([(k, ch[k]) for k in keys])
+
+    ###########################################################################
+    # Handlers
+    def signin(self, match, body, headers):
+        if(pdutils.check(body, dict, ['username', 'password'])):
+            return pdapi.ERR_BADPARAM, None
+        u = self.users.get(body['username'], None)
+        if(not u or u['password'] != body['password']):
+            return pdapi.ERR_BADAUTH, None
+        tok = pdutils.generateToken()
+        with self.lock:
+            self.sessions[tok] = u['devid']
+        return pdapi.OK, {'sessionToken': tok, 'devid': u['devid']}
+
+    def signout(self, match, body, headers):
+        with self.lock:
+            self.sessions.pop(headers.get('sessionToken', None), None)
+        return self.ok()
+
+    def apList(self, match, body, headers):
+        devid = self.devid(headers)
+        with self.lock:
+            aps = [a for a in self.aps.values() if not self.requireAuth or a['devid'] == devid]
+            return pdapi.OK, [{'name': a['name'], 'guid': a['guid'], 'contact': a['contact'], 'devinfo': a['devinfo']}
+                              for a in sorted(aps, key=lambda a: a['name'])]
+
+    def apGetInfo(self, match, body, headers):
+        a = self.getAP(match.group(1))
+        if(not a):
+            return pdapi.ERR_BADPARAM, None
+        return self.ok({'name': a['name'], 'guid': a['guid'], 'contact': a['contact'], 'devinfo': a['devinfo']})
+
+    def apSetInfo(self, match, body, headers):
+        a = self.getAP(match.group(1))
+        if(not a or not isinstance(body, dict)):
+            return pdapi.ERR_BADPARAM, None
+        with self.lock:
+            for k in ('name', 'contact', 'devinfo'):
+                if(k in body):
+                    a[k] = body[k]
+        return self.ok()
+
+    def apStatus(self, match, body, headers):
+        a = self.getAP(match.group(1))
+        if(not a):
+            return pdapi.ERR_NOSTATUS, None
+        return self.ok(a['status'])
+
+    def apUpdate(self, match, body, headers):
+        u = self.updates.get(('ap', match.group(1)), None)
+        if(u is None):
+            return pdapi.ERR_NOSTATUS, None
+        return self.ok(u)
+
+    def apReset(self, match, body, headers):
+        apid = match.group(1)
+        if(not self.getAP(apid)):
+            return pdapi.ERR_BADPARAM, None
+        with self.lock:
+            self.updates[('ap', apid)] = {'action': 'reset', 'status': 'done', 'time': self.now()}
+        return self.ok()
+
+    def apChutes(self, match, body, headers):
+        apid = match.group(1)
+        if(not self.getAP(apid)):
+            return pdapi.ERR_BADPARAM, None
+        with self.lock:
+            chutes = [self.chuteDesc(c) for c in self.chutes.values() if c['apid'] == apid]
+        return self.ok(sorted(chutes, key=lambda c: c['internalid']))
+
+    def newChute(self, match, body, headers):
+        apid = match.group(1)
+        if(not self.getAP(apid)):
+            return pdapi.ERR_BADPARAM, None
+        guid = self.addChute(apid)
+        return self.ok(self.chuteDesc(self.chutes[guid]))
+
+    def deleteChute(self, match, body, headers):
+        with self.lock:
+            if(not self.chutes.pop(match.group(1), None)):
+                return pdapi.ERR_BADPARAM, None
+            self.files.pop(match.group(1), None)
+        return self.ok()
+
+    def chuteGetInfo(self, match, body, headers):
+        ch = self.getChute(match.group(1))
+        if(not ch):
+            return pdapi.ERR_BADPARAM, None
+        return self.ok(self.chuteDesc(ch))
+
+    def chuteSetInfo(self, match, body, headers):
+        ch = self.getChute(match.group(1))
+        if(not ch or not isinstance(body, dict)):
+            return pdapi.ERR_BADPARAM, None
+        with self.lock:
+            for k in ('name', 'contact', 'devinfo'):
+                if(k in body):
+                    ch[k] = body[k]
+        return self.ok()
+
+    def chuteGetData(self, match, body, headers):
+        ch = self.getChute(match.group(1))
+        if(not ch):
+            return pdapi.ERR_BADPARAM, None
+        return self.ok(self.chuteDesc(ch, True))
+
+    def chuteSetData(self, match, body, headers):
+        ch = self.getChute(match.group(1))
+        if(not ch or not isinstance(body, dict)):
+            return pdapi.ERR_BADPARAM, None
+        if(ch['state'] == 'frozen'):
+            return pdapi.ERR_CHUTESTATE, None
+        with self.lock:
+            for k in ('name', 'contact', 'devinfo', 'struct', 'runtime', 'traffic', 'resource', 'files'):
+                if(k in body):
+                    ch[k] = body[k]
+            self.updates[('chute', ch['guid'])] = {'action': 'data', 'status': 'done', 'time': self.now()}
+        return self.ok()
+
+    def chutePatchData(self, match, body, headers):
+        """Takes the {'merge': {section: merge patch}, 'replace': {section: value}} Chute.diffSections makes."""
+        ch = self.getChute(match.group(1))
+        if(not ch or not isinstance(body, dict)):
+            return pdapi.ERR_BADPARAM, None
+        merge = body.get('merge', None) or {}
+        replace = body.get('replace', None) or {}
+        if(not isinstance(merge, dict) or not isinstance(replace, dict)):
+            return pdapi.ERR_BADPARAM, None
+        if(ch['state'] == 'frozen'):
+            return pdapi.ERR_CHUTESTATE, None
+        with self.lock:
+            for k in ('name', 'contact', 'devinfo', 'struct', 'runtime', 'traffic', 'resource', 'files'):
+                if(k in replace):
+                    ch[k] = replace[k]
+                elif(k in merge):
+                    ch[k] = pdutils.applyMergePatch(ch.get(k, None), merge[k])
+            self.updates[('chute', ch['guid'])] = {'action': 'data', 'status': 'done', 'time': self.now()}
+        return self.ok()
+
+    def chuteAction(self, match, body, headers):
+        ch = self.getChute(match.group(1))
+        if(not ch):
+            return pdapi.ERR_BADPARAM, None
+        action = match.group(2)
+        nextState = CHUTE_ACTIONS[action]
+        with self.lock:
+            if(not pdutils.isValidStateTransition(ch['state'], nextState)):
+                return pdapi.ERR_STATECHANGE, None
+            ch['state'] = nextState
+            self.updates[('chute', ch['guid'])] = {'action': action, 'status': 'done', 'state': nextState, 'time': self.now()}
+        return self.ok()
+
+    def chuteStatus(self, match, body, headers):
+        ch = self.getChute(match.group(1))
+        if(not ch):
+            return pdapi.ERR_NOSTATUS, None
+        return self.ok({'state': ch['state']})
+
+    def chuteUpdate(self, match, body, headers):
+        u = self.updates.get(('chute', match.group(1)), None)
+        if(u is None):
+            return pdapi.ERR_NOSTATUS, None
+        return self.ok(u)
+
+    def fileData(self, body, headers):
+        """The contents of an uploaded file: raw for octet-stream, otherwise the base64 JSON string the client sends."""
+        if(body is None):
+            return ''
+        if(headers.get('Content-Type', '') == 'application/octet-stream'):
+            return body
+        if(body[:1] == '"'):
+            body = json.loads(body)
+        # json2str percent-encodes the string, base64 has no '%' of its own so this is safe either way
+        return base64.b64decode(urllib.unquote(str(body)))
+
+    def putFile(self, match, body, headers):
+        chid, name = match.groups()
+        if(not self.getChute(chid)):
+            return pdapi.ERR_BADPARAM, None
+        try:
+            data = self.fileData(body, headers)
+        except Exception:
+            return pdapi.ERR_BADFORMAT, None
+        self.addFile(chid, name, data)
+        return self.ok()
+
+    def fileStats(self, name, f):
+        return {'name': name, 'size': f['size'], 'sha1': f['sha1'], 'mtime': f['mtime']}
+
+    def statFile(self, match, body, headers):
+        chid, name = match.groups()
+        f = self.files.get(chid, {}).get(name, None)
+        if(not f):
+            return pdapi.ERR_BADPATH, None
+        # Asking for the raw data gets the file contents rather than its stats
+        if(headers.get('Accept', '') == 'application/octet-stream'):
+            return pdapi.OK, RawBody(f['data'])
+        return self.ok(self.fileStats(name, f))
+
+    def deleteFile(self, match, body, headers):
+        chid, name = match.groups()
+        with self.lock:
+            if(not self.files.get(chid, {}).pop(name, None)):
+                return pdapi.ERR_BADPATH, None
+        return self.ok()
+
+    def chuteFiles(self, match, body, headers):
+        chid = match.group(1)
+        if(not self.getChute(chid)):
+            return pdapi.ERR_BADPARAM, None
+        with self.lock:
+            return pdapi.OK, [self.fileStats(n, f) for n, f in sorted(self.files.get(chid, {}).items())]
@@ -0,0 +1,90 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Run the same ParaDropAPIClient call against many APs or chutes at once.
+"""
+
+import time
+
+from lib.paradrop import *
+from lib.paradrop.api.pdapi import PDAPIError
+from lib.paradrop.utils.pdfuture import WorkerPool, asCompleted
+
+DEFAULT_FLEET_WORKERS = 8
+
+class FleetResult:
+    """
+        Outcome of a call against one target.
+            Members:
+                @target  : the AP, Chute or guid the call was made with
+                @result  : what the client call returned, None if it raised
+                @error   : the exception the call raised, None if it returned
+                @elapsed : seconds the call took
+                @index   : position of @target in the list of targets the call was submitted with
+    """
+    def __init__(self, target, result=None, error=None, elapsed=0.0, index=None):
+        self.target = target
+        self.index = index
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        if(self.error):
+            return "<FleetResult %r error: %s>" % (self.target, str(self.error))
+        return "<FleetResult %r (%.3fs)>" % (self.target, self.elapsed)
+
+class FleetExecutor:
+    """
+        Fans a client call out over a list of targets on a bounded thread pool.
+        A failure against one target is kept in its FleetResult (and in @errors) instead of stopping the rest.
+            Arguments:
+                @client  : the ParaDropAPIClient to make the calls with
+                @workers : maximum number of calls in flight at once
+    """
+    def __init__(self, client, workers=DEFAULT_FLEET_WORKERS):
+        self.client = client
+        self.workers = WorkerPool(workers, "pdfleet")
+        self.errors = []
+
+    def __repr__(self):
+        return "<FleetExecutor %d errors, %r>" % (len(self.errors), self.workers)
+
+    def _call(self, func, index, target, args, kwargs):
+        start = time.time()
+        try:
+            return FleetResult(target, func(target, *args, **kwargs), None, time.time() - start, index)
+        except Exception as e:
+            return FleetResult(target, None, e, time.time() - start, index)
+
+    def submit(self, methodName, targets, *args, **kwargs):
+        """Queue client.methodName(target, *args, **kwargs) for every target, returns the list of Futures."""
+        func = getattr(self.client, methodName, None)
+        if(not callable(func)):
+            raise PDAPIError('fleet', 'Unknown client method %s' % methodName)
+        return [self.workers.submit(self._call, func, i, t, args, kwargs) for i, t in enumerate(targets)]
+
+    def map(self, methodName, targets, *args, **kwargs):
+        """
+            Generator that yields a FleetResult for each target as its call completes (not in target order),
+            its @index says where the target was in @targets.
+            Results that hold an error are also appended to @errors.
+        """
+        for f in asCompleted(self.submit(methodName, targets, *args, **kwargs)):
+            r = f.result()
+            if(r.error):
+                self.errors.append(r)
+            yield r
+
+    def run(self, methodName, targets, *args, **kwargs):
+        """Blocking version of map(), returns the list of FleetResults in the same order as @targets."""
+        futures = self.submit(methodName, targets, *args, **kwargs)
+        results = [f.result() for f in futures]
+        self.errors.extend([r for r in results if r.error])
+        return results
+
+    def close(self, wait=True):
+        self.workers.shutdown(wait)
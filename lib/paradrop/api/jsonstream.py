@@ -0,0 +1,155 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Incremental decoding of large JSON list responses.
+    The elements of the list are decoded one at a time as the blocks of the body arrive,
+    so the memory used depends on the size of an element rather than the whole response.
+"""
+
+import json
+
+from lib.paradrop import *
+from lib.paradrop import _fromJson, _fromJsonDoc
+
+WHITESPACE = ' \t\n\r'
+# What can follow a complete value, anything else may be the rest of a number split between blocks
+DELIMITERS = WHITESPACE + ',]}:'
+
+class JSONArrayStream:
+    """
+        Yields the elements of a JSON array read from an iterable of str @blocks.
+        The array is either the whole document (@key None) or the value of @key in a top level object,
+        the other values of that object are decoded whole and kept in @fields.
+        Each element is decoded the same way str2json would decode it as part of the whole document.
+    """
+    def __init__(self, blocks, key=None):
+        self._blocks = iter(blocks)
+        self._key = key
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+        self.fields = {}
+        self.found = False
+        self.count = 0
+
+    def __repr__(self):
+        return "<JSONArrayStream %s %d elements>" % (self._key, self.count)
+
+    def _more(self):
+        """Read the next block onto the buffer, returns False at the end of the body."""
+        if(self._eof):
+            return False
+        # Let go of what has been decoded already
+        if(self._pos):
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        for block in self._blocks:
+            if(block):
+                self._buf += block
+                return True
+        self._eof = True
+        return False
+
+    def _peek(self):
+        """Skip whitespace and return the next char without consuming it, '' at the end of the body."""
+        while(True):
+            buf = self._buf
+            pos = self._pos
+            n = len(buf)
+            while(pos < n and buf[pos] in WHITESPACE):
+                pos += 1
+            self._pos = pos
+            if(pos < n):
+                return buf[pos]
+            if(not self._more()):
+                return ''
+
+    def _expect(self, chars):
+        c = self._peek()
+        if(not c or c not in chars):
+            raise ValueError("Expected one of '%s' at %d, got '%s'" % (chars, self._pos, c))
+        self._pos += 1
+        return c
+
+    def _value(self):
+        """Decode the next JSON value, reading more of the body until all of it (and what follows it) is buffered."""
+        self._peek()
+        while(True):
+            decoded = None
+            try:
+                obj, end = self._decoder.raw_decode(self._buf, self._pos)
+                # A value not followed by a delimiter may continue in the next block (ie a number)
+                if(self._eof or (end < len(self._buf) and self._buf[end] in DELIMITERS)):
+                    self._pos = end
+                    return obj
+                decoded = (obj, end - self._pos)
+            except ValueError:
+                if(self._eof):
+                    raise
+            # Read at least as much again as is pending so a large value isn't decoded over and over,
+            # at the end of the body the next try finishes the value or raises
+            pending = len(self._buf) - self._pos
+            while(self._more() and len(self._buf) - self._pos < 2 * pending):
+                pass
+            # The value ran to the end of the body, no need to decode it again
+            if(decoded and len(self._buf) - self._pos == pending):
+                self._pos += decoded[1]
+                return decoded[0]
+
+    def _elements(self, level):
+        self.found = True
+        self._expect('[')
+        if(self._peek() == ']'):
+            self._pos += 1
+            return
+        while(True):
+            self.count += 1
+            yield _fromJson(self._value(), level)
+            if(self._expect(',]') == ']'):
+                return
+
+    def __iter__(self):
+        c = self._peek()
+        if(self._key is None):
+            if(c != '['):
+                raise ValueError("Expected a JSON array, got '%s'" % c)
+            for e in self._elements(1):
+                yield e
+            return
+
+        self._expect('{')
+        if(self._peek() == '}'):
+            self._pos += 1
+            return
+        while(True):
+            key = _fromJson(self._value(), 1)
+            self._expect(':')
+            if(key == self._key and self._peek() == '['):
+                for e in self._elements(1):
+                    yield e
+            else:
+                self.fields[key] = _fromJson(self._value(), 1)
+            if(self._expect(',}') == '}'):
+                return
+
+class JSONValueStream(JSONArrayStream):
+    """
+        Yields each of the JSON values read from an iterable of str @blocks, where the values follow one
+        another separated only by whitespace (ie JSON lines, or a single document however it is indented).
+        Each value is decoded the same way str2json would decode it on its own.
+    """
+    def __init__(self, blocks):
+        JSONArrayStream.__init__(self, blocks)
+
+    def __repr__(self):
+        return "<JSONValueStream %d values>" % self.count
+
+    def __iter__(self):
+        self.found = True
+        while(self._peek()):
+            self.count += 1
+            yield _fromJsonDoc(self._value())
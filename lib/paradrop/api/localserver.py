@@ -0,0 +1,329 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Local stand-in for the ParaDrop API server so the client can be exercised offline.
+
+    LocalAPI holds the routes (and understands the batch envelope sent by batch.BatchQueue),
+    LocalAPIServer serves a LocalAPI over HTTP/1.1 with keep-alive on a background thread.
+"""
+
+import re, time, socket, threading, BaseHTTPServer, SocketServer
+
+from lib.paradrop import *
+from lib.paradrop import JSON, getSerializer
+from lib.paradrop.api import pdapi
+from lib.paradrop.utils import pdutils
+from lib.paradrop.api.compress import gzipCompress, gzipDecompress, DEFAULT_COMPRESS_THRESHOLD
+
+BATCH_METHOD = "batch"
+
+class RawBody:
+    """Handlers return this as the response object to send @data as is rather than JSON encoded."""
+    def __init__(self, data, contentType='application/octet-stream'):
+        self.data = data
+        self.contentType = contentType
+
+    def __repr__(self):
+        return "<RawBody %s (%d bytes)>" % (self.contentType, len(self.data))
+
+def parseRange(header, size):
+    """Returns the (first, last) byte of a 'bytes=first-last' Range header for a body of @size, None if not satisfiable."""
+    try:
+        unit, spec = header.split('=', 1)
+        if(unit.strip() != 'bytes' or ',' in spec):
+            return None
+        first, last = spec.strip().split('-', 1)
+        if(not first):
+            # Suffix range, the last N bytes
+            n = int(last)
+            if(n <= 0):
+                return None
+            return max(0, size - n), size - 1
+        first = int(first)
+        if(last):
+            last = min(int(last), size - 1)
+        else:
+            last = size - 1
+        if(first >= size or last < first):
+            return None
+        return first, last
+    except ValueError:
+        return None
+
+class LocalAPI:
+    """
+        Routes API calls to handler functions.
+        Handlers are registered with route(httpMethod, regex, func) and called as func(match, body, headers),
+        they return a tuple of (code, response object), the response object is encoded for them as JSON,
+        or in the first format listed in the Accept header we have a Serializer for
+        unless it is a RawBody.
+        @clockOffset is added to the time the API gives out (update times, the Date header), to act as a server
+        whose clock is off from the client's.
+    """
+    def __init__(self):
+        self.routes = []
+        self.calls = 0
+        self.clockOffset = 0.0
+        self.route(None, '^%s$' % BATCH_METHOD, self.batch)
+
+    def __repr__(self):
+        return "<%s %d routes, %d calls>" % (self.__class__.__name__, len(self.routes), self.calls)
+
+    def now(self):
+        """The time on this server's clock."""
+        return time.time() + self.clockOffset
+
+    def route(self, httpMethod, regex, func):
+        """Register func for the method path matching @regex, @httpMethod None matches any."""
+        self.routes.append((httpMethod, re.compile(regex), func))
+
+    def dispatch(self, httpMethod, method, body, headers):
+        """Find the handler for this call and run it, returns (code, response object)."""
+        self.calls += 1
+        pathFound = False
+        for hm, regex, func in self.routes:
+            m = regex.match(method)
+            if(not m):
+                continue
+            if(hm and hm != httpMethod):
+                pathFound = True
+                continue
+            try:
+                return func(m, body, headers)
+            except Exception as e:
+                out.lazy('err', '!! %s Handler for %s failed: %s\n', LOGPREFIX, method, e)
+                return pdapi.ERR_CONTACTPD, None
+        # The path is there, just not for this method
+        if(pathFound):
+            return pdapi.ERR_BADMETHOD, None
+        return pdapi.ERR_BADPATH, None
+
+    def batch(self, match, body, headers):
+        """
+            Unpacks a batch envelope, runs each call through dispatch() and packs the responses back up.
+            Request:  {"requests": [{"id": .., "method": .., "httpMethod": .., "body": ..}, ...]}
+            Response: {"response": "OK", "data": [{"id": .., "code": .., "msg": .., "body": ..}, ...]}
+        """
+        res = pdutils.check(body, dict, ["requests"])
+        if(res or not isinstance(body['requests'], list)):
+            return pdapi.ERR_BADFORMAT, None
+        data = []
+        for item in body['requests']:
+            if(not isinstance(item, dict) or 'method' not in item):
+                data.append({'id': None, 'code': pdapi.ERR_BADFORMAT, 'msg': pdapi.RESP_MSG[pdapi.ERR_BADFORMAT], 'body': None})
+                continue
+            hm = item.get('httpMethod', None)
+            if(not hm):
+                if(item.get('body', None) is None):
+                    hm = 'GET'
+                else:
+                    hm = 'POST'
+            code, resp = self.dispatch(hm, item['method'], item.get('body', None), headers)
+            data.append({'id': item.get('id', None), 'code': code, 'msg': pdapi.RESP_MSG.get(code, None), 'body': resp})
+        return pdapi.OK, {'response': 'OK', 'data': data}
+
+class EchoAPI(LocalAPI):
+    """Answers every call with OK and echoes the call back, enough to test and time the transport."""
+    def __init__(self):
+        LocalAPI.__init__(self)
+        self.route(None, '^(.*)$', self.echo)
+
+    def echo(self, match, body, headers):
+        return pdapi.OK, {'response': 'OK', 'data': {'method': match.group(1), 'body': body}}
+
+class LocalAPIHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Turns HTTP requests into LocalAPI.dispatch() calls."""
+    protocol_version = 'HTTP/1.1'
+    # Buffer the writes so the status, headers and body leave in one go
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def date_time_string(self, timestamp=None):
+        # The Date header follows the API's clock
+        if(timestamp is None):
+            timestamp = self.server.api.now()
+        return BaseHTTPServer.BaseHTTPRequestHandler.date_time_string(self, timestamp)
+
+    def readBody(self):
+        """Read the request body, undoing any gzip Content-Encoding."""
+        raw = self.readRaw()
+        if(raw is not None and self.headers.get('Content-Encoding', '').lower() == 'gzip'):
+            raw = gzipDecompress(raw)
+        return raw
+
+    def readRaw(self):
+        """Read the request body, handling both Content-Length and chunked transfer encoding."""
+        if(self.headers.get('Transfer-Encoding', '').lower() == 'chunked'):
+            chunks = []
+            while(True):
+                size = int(self.rfile.readline().split(';')[0].strip(), 16)
+                if(size == 0):
+                    # Trailing CRLF after the last chunk
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return ''.join(chunks)
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        if(length):
+            return self.rfile.read(length)
+        return None
+
+    def decodeBody(self, raw):
+        """JSON (or any format we have a Serializer for) bodies are handed to the API decoded, anything else as the raw str."""
+        if(raw is None):
+            return None
+        ser = getSerializer(self.headers.get('Content-Type', '') or 'application/octet-stream')
+        if(ser):
+            return ser.loads(raw)
+        return raw
+
+    def responseSerializer(self):
+        """The first type of the Accept header we can send, JSON if there is none."""
+        for t in self.headers.get('Accept', '').split(','):
+            ser = getSerializer(t.strip() or 'application/json')
+            if(ser):
+                return ser
+        return JSON
+
+    def sendRaw(self, raw):
+        """Send a RawBody, honoring a Range header on it."""
+        b = raw.data
+        headers = {}
+        code = pdapi.OK
+        rng = self.headers.get('Range', None)
+        if(rng):
+            r = parseRange(rng, len(b))
+            if(r is None):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % len(b))
+                self.send_header('Content-Length', 0)
+                self.end_headers()
+                return
+            code = 206
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (r[0], r[1], len(b))
+            b = b[r[0]:r[1] + 1]
+        self.send_response(code)
+        self.send_header('Content-Type', raw.contentType)
+        self.send_header('Accept-Ranges', 'bytes')
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', len(b))
+        self.end_headers()
+        self.wfile.write(b)
+
+    def sendResult(self, code, resp):
+        if(isinstance(resp, RawBody) and code == pdapi.OK):
+            return self.sendRaw(resp)
+        ser = self.responseSerializer()
+        if(resp is None):
+            b = ''
+        else:
+            b = ser.dumps(resp)
+        # Use our own messages for the error codes, the HTTP ones don't match what pdapi means
+        if(code == pdapi.OK):
+            self.send_response(code)
+        else:
+            self.send_response(code, pdapi.RESP_MSG.get(code, None))
+        self.send_header('Content-Type', ser.contentType)
+        if(len(b) >= self.server.compressThreshold and 'gzip' in self.headers.get('Accept-Encoding', '')):
+            b = gzipCompress(b)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', len(b))
+        self.end_headers()
+        self.wfile.write(b)
+
+    def handleAny(self):
+        method = self.path.split('?')[0]
+        prefix = self.server.prefix
+        if(method.startswith(prefix)):
+            method = method[len(prefix):]
+        try:
+            body = self.decodeBody(self.readBody())
+        except Exception:
+            return self.sendResult(pdapi.ERR_BADFORMAT, None)
+        code, resp = self.server.api.dispatch(self.command, method, body, self.headers)
+        self.sendResult(code, resp)
+
+    do_GET = handleAny
+    do_POST = handleAny
+    do_PUT = handleAny
+    do_DELETE = handleAny
+    do_PATCH = handleAny
+
+class LocalAPIServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+        Serves a LocalAPI on @addr, port 0 picks a free port.
+        Use start() to run it on a background thread and @url as the base url for the ParaDropAPIClient.
+        Responses of at least @compressThreshold bytes are gzip encoded for clients that accept it, None to never compress.
+        stop() also closes the keep-alive connections still open so their handler threads finish.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, api, addr=('127.0.0.1', 0), prefix='/v1/', handler=LocalAPIHandler,
+            compressThreshold=DEFAULT_COMPRESS_THRESHOLD):
+        BaseHTTPServer.HTTPServer.__init__(self, addr, handler)
+        self.api = api
+        self.prefix = prefix
+        if(compressThreshold is None):
+            compressThreshold = float('inf')
+        self.compressThreshold = compressThreshold
+        self._thread = None
+        self._stopping = False
+        # Sockets of the requests being handled, so stop() can cut them off
+        self._requests = set()
+        self._cond = threading.Condition()
+
+    def __repr__(self):
+        return "<LocalAPIServer %s %r>" % (self.url, self.api)
+
+    @property
+    def url(self):
+        return 'http://%s:%d%s' % (self.server_address[0], self.server_address[1], self.prefix)
+
+    def start(self):
+        """Serve requests on a background thread, returns the base url."""
+        self._thread = threading.Thread(target=self.serve_forever, name="pdlocalserver")
+        self._thread.daemon = True
+        self._thread.start()
+        return self.url
+
+    def process_request(self, request, client_address):
+        with self._cond:
+            self._requests.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        with self._cond:
+            self._requests.discard(request)
+            self._cond.notify_all()
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def handle_error(self, request, client_address):
+        # Connections cut off by stop() are expected to fail
+        if(not self._stopping):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+    def stop(self, timeout=5.0):
+        """Stop serving, close the connections still open and wait up to @timeout seconds for their handlers to finish."""
+        self._stopping = True
+        if(self._thread):
+            self.shutdown()
+        self.server_close()
+        with self._cond:
+            # Wakes up handlers waiting on a keep-alive connection for the next request
+            for request in self._requests:
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+            end = time.time() + timeout
+            while(self._requests and time.time() < end):
+                self._cond.wait(end - time.time())
@@ -0,0 +1,264 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Latency, size and error metrics of the API calls made by ParaDropAPIClient, kept per endpoint family
+    (see pdapi.endpointFamily) in fixed memory histograms, and exporters for Prometheus text and JSON lines.
+"""
+
+import os, time, json, errno, socket, threading
+
+from lib.paradrop import *
+from lib.paradrop.pderror import PDError
+from lib.paradrop.api import pdapi
+from lib.paradrop.utils.pdstats import Histogram, LATENCY_BUCKETS, SIZE_BUCKETS
+
+# Where the time of a call goes, the first four are measured by the connection pool for each request sent,
+# total is the whole call however it ended (see APIMetrics.call)
+PHASES = ('connect', 'send', 'wait', 'read', 'decode', 'total')
+
+class EndpointMetrics:
+    """Histograms and counters of a single endpoint family."""
+    def __init__(self, family):
+        self.family = family
+        self.phases = dict([(p, Histogram(LATENCY_BUCKETS)) for p in PHASES])
+        self.sent = Histogram(SIZE_BUCKETS)
+        self.received = Histogram(SIZE_BUCKETS)
+        self.codes = {}
+        self.errors = {}
+        self.calls = 0
+        self.cacheHits = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<EndpointMetrics %s %d calls>" % (self.family, self.calls)
+
+    def count(self, d, key):
+        with self._lock:
+            d[key] = d.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            codes = dict([(str(k), v) for k, v in self.codes.items()])
+            errors = dict(self.errors)
+            calls = self.calls
+            cacheHits = self.cacheHits
+        return {'family': self.family, 'calls': calls, 'cacheHits': cacheHits, 'codes': codes, 'errors': errors,
+                'phases': dict([(p, h.snapshot()) for p, h in self.phases.items()]),
+                'bytesSent': self.sent.snapshot(), 'bytesReceived': self.received.snapshot()}
+
+class APIMetrics:
+    """
+        Collects the metrics of every call, the memory used only grows with the number of endpoint families.
+        Can be shared between clients and threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.started = time.time()
+
+    def __repr__(self):
+        return "<APIMetrics %d endpoints>" % len(self._endpoints)
+
+    def get(self, method):
+        """Returns the EndpointMetrics for the family of @method."""
+        family = pdapi.endpointFamily(method)
+        with self._lock:
+            m = self._endpoints.get(family, None)
+            if(not m):
+                m = EndpointMetrics(family)
+                self._endpoints[family] = m
+            return m
+
+    def call(self, method, seconds, cached=False):
+        """
+            Record one call of @method however it ended (answered, failed, from the cache or a batch),
+            @seconds is its total time. Counts the calls, whatever number of requests each one sent.
+        """
+        m = self.get(method)
+        m.phases['total'].observe(seconds)
+        with m._lock:
+            m.calls += 1
+            if(cached):
+                m.cacheHits += 1
+
+    def record(self, method, timings=None, sent=None, received=None, code=None, error=None):
+        """
+            Record one request of @method, there can be several to a call when it is retried.
+            Arguments:
+                @timings  : dict of phase: seconds, any phase missing is not recorded
+                @sent     : request body bytes on the wire
+                @received : response body bytes on the wire
+                @code     : the HTTP/pdapi status code
+                @error    : name of the exception if the request never got a response
+        """
+        m = self.get(method)
+        if(timings):
+            for p, v in timings.items():
+                h = m.phases.get(p, None)
+                if(h):
+                    h.observe(v)
+        if(sent is not None):
+            m.sent.observe(sent)
+        if(received is not None):
+            m.received.observe(received)
+        if(code is not None):
+            m.count(m.codes, code)
+        if(error is not None):
+            m.count(m.errors, error)
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        """Returns a dict of family: metrics dict."""
+        with self._lock:
+            endpoints = self._endpoints.items()
+        return dict([(k, v.snapshot()) for k, v in endpoints])
+
+def errorName(e):
+    """Short name of a transport exception for the error counters, ie ECONNREFUSED or timeout."""
+    if(isinstance(e, socket.timeout)):
+        return 'timeout'
+    code = getattr(e, 'errno', None)
+    if(code in errno.errorcode):
+        return errno.errorcode[code]
+    return e.__class__.__name__
+
+def _labels(d):
+    return ','.join(['%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in sorted(d.items())])
+
+def _promHistogram(lines, name, labels, h):
+    cumulative = 0
+    for bound, c in h['buckets']:
+        cumulative += c
+        l = dict(labels)
+        if(bound is None):
+            l['le'] = '+Inf'
+        else:
+            l['le'] = repr(bound)
+        lines.append('%s_bucket{%s} %d' % (name, _labels(l), cumulative))
+    lines.append('%s_sum{%s} %r' % (name, _labels(labels), h['sum']))
+    lines.append('%s_count{%s} %d' % (name, _labels(labels), h['count']))
+
+def prometheusText(snapshot, prefix='pdapi'):
+    """Formats an APIMetrics snapshot in the Prometheus text exposition format."""
+    lines = ['# HELP %s_request_seconds Time spent in each phase of an API call' % prefix,
+             '# TYPE %s_request_seconds histogram' % prefix]
+    for family in sorted(snapshot.keys()):
+        for phase in PHASES:
+            _promHistogram(lines, '%s_request_seconds' % prefix, {'family': family, 'phase': phase},
+                    snapshot[family]['phases'][phase])
+
+    lines += ['# HELP %s_body_bytes Size of the request and response bodies on the wire' % prefix,
+              '# TYPE %s_body_bytes histogram' % prefix]
+    for family in sorted(snapshot.keys()):
+        _promHistogram(lines, '%s_body_bytes' % prefix, {'family': family, 'direction': 'sent'},
+                snapshot[family]['bytesSent'])
+        _promHistogram(lines, '%s_body_bytes' % prefix, {'family': family, 'direction': 'received'},
+                snapshot[family]['bytesReceived'])
+
+    lines += ['# HELP %s_calls_total Calls made, however they ended' % prefix,
+              '# TYPE %s_calls_total counter' % prefix]
+    for family in sorted(snapshot.keys()):
+        lines.append('%s_calls_total{%s} %d' % (prefix, _labels({'family': family}), snapshot[family]['calls']))
+
+    lines += ['# HELP %s_cache_hits_total Calls answered from the response cache' % prefix,
+              '# TYPE %s_cache_hits_total counter' % prefix]
+    for family in sorted(snapshot.keys()):
+        lines.append('%s_cache_hits_total{%s} %d' % (prefix, _labels({'family': family}), snapshot[family]['cacheHits']))
+
+    lines += ['# HELP %s_responses_total Responses by status code' % prefix,
+              '# TYPE %s_responses_total counter' % prefix]
+    for family in sorted(snapshot.keys()):
+        for code, n in sorted(snapshot[family]['codes'].items()):
+            lines.append('%s_responses_total{%s} %d' % (prefix, _labels({'family': family, 'code': code}), n))
+
+    lines += ['# HELP %s_errors_total Requests that got no response' % prefix,
+              '# TYPE %s_errors_total counter' % prefix]
+    for family in sorted(snapshot.keys()):
+        for err, n in sorted(snapshot[family]['errors'].items()):
+            lines.append('%s_errors_total{%s} %d' % (prefix, _labels({'family': family, 'error': err}), n))
+    return '\n'.join(lines) + '\n'
+
+def jsonLines(snapshot, now=None):
+    """Formats an APIMetrics snapshot as one JSON object per endpoint family, each stamped with the time."""
+    if(now is None):
+        now = time.time()
+    lines = []
+    for family in sorted(snapshot.keys()):
+        d = dict(snapshot[family])
+        d['time'] = now
+        lines.append(json.dumps(d, sort_keys=True))
+    return '\n'.join(lines) + '\n'
+
+def writePrometheus(metrics, path):
+    """Replace @path with the current metrics in Prometheus text format (for the node exporter textfile collector).
+        Returns True in failure, False otherwise."""
+    try:
+        tmp = '%s.tmp' % path
+        with open(tmp, 'w') as fd:
+            fd.write(prometheusText(metrics.snapshot()))
+        # Rename so a scrape never reads a half written file
+        os.rename(tmp, path)
+        return False
+    except Exception as e:
+        out.warn('** %s Unable to write metrics to %s: %s\n' % (logPrefix(), path, str(e)))
+        return True
+
+def appendJSONLines(metrics, path):
+    """Append the current metrics to @path as JSON lines.
+        Returns True in failure, False otherwise."""
+    try:
+        with open(path, 'a') as fd:
+            fd.write(jsonLines(metrics.snapshot()))
+        return False
+    except Exception as e:
+        out.warn('** %s Unable to write metrics to %s: %s\n' % (logPrefix(), path, str(e)))
+        return True
+
+class MetricsExporter:
+    """
+        Writes the metrics to @path every @interval seconds on a background thread.
+            Arguments:
+                @metrics  : the APIMetrics to export (ie client.metrics)
+                @path     : the file to write
+                @fmt      : 'prometheus' rewrites the file each time, 'jsonl' appends to it
+                @interval : seconds between writes
+    """
+    def __init__(self, metrics, path, fmt='prometheus', interval=60.0):
+        if(fmt == 'prometheus'):
+            self.write = writePrometheus
+        elif(fmt == 'jsonl'):
+            self.write = appendJSONLines
+        else:
+            raise PDError('METRICS', 'Unknown metrics format %s' % fmt)
+        self.metrics = metrics
+        self.path = path
+        self.fmt = fmt
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return "<MetricsExporter %s %s every %ss>" % (self.fmt, self.path, self.interval)
+
+    def _run(self):
+        while(not self._stop.wait(self.interval)):
+            self.write(self.metrics, self.path)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="pdmetrics")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread and write the metrics one last time."""
+        self._stop.set()
+        if(self._thread):
+            self._thread.join()
+        self.write(self.metrics, self.path)
@@ -63,6 +63,10 @@ RESP_MSG = {
   ERR_UNIMPLEMENTED: "Function unimplemented yet",
 }
 
+# The codes a server without PATCH support answers one with, the client falls back to sending the whole thing.
+# Not 404 or ERR_BADPATH, those can just as well mean the chute doesn't exist. 501 is HTTP Not Implemented.
+PATCH_UNSUPPORTED = (ERR_BADMETHOD, 501)
+
 
 def getResponse(code, *args):
     """Designed to be called to provide the arguments for the Request.setResponseCode()"""
@@ -75,6 +79,44 @@ def getErrorToken():
     """Generates a random string which is used to match client issues with log output."""
     return '%010d' % int(random.getrandbits(32))
 
+# Actions that change state on the server even when sent without a body
+MUTATING_ACTIONS = set(['signin', 'signout', 'newchute', 'delete', 'reset', 'enable', 'disable', 'freeze', 'unfreeze'])
+
+def splitMethod(method):
+    """
+        Breaks an API method path into (kind, guid, action), where kind is "ap", "chute" or "auth".
+        Example:
+            "chute/<guid>/file/www.tar" => ("chute", "<guid>", "file")
+            "ap/list" => ("ap", None, "list")
+    """
+    parts = method.strip('/').split('/')
+    if(len(parts) >= 3):
+        return parts[0], parts[1], parts[2]
+    elif(len(parts) == 2):
+        return parts[0], None, parts[1]
+    else:
+        return parts[0], None, None
+
+def endpointFamily(method):
+    """Returns the method path with the guid and file name replaced by '*' (ie "chute/*/file/*")."""
+    kind, guid, action = splitMethod(method)
+    if(not guid):
+        return method.strip('/')
+    parts = method.strip('/').split('/')
+    fam = "%s/*/%s" % (kind, action)
+    if(len(parts) > 3):
+        fam += "/*"
+    return fam
+
+def isMutating(method, hasBody, httpMethod=None):
+    """Returns True if the call can change data on the server, so it is not safe to cache or blindly repeat."""
+    if(httpMethod in ('PUT', 'DELETE', 'PATCH')):
+        return True
+    if(hasBody or httpMethod == 'POST'):
+        return True
+    kind, guid, action = splitMethod(method)
+    return action in MUTATING_ACTIONS
+
 def getAPIKeys(method):
     """Returns the default key set related to the @method argument."""
     if(method in DEFAULT_API_KEYS.keys()):
@@ -0,0 +1,366 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Keep-alive HTTP/1.1 connection pool used by the ParaDropAPIClient.
+
+    Connections are kept per (scheme, host, port) and handed out to one caller at a time,
+    so a single pool can be shared by several clients and threads.
+"""
+
+import httplib, socket, select, threading, time, urlparse
+
+from lib.paradrop import *
+from lib.paradrop.api.compress import GzipDecoder
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_IDLE_TIMEOUT = 60.0
+READ_BLOCK_SIZE = 64 * 1024
+# Requests that can be sent twice without harm, unless they have a body
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+class PooledResponse:
+    """
+        The result of a request made through the HTTPConnectionPool.
+            Members:
+                @status  : the HTTP status code
+                @reason  : the HTTP reason phrase
+                @headers : dict of the response headers (lower case keys)
+                @data    : the full body of the response, already decompressed if it was sent gzip encoded
+                @wireSize: the number of body bytes that came over the wire
+                @sentSize: the number of body bytes sent with the request
+                @timings : dict of seconds spent in each phase: connect, send, wait (for the response headers), read
+    """
+    def __init__(self, status, reason, headers, data, wireSize=None, sentSize=0, timings=None):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.data = data
+        if(wireSize is None):
+            wireSize = len(data)
+        self.wireSize = wireSize
+        self.sentSize = sentSize
+        self.timings = timings or {}
+
+    def __repr__(self):
+        return "<PooledResponse %d %s (%d bytes)>" % (self.status, self.reason, len(self.data))
+
+class HTTPConnectionPool:
+    """
+        Thread safe pool of persistent HTTP connections.
+            Arguments:
+                @maxSize     : number of idle connections kept alive for each host, any extra connections are closed after use
+                @idleTimeout : seconds a connection may sit idle before it is evicted from the pool
+                @timeout     : socket timeout applied to new connections, None for the global default
+    """
+    def __init__(self, maxSize=DEFAULT_POOL_SIZE, idleTimeout=DEFAULT_IDLE_TIMEOUT, timeout=None):
+        self.maxSize = maxSize
+        self.idleTimeout = idleTimeout
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # Maps (scheme, host, port) to a list of [conn, lastUsed] with the most recently used at the end
+        self._idle = {}
+
+    def __repr__(self):
+        return "<HTTPConnectionPool %d hosts, %d idle>" % (len(self._idle), sum([len(v) for v in self._idle.values()]))
+
+    def _newConn(self, key):
+        """Create a new connection for the (scheme, host, port) key."""
+        scheme, host, port = key
+        if(scheme == 'https'):
+            connCls = httplib.HTTPSConnection
+        else:
+            connCls = httplib.HTTPConnection
+        if(self.timeout is None):
+            return connCls(host, port)
+        else:
+            return connCls(host, port, timeout=self.timeout)
+
+    def _isDropped(self, conn):
+        """True if the server has closed the idle connection @conn (it reads as ready with nothing left to say)."""
+        if(conn.sock is None):
+            return True
+        try:
+            r, w, x = select.select([conn.sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return True
+        return bool(r)
+
+    def _getConn(self, key):
+        """Returns a tuple of (conn, reused), taking an idle connection for this host if we have one."""
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while(idle):
+                conn, lastUsed = idle.pop()
+                if(now - lastUsed <= self.idleTimeout and not self._isDropped(conn)):
+                    return conn, True
+                conn.close()
+        return self._newConn(key), False
+
+    def _putConn(self, key, conn):
+        """Return a connection to the pool, closing it if we already hold enough for this host."""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if(len(idle) < self.maxSize):
+                idle.append([conn, time.time()])
+                return
+        conn.close()
+
+    def evictIdle(self):
+        """Close every connection that has been idle for longer than @idleTimeout.
+            Returns the number of connections closed."""
+        now = time.time()
+        closed = 0
+        with self._lock:
+            for key, idle in self._idle.items():
+                keep = []
+                for conn, lastUsed in idle:
+                    if(now - lastUsed > self.idleTimeout):
+                        conn.close()
+                        closed += 1
+                    else:
+                        keep.append([conn, lastUsed])
+                if(keep):
+                    self._idle[key] = keep
+                else:
+                    del(self._idle[key])
+        return closed
+
+    def close(self):
+        """Close all idle connections held by the pool."""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, lastUsed in idle:
+                    conn.close()
+            self._idle = {}
+
+    def _send(self, conn, method, path, body, headers):
+        """
+            Send the request line, headers and body on the connection.
+            A body that is not a str is treated as an iterable of blocks which are written as they are produced,
+            if the caller did not provide a Content-Length the blocks are sent with chunked transfer encoding.
+            Returns the number of body bytes sent.
+        """
+        if(body is None or isinstance(body, str)):
+            conn.request(method, path, body, headers)
+            return len(body or '')
+
+        names = [k.lower() for k in headers.keys()]
+        chunked = ('content-length' not in names)
+        conn.putrequest(method, path, skip_host=('host' in names), skip_accept_encoding=('accept-encoding' in names))
+        for k, v in headers.iteritems():
+            conn.putheader(k, v)
+        if(chunked):
+            conn.putheader('Transfer-Encoding', 'chunked')
+        conn.endheaders()
+
+        sent = 0
+        for block in body:
+            if(not block):
+                continue
+            sent += len(block)
+            if(chunked):
+                conn.send('%x\r\n%s\r\n' % (len(block), block))
+            else:
+                conn.send(block)
+        if(chunked):
+            conn.send('0\r\n\r\n')
+        return sent
+
+    def _read(self, resp):
+        """Read the whole body, returns (data, wireSize) undoing any gzip Content-Encoding as each block arrives."""
+        if(resp.getheader('content-encoding', '').lower() != 'gzip'):
+            data = resp.read()
+            return data, len(data)
+        dec = GzipDecoder()
+        parts = []
+        wire = 0
+        while(True):
+            block = resp.read(READ_BLOCK_SIZE)
+            if(not block):
+                break
+            wire += len(block)
+            parts.append(dec.decompress(block))
+        parts.append(dec.flush())
+        return ''.join(parts), wire
+
+    def _request(self, method, url, body, headers, preload, idempotent=None):
+        """
+            Send the request on a pooled connection. If a kept-alive one turns out to have been dropped the request
+            is sent again on a fresh connection, but only if it is @idempotent (by default a GET or HEAD without a body)
+            since the server may have acted on it before the connection went. Anything else raises, and it is up to
+            the caller (ie the client's RetryPolicy) whether to try again.
+            If @preload the body is read and the connection returned to the pool.
+            Returns (key, conn, resp, sentBytes, timings, data, wireSize), data and wireSize are None without @preload.
+        """
+        u = urlparse.urlsplit(url)
+        if(u.port):
+            port = u.port
+        elif(u.scheme == 'https'):
+            port = httplib.HTTPS_PORT
+        else:
+            port = httplib.HTTP_PORT
+        key = (u.scheme, u.hostname, port)
+        path = u.path or '/'
+        if(u.query):
+            path += '?' + u.query
+
+        if(idempotent is None):
+            idempotent = (method in IDEMPOTENT_METHODS and body is None)
+
+        while(True):
+            t0 = time.time()
+            conn, reused = self._getConn(key)
+            data = wireSize = None
+            try:
+                if(conn.sock is None):
+                    conn.connect()
+                t1 = time.time()
+                sent = self._send(conn, method, path, body, headers or {})
+                t2 = time.time()
+                resp = conn.getresponse()
+                t3 = time.time()
+                if(preload):
+                    data, wireSize = self._read(resp)
+                t4 = time.time()
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                # The server may have dropped a kept-alive connection while it sat idle, it may also have
+                # done the work and then dropped it, so only send again what is safe to send twice
+                if(reused and idempotent and (body is None or isinstance(body, str) or hasattr(body, 'rewind'))):
+                    if(hasattr(body, 'rewind')):
+                        body.rewind()
+                    continue
+                raise
+            except:
+                # Anything else (ie the body stream or the gzip decoder failing) still leaves the connection half used
+                conn.close()
+                raise
+
+            timings = {'connect': t1 - t0, 'send': t2 - t1, 'wait': t3 - t2}
+            if(preload):
+                timings['read'] = t4 - t3
+                self._release(key, conn, resp)
+            return key, conn, resp, sent, timings, data, wireSize
+
+    def _release(self, key, conn, resp):
+        """Return the connection to the pool once @resp has been read to the end, otherwise close it."""
+        if(resp.will_close or not resp.isclosed()):
+            conn.close()
+        else:
+            self._putConn(key, conn)
+
+    def urlopen(self, method, url, body=None, headers=None, idempotent=None):
+        """
+            Perform the HTTP request on a pooled connection.
+            Arguments:
+                @method  : the HTTP method (GET, POST, PUT, ...)
+                @url     : the full url to request
+                @body    : str of the body to send, an iterable of str blocks to stream, or None
+                @headers : dict of headers to send
+                @idempotent : True if the request may safely reach the server twice, None to go by @method and @body
+            Returns:
+                A PooledResponse object, HTTP error codes are not treated as exceptions here.
+            Raises:
+                socket.error or httplib.HTTPException if the server could not be reached.
+        """
+        key, conn, resp, sent, timings, data, wireSize = self._request(method, url, body, headers, True, idempotent)
+        return PooledResponse(resp.status, resp.reason, dict(resp.getheaders()), data, wireSize, sent, timings)
+
+    def stream(self, method, url, body=None, headers=None, idempotent=None):
+        """
+            Like urlopen() but the response body is left on the connection for the caller to read as it arrives.
+            Returns:
+                A StreamedResponse, which must be read to the end or closed (use it as a context manager).
+        """
+        key, conn, resp, sent, timings, data, wireSize = self._request(method, url, body, headers, False, idempotent)
+        return StreamedResponse(self, key, conn, resp, sent, timings)
+
+class StreamedResponse:
+    """
+        A response whose body is read block by block as it arrives instead of being held in memory.
+        The connection goes back to the pool once the body has been read to the end, close() drops it otherwise.
+            Members:
+                @status, @reason, @headers, @sentSize, @timings : as PooledResponse
+                @length   : the number of body bytes still to come if known, None otherwise
+                @wireSize : the number of body bytes read off the wire so far
+    """
+    def __init__(self, pool, key, conn, resp, sentSize=0, timings=None):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = dict(resp.getheaders())
+        self.sentSize = sentSize
+        self.timings = timings or {}
+        self.wireSize = 0
+        self._gzip = (self.headers.get('content-encoding', '').lower() == 'gzip')
+        self._released = False
+
+    def __repr__(self):
+        return "<StreamedResponse %d %s (%d bytes read)>" % (self.status, self.reason, self.wireSize)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, value, tb):
+        self.close()
+        return False
+
+    @property
+    def length(self):
+        return self._resp.length
+
+    def blocks(self, blockSize=READ_BLOCK_SIZE):
+        """Generator over the body in blocks of up to @blockSize (decompressed if it was gzip encoded)."""
+        dec = None
+        if(self._gzip):
+            dec = GzipDecoder()
+        while(True):
+            block = self._resp.read(blockSize)
+            if(not block):
+                break
+            self.wireSize += len(block)
+            if(dec):
+                block = dec.decompress(block)
+                if(not block):
+                    continue
+            yield block
+        if(dec):
+            block = dec.flush()
+            if(block):
+                yield block
+        self.close()
+
+    def read(self):
+        """Read the rest of the body."""
+        return ''.join(self.blocks())
+
+    def readinto(self, buf):
+        """
+            Read the next part of the body into the bytearray @buf, returns the number of bytes read, 0 at the end.
+            Where the response has its own readinto() the body is received straight into @buf,
+            otherwise it goes through read() so httplib still handles the length and chunking.
+        """
+        resp = self._resp
+        if(self._gzip):
+            raise httplib.HTTPException("readinto() cannot decode a gzip body, use blocks()")
+        if(hasattr(resp, 'readinto')):
+            n = resp.readinto(buf)
+        else:
+            data = resp.read(len(buf))
+            n = len(data)
+            buf[:n] = data
+        self.wireSize += n
+        return n
+
+    def close(self):
+        """Give the connection back to the pool if the body was read to the end, otherwise close it."""
+        if(not self._released):
+            self._released = True
+            self._pool._release(self._key, self._conn, self._resp)
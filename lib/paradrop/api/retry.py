@@ -0,0 +1,132 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Retry and circuit breaker policies used by ParaDropAPIClient.sendRequest.
+"""
+
+import random, time, threading
+
+from lib.paradrop import *
+from lib.paradrop.api import pdapi
+
+# Codes where the server is telling us to try again, nothing was changed
+RETRY_CODES = set([pdapi.ERR_DBISSUE])
+
+class RetryPolicy:
+    """
+        Decides if and when a failed request is sent again.
+        Read only calls are retried on transport errors (connection refused, reset, timeout) and on @retryCodes.
+        Mutating calls are never retried on transport errors since the server may have applied them,
+        only on @retryCodes which mean the change was not made (unless @retryMutating is False).
+        Codes such as ERR_BADAUTH or ERR_TOKEXPIRE are never retried.
+            Arguments:
+                @maxRetries    : number of times a request is sent again before giving up
+                @backoff       : base seconds of the exponential backoff
+                @maxBackoff    : cap on a single backoff
+                @retryCodes    : set of pdapi codes that are worth retrying
+                @retryMutating : allow mutating calls to be retried on @retryCodes
+    """
+    def __init__(self, maxRetries=2, backoff=0.25, maxBackoff=5.0, retryCodes=RETRY_CODES, retryMutating=True):
+        self.maxRetries = maxRetries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.retryCodes = set(retryCodes)
+        self.retryMutating = retryMutating
+
+    def __repr__(self):
+        return "<RetryPolicy %d retries, %.2fs-%.2fs>" % (self.maxRetries, self.backoff, self.maxBackoff)
+
+    def shouldRetry(self, attempt, mutating, code=None):
+        """
+            Returns True if the request should be sent again.
+            Arguments:
+                @attempt  : how many retries have already been made
+                @mutating : True if the call changes data on the server
+                @code     : the HTTP/pdapi code that came back, None for a transport error
+        """
+        if(attempt >= self.maxRetries):
+            return False
+        if(code is None):
+            return not mutating
+        if(code not in self.retryCodes):
+            return False
+        return self.retryMutating or not mutating
+
+    def delay(self, attempt):
+        """Seconds to wait before retry number @attempt, exponential with full jitter so clients spread out."""
+        return random.uniform(0, min(self.maxBackoff, self.backoff * (2 ** attempt)))
+
+NO_RETRY = RetryPolicy(maxRetries=0)
+
+CLOSED = "closed"
+OPEN = "open"
+HALFOPEN = "halfopen"
+
+class CircuitBreaker:
+    """
+        Stops sending requests to an endpoint after it keeps failing.
+        After @failThreshold failures in a row the circuit opens and requests fail right away for @resetTimeout seconds,
+        then a single trial request is let through: success closes the circuit, failure opens it again.
+    """
+    def __init__(self, failThreshold=5, resetTimeout=30.0):
+        self.failThreshold = failThreshold
+        self.resetTimeout = resetTimeout
+        self.state = CLOSED
+        self.failures = 0
+        self.openedAt = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<CircuitBreaker %s (%d failures)>" % (self.state, self.failures)
+
+    def allow(self):
+        """Returns True if a request may be sent now."""
+        with self._lock:
+            if(self.state == CLOSED):
+                return True
+            if(self.state == OPEN and time.time() - self.openedAt >= self.resetTimeout):
+                # Let this one request through as a trial
+                self.state = HALFOPEN
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if(self.state == HALFOPEN or self.failures >= self.failThreshold):
+                self.state = OPEN
+                self.openedAt = time.time()
+
+class CircuitBreakers:
+    """Keeps one CircuitBreaker per endpoint family (see pdapi.endpointFamily) so one bad call doesn't block the rest."""
+    def __init__(self, failThreshold=5, resetTimeout=30.0):
+        self.failThreshold = failThreshold
+        self.resetTimeout = resetTimeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<CircuitBreakers %s>" % ', '.join(['%s:%s' % (k, v.state) for k, v in self._breakers.items()])
+
+    def get(self, method):
+        """Returns the CircuitBreaker for the endpoint family of @method."""
+        family = pdapi.endpointFamily(method)
+        with self._lock:
+            b = self._breakers.get(family, None)
+            if(not b):
+                b = CircuitBreaker(self.failThreshold, self.resetTimeout)
+                self._breakers[family] = b
+            return b
+
+    def states(self):
+        """Returns a dict of family: state."""
+        with self._lock:
+            return dict([(k, v.state) for k, v in self._breakers.items()])
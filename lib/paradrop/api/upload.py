@@ -0,0 +1,306 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Request bodies that stream chute files to the API server block by block,
+    so the memory used by an upload does not depend on the size of the file.
+    Also keeps track of what was last uploaded so unchanged files can be skipped.
+"""
+
+import os, base64, urllib, hashlib, threading, tarfile, gzip, Queue
+
+from lib.paradrop import *
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+class FileBodyStream:
+    """
+        Iterable request body which reads the file in fixed size blocks as they are sent.
+            Arguments:
+                @path      : the file to send
+                @blockSize : bytes read from the file for each block
+                @progress  : optional function called as progress(sentBytes, totalBytes) after each block
+    """
+    contentType = 'application/octet-stream'
+
+    def __init__(self, path, blockSize=DEFAULT_BLOCK_SIZE, progress=None):
+        self.path = path
+        self.blockSize = blockSize
+        self.progress = progress
+        self.size = os.path.getsize(path)
+        self.sent = 0
+        self._sha1 = hashlib.sha1()
+
+    def __repr__(self):
+        return "<%s %s (%d/%d)>" % (self.__class__.__name__, self.path, self.sent, self.size)
+
+    def getLength(self):
+        """Return the number of bytes this body will put on the wire, or None if not known ahead of time."""
+        return self.size
+
+    def rewind(self):
+        """Start over, the connection pool calls this before it resends the body."""
+        self.sent = 0
+
+    def hexdigest(self):
+        """The sha1 of the file, complete once the whole body has been sent."""
+        return self._sha1.hexdigest()
+
+    def blocks(self):
+        """Generator over the raw blocks of the file, updating the progress and sha1 as each one is consumed."""
+        self.sent = 0
+        self._sha1 = hashlib.sha1()
+        with open(self.path, 'rb') as fd:
+            while(True):
+                block = fd.read(self.blockSize)
+                if(not block):
+                    break
+                self._sha1.update(block)
+                yield block
+                # Once we are resumed the block has been written out
+                self.sent += len(block)
+                if(self.progress):
+                    self.progress(self.sent, self.size)
+
+    def __iter__(self):
+        return self.blocks()
+
+class Base64BodyStream(FileBodyStream):
+    """
+        Produces the same body as the buffered putChuteFile (the base64 data as a percent-encoded JSON string)
+        one block at a time, for servers that only understand that format.
+        The encoded length is not known until the data is read so it is sent with chunked transfer encoding.
+    """
+    contentType = 'application/json'
+
+    def __init__(self, path, blockSize=DEFAULT_BLOCK_SIZE, progress=None):
+        # Keep each block a multiple of 3 bytes so the base64 of the blocks concatenate without padding
+        FileBodyStream.__init__(self, path, max(3, blockSize - blockSize % 3), progress)
+
+    def getLength(self):
+        return None
+
+    def __iter__(self):
+        yield '"'
+        for block in self.blocks():
+            yield urllib.quote(base64.b64encode(block), ' ')
+        yield '"'
+
+class _StopProducer(Exception):
+    pass
+
+class _QueueWriter:
+    """File like object handing what is written to a queue in blocks, for the tar producer thread."""
+    def __init__(self, queue, blockSize, stop):
+        self.queue = queue
+        self.blockSize = blockSize
+        self.stop = stop
+        self.buf = []
+        self.buffered = 0
+
+    def put(self, item):
+        # Don't block forever if the consumer went away
+        while(True):
+            if(self.stop.is_set()):
+                raise _StopProducer()
+            try:
+                return self.queue.put(item, True, 0.5)
+            except Queue.Full:
+                pass
+
+    def write(self, data):
+        self.buf.append(data)
+        self.buffered += len(data)
+        if(self.buffered >= self.blockSize):
+            self.flush()
+
+    def flush(self):
+        if(self.buf):
+            self.put(('data', ''.join(self.buf)))
+            self.buf = []
+            self.buffered = 0
+
+class TarBodyStream:
+    """
+        Request body which is a gzipped tar archive of a directory, built while it is being sent so
+        the archive never exists on disk or in memory as a whole. A producer thread writes the archive into
+        a bounded queue the body is read from, the sha1 of the archive is computed as it goes out.
+        The archive is reproducible (sorted entries, no gzip timestamp) so an unchanged directory gives the same sha1.
+            Arguments:
+                @dirPath   : the directory to archive, its contents are stored relative to it
+                @blockSize : size of the blocks put on the wire
+                @progress  : optional function called as progress(sentBytes, None) after each block
+                @queueSize : number of blocks the producer can get ahead of the connection
+    """
+    contentType = 'application/octet-stream'
+
+    def __init__(self, dirPath, blockSize=DEFAULT_BLOCK_SIZE, progress=None, queueSize=8):
+        self.path = dirPath
+        self.blockSize = blockSize
+        self.progress = progress
+        self.queueSize = queueSize
+        self.sent = 0
+        self.members = 0
+        self._sha1 = hashlib.sha1()
+
+    def __repr__(self):
+        return "<TarBodyStream %s (%d sent)>" % (self.path, self.sent)
+
+    def getLength(self):
+        return None
+
+    def rewind(self):
+        """Start over, the archive is produced again the next time the body is iterated."""
+        self.sent = 0
+
+    def hexdigest(self):
+        """The sha1 of the archive, complete once the whole body has been sent."""
+        return self._sha1.hexdigest()
+
+    def _produce(self, queue, stop):
+        """Producer thread, writes the archive into @queue followed by a ('done', None) or ('error', e) item."""
+        w = _QueueWriter(queue, self.blockSize, stop)
+        try:
+            gz = gzip.GzipFile('', 'wb', 9, w, 0)
+            tar = tarfile.open(fileobj=gz, mode='w|')
+            members = 0
+            for root, dirs, files in os.walk(self.path):
+                dirs.sort()
+                for name in dirs + sorted(files):
+                    p = os.path.join(root, name)
+                    tar.add(p, os.path.relpath(p, self.path), False)
+                    members += 1
+            tar.close()
+            gz.close()
+            w.flush()
+            self.members = members
+            w.put(('done', None))
+        except _StopProducer:
+            pass
+        except Exception as e:
+            try:
+                w.put(('error', e))
+            except _StopProducer:
+                pass
+
+    def __iter__(self):
+        queue = Queue.Queue(self.queueSize)
+        stop = threading.Event()
+        t = threading.Thread(target=self._produce, args=(queue, stop), name="pdtar")
+        t.daemon = True
+        t.start()
+        self.sent = 0
+        self._sha1 = hashlib.sha1()
+        try:
+            while(True):
+                kind, item = queue.get()
+                if(kind == 'done'):
+                    break
+                if(kind == 'error'):
+                    raise item
+                self._sha1.update(item)
+                yield item
+                self.sent += len(item)
+                if(self.progress):
+                    self.progress(self.sent, None)
+        finally:
+            # Stops the producer if the upload was abandoned part way
+            stop.set()
+
+def progressPrinter(name, theOut=None):
+    """Returns a progress function that writes the upload percentage of @name to the info stream."""
+    if(not theOut):
+        theOut = out.info
+    def _progress(sent, total):
+        if(total):
+            theOut('\r-- Sending %s: %3d%%' % (name, sent * 100 / total))
+            if(sent >= total):
+                theOut('\n')
+        else:
+            theOut('\r-- Sending %s: %d bytes' % (name, sent))
+    return _progress
+
+def sha1File(path, blockSize=DEFAULT_BLOCK_SIZE):
+    """Returns the hex sha1 of the file at @path, reading it in blocks."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as fd:
+        while(True):
+            block = fd.read(blockSize)
+            if(not block):
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def defaultRecordPath():
+    """Location of the upload record, next to the pdcli state in PDPATH if defined."""
+    if('PDPATH' in os.environ):
+        return "%s/.pduploads" % os.environ['PDPATH']
+    else:
+        return "./.pduploads"
+
+class UploadRecord:
+    """
+        Local record of the files that were last uploaded to each chute.
+        Entries are keyed by chute guid and file name and store the sha1, size and mtime of the local file,
+        the size and mtime let us avoid hashing a file again if it has not been touched since it was sent.
+            Arguments:
+                @path : JSON file the record is kept in, None to only keep it in memory
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._files = {}
+        if(path and os.path.exists(path)):
+            try:
+                with open(path, 'r') as fd:
+                    self._files = str2json(fd.read())
+            except Exception as e:
+                out.lazy('warn', '** %s Unable to read upload record %s: %s\n', LOGPREFIX, path, e)
+                self._files = {}
+
+    def __repr__(self):
+        return "<UploadRecord %s (%d files)>" % (self.path, len(self._files))
+
+    def _key(self, chid, fileName):
+        return "%s/%s" % (chid, fileName)
+
+    def get(self, chid, fileName):
+        """Return the dict stored for this file of the chute or None if we have never sent it."""
+        with self._lock:
+            return self._files.get(self._key(chid, fileName), None)
+
+    def set(self, chid, fileName, sha1, size, mtime):
+        with self._lock:
+            self._files[self._key(chid, fileName)] = {'sha1': sha1, 'size': size, 'mtime': mtime}
+
+    def remove(self, chid, fileName):
+        with self._lock:
+            self._files.pop(self._key(chid, fileName), None)
+
+    def localSha1(self, chid, fileName, filePath):
+        """
+            Returns the sha1 of the local file, reusing the recorded value if the size and mtime
+            of the file still match what we saw when it was uploaded.
+        """
+        st = os.stat(filePath)
+        r = self.get(chid, fileName)
+        if(r and r['size'] == st.st_size and r['mtime'] == st.st_mtime):
+            return r['sha1']
+        return sha1File(filePath)
+
+    def save(self):
+        """Write the record out to @path.
+            Returns True in failure, False otherwise."""
+        if(not self.path):
+            return False
+        try:
+            with self._lock:
+                s = json2str(self._files)
+            with open(self.path, 'w') as fd:
+                fd.write(s)
+            return False
+        except Exception as e:
+            out.lazy('warn', '** %s Unable to save upload record %s: %s\n', LOGPREFIX, self.path, e)
+            return True
@@ -0,0 +1,278 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Watches the pending updates of many chutes and APs with a single scheduler,
+    instead of every caller running their own getChuteUpdate/getAPUpdate polling loop.
+"""
+
+import time, heapq, threading, itertools
+
+from lib.paradrop import *
+from lib.paradrop.ap import AP
+from lib.paradrop.chute import Chute
+from lib.paradrop.api.pdapi import PDAPIError
+from lib.paradrop.utils.pdfuture import Future, WorkerPool
+
+DEFAULT_WATCH_WORKERS = 4
+DEFAULT_MIN_INTERVAL = 1.0
+DEFAULT_MAX_INTERVAL = 30.0
+DEFAULT_WATCH_TIMEOUT = 600.0
+# How far the server clock may be from what we make of it (client.clockOffset() only has whole seconds)
+DEFAULT_CLOCK_SKEW = 2.0
+
+# Values in the update data which mean the update has not finished yet
+PENDING_VALUES = set(['pending', 'waiting', 'inprogress', 'in progress'])
+
+def isSettled(data):
+    """Default test for an update being finished: there is update data and nothing in it says it is still pending."""
+    if(not isinstance(data, dict)):
+        return False
+    if(data.get('pending', False)):
+        return False
+    for k in ('status', 'state', 'result'):
+        v = data.get(k, None)
+        if(isinstance(v, str) and v.lower() in PENDING_VALUES):
+            return False
+    return True
+
+# Keys of the update data holding the time the update was made
+UPDATE_TIME_KEYS = ('time', 'timestamp')
+
+def updateTime(data):
+    """The time the update @data was made, None if it doesn't say."""
+    if(not isinstance(data, dict)):
+        return None
+    for k in UPDATE_TIME_KEYS:
+        v = data.get(k, None)
+        if(isinstance(v, (int, long, float))):
+            return v
+    return None
+
+class _Waiter:
+    """
+        One caller waiting on a _Watch, with its own test for the update being done and its own deadline.
+        The first timestamped update seen is the baseline: it only counts if it was made no earlier than @since
+        (less @skew), any update after it is a new change and always counts.
+    """
+    def __init__(self, future, settled, since, deadline, skew):
+        self.future = future
+        self.settled = settled
+        self.since = since
+        self.deadline = deadline
+        self.skew = skew
+        self.baseline = None
+        self.stale = False
+
+    def isDone(self, data):
+        t = updateTime(data)
+        if(t is not None and self.baseline is None):
+            self.baseline = t
+            # An update made before the change this caller waits on is not the one they asked about
+            self.stale = (self.since is not None and t < self.since - self.skew)
+        if(self.stale and t is not None and t <= self.baseline):
+            return False
+        return self.settled(data)
+
+class _Watch:
+    """State kept for one chute or AP being watched, shared by everyone waiting on it."""
+    def __init__(self, kind, guid, interval):
+        self.kind = kind
+        self.guid = guid
+        self.interval = interval
+        self.waiters = []
+        self.last = None
+        self.polls = 0
+
+    def deadline(self):
+        """When the next waiter times out."""
+        return min([wt.deadline for wt in self.waiters])
+
+class UpdateWatcher:
+    """
+        Tracks pending chute and AP updates and resolves a Future for each one once it settles.
+        Each target has at most one getChuteUpdate/getAPUpdate in flight, and the time between polls of a target
+        grows by @factor while its update data stays the same (back to @minInterval as soon as it changes).
+            Arguments:
+                @client      : the ParaDropAPIClient to poll with
+                @workers     : maximum number of polls in flight across all targets
+                @minInterval : seconds between the first polls of a target
+                @maxInterval : the longest we wait between polls of a target
+                @factor      : how much the interval grows after each unchanged poll
+                @timeout     : default seconds before a watch gives up
+                @skew        : seconds the server clock may be off from client.clockOffset(), see watch()
+    """
+    def __init__(self, client, workers=DEFAULT_WATCH_WORKERS, minInterval=DEFAULT_MIN_INTERVAL,
+            maxInterval=DEFAULT_MAX_INTERVAL, factor=1.5, timeout=DEFAULT_WATCH_TIMEOUT, skew=DEFAULT_CLOCK_SKEW):
+        self.client = client
+        self.skew = skew
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.factor = factor
+        self.timeout = timeout
+        self.workers = WorkerPool(workers, "pdwatch")
+        self._cond = threading.Condition()
+        self._heap = []
+        self._watches = {}
+        self._seq = itertools.count()
+        self._thread = None
+        self._stopped = False
+
+    def __repr__(self):
+        return "<UpdateWatcher %d watching>" % len(self._watches)
+
+    def pending(self):
+        """Returns the number of targets still being watched."""
+        return len(self._watches)
+
+    def watchChute(self, ch, settled=None, callback=None, timeout=None, since=None):
+        """Returns a Future which resolves to the update data of the chute once settled(data) is True."""
+        if(isinstance(ch, Chute)):
+            ch = ch.guid
+        return self.watch('chute', ch, settled, callback, timeout, since)
+
+    def watchAP(self, ap, settled=None, callback=None, timeout=None, since=None):
+        """Returns a Future which resolves to the update data of the AP once settled(data) is True."""
+        if(isinstance(ap, AP)):
+            ap = ap.guid
+        return self.watch('ap', ap, settled, callback, timeout, since)
+
+    def watch(self, kind, guid, settled=None, callback=None, timeout=None, since=None):
+        """
+            Start watching the update of a 'chute' or 'ap' guid.
+            Arguments:
+                @settled  : function(data) returning True once the update is done, defaults to isSettled
+                @callback : function(future) called when the watch finishes
+                @timeout  : seconds before the Future fails with a PDAPIError, defaults to the watcher timeout
+                @since    : the update there when the watch starts is ignored if it was made (its 'time' or 'timestamp',
+                            see updateTime) before this time, so an update that finished earlier can't settle the watch,
+                            any later update is taken whatever its time. Defaults to when the client last sent a change
+                            to the target, or now if it hasn't. 0 accepts any update.
+                            It is in our time, the update times are in the server's: it is moved by
+                            client.clockOffset() and the watcher @skew is allowed for on top of that.
+            Returns:
+                A Future of the final update data. Watching a target which is already watched shares its polling,
+                each caller's @settled, @timeout and @since still apply only to their own Future.
+        """
+        if(timeout is None):
+            timeout = self.timeout
+        if(since is None):
+            since = getattr(self.client, 'lastChange', lambda k, g: None)(kind, guid)
+            if(since is None):
+                since = time.time()
+        if(since):
+            since += getattr(self.client, 'clockOffset', lambda: 0.0)()
+        f = Future()
+        if(callback):
+            f.addDoneCallback(callback)
+        with self._cond:
+            if(self._stopped):
+                raise PDAPIError('watch', 'Watcher has been stopped')
+            w = self._watches.get((kind, guid), None)
+            if(not w):
+                w = _Watch(kind, guid, self.minInterval)
+                self._watches[(kind, guid)] = w
+                # Poll right away, the update may already be done
+                self._schedule(w, 0)
+            w.waiters.append(_Waiter(f, settled or isSettled, since, time.time() + timeout, self.skew))
+            self._startThread()
+        return f
+
+    def _startThread(self):
+        if(not self._thread):
+            self._thread = threading.Thread(target=self._run, name="pdwatch-sched")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _schedule(self, w, delay):
+        """Queue the next poll of @w (caller holds the lock)."""
+        heapq.heappush(self._heap, (time.time() + delay, next(self._seq), w))
+        self._cond.notify()
+
+    def _resolve(self, w, results):
+        """
+            Resolve the futures of the waiters in @results, a list of (waiter, data, error), and stop watching @w
+            once nobody is waiting on it. Returns True if @w is still being watched.
+        """
+        with self._cond:
+            done = set([id(wt) for wt, data, error in results])
+            w.waiters = [wt for wt in w.waiters if id(wt) not in done]
+            watched = bool(w.waiters)
+            if(not watched):
+                self._watches.pop((w.kind, w.guid), None)
+        for wt, data, error in results:
+            if(error):
+                wt.future.setException(error)
+            else:
+                wt.future.setResult(data)
+        return watched
+
+    def _run(self):
+        """Scheduler thread, hands each poll that is due to the worker pool."""
+        while(True):
+            with self._cond:
+                while(not self._stopped and (not self._heap or self._heap[0][0] > time.time())):
+                    if(self._heap):
+                        self._cond.wait(self._heap[0][0] - time.time())
+                    else:
+                        self._cond.wait(60)
+                if(self._stopped):
+                    return
+                due, seq, w = heapq.heappop(self._heap)
+            self.workers.submit(self._poll, w)
+
+    def _poll(self, w):
+        """Runs on a worker, does one poll of @w and decides whether to finish or poll again."""
+        if(w.kind == 'chute'):
+            func = self.client.getChuteUpdate
+        else:
+            func = self.client.getAPUpdate
+        try:
+            data = func(w.guid)
+        except Exception as e:
+            out.lazy('warn', '** %s Error polling %s %s: %s\n', LOGPREFIX, w.kind, w.guid, e)
+            data = None
+        w.polls += 1
+
+        now = time.time()
+        with self._cond:
+            waiters = list(w.waiters)
+        results = []
+        for wt in waiters:
+            try:
+                if(wt.isDone(data)):
+                    results.append((wt, data, None))
+                    continue
+            except Exception as e:
+                results.append((wt, None, e))
+                continue
+            if(now > wt.deadline):
+                results.append((wt, None, PDAPIError("%s/%s/update" % (w.kind, w.guid), "Timed out waiting for update to settle")))
+        if(not self._resolve(w, results)):
+            return
+
+        # Back off while nothing changes, poll quickly again once something does
+        if(data != w.last):
+            w.interval = self.minInterval
+        else:
+            w.interval = min(self.maxInterval, w.interval * self.factor)
+        w.last = data
+        with self._cond:
+            if(self._stopped or not w.waiters):
+                return
+            self._schedule(w, min(w.interval, max(0, w.deadline() - time.time())))
+
+    def stop(self):
+        """Stop polling, every watch still pending fails with a PDAPIError."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            watches = self._watches.values()
+        for w in watches:
+            err = PDAPIError("%s/%s/update" % (w.kind, w.guid), "Watcher stopped")
+            with self._cond:
+                waiters = list(w.waiters)
+            self._resolve(w, [(wt, None, err) for wt in waiters])
+        self.workers.shutdown(False)
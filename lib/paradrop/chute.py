@@ -3,9 +3,14 @@
 # Authors: The Paradrop Team
 ###################################################################
 
+import json, itertools
+
 from lib.paradrop import *
+from lib.paradrop import sniffSerializer
 from lib.paradrop.pderror import PDError
 from lib.paradrop.utils import pdutils
+from lib.paradrop.utils import pdperf
+from lib.paradrop.api.jsonstream import JSONArrayStream, JSONValueStream
 
 STATE_INVALID = "invalid"
 STATE_DISABLED = "disabled"
@@ -13,12 +18,20 @@ STATE_RUNNING = "running"
 STATE_FROZEN = "frozen"
 STATE_STOPPED = "stopped"
 
-class Chute:
+# The sections of a chute the API server lets us change, see Chute.diffSections
+DATA_SECTIONS = ('name', 'contact', 'devinfo', 'struct', 'runtime', 'traffic', 'resource', 'files')
+# The sections which are dicts and so can be sent as a merge patch rather than whole
+DICT_SECTIONS = ('devinfo', 'struct', 'resource')
+
+class Chute(object):
     """
         Wrapper class for Chute objects.
+        Uses slots rather than a __dict__ so a fleet's worth of them can be held in memory.
     """
+    __slots__ = ('name', 'guid', 'apid', 'contact', 'state', 'internalid', 'devinfo', 'struct', 'runtime', 'traffic',
+                 'resource', 'files', '_cache', '_baseline')
 
-    def __init__(self, name="", guid="", apid="", contact="", state="", internalid="", devinfo={}, descriptor=None):
+    def __init__(self, name="", guid="", apid="", contact="", state="", internalid="", devinfo=None, descriptor=None):
         # Set these first so we don't have to worry about it later
         self.name = name
         self.guid = guid
@@ -26,6 +39,8 @@ class Chute:
         self.contact = contact
         self.state = state
         self.internalid = internalid
+        if(devinfo is None):
+            devinfo = {}
         self.devinfo = devinfo
         self.struct = {}
         self.runtime = []
@@ -33,6 +48,8 @@ class Chute:
         self.resource = {}
         self.files = []
         self._cache = {}
+        # The data sections as of the last sync with the API server, see markSynced
+        self._baseline = None
         
         # Descriptor will be a dict object of potentially ALL of the chute options
         if(descriptor):
@@ -55,6 +72,17 @@ class Chute:
                 self.loadCache(descriptor['cache'])
                 
 
+    def __getstate__(self):
+        """Slots have no __dict__ for pickle (the CLI saves its vars with it) or copy to use, so hand them one."""
+        return dict([(k, getattr(self, k)) for k in self.__slots__ if hasattr(self, k)])
+
+    def __setstate__(self, state):
+        # Also loads chutes pickled before slots, their state is the old __dict__
+        self._baseline = None
+        for k, v in state.iteritems():
+            if(k in self.__slots__):
+                setattr(self, k, v)
+
     def setObject(self, attr, data, jsonize=None):
         # This if block can fail, its ok the descriptor doesn't have to contain everything
         if(attr in data.keys()):
@@ -160,6 +188,48 @@ class Chute:
             return False
         return True
 
+    def markSynced(self):
+        """Remember the data sections as they are now, as what the API server has, so diffSections can tell what changed since."""
+        try:
+            self._baseline = dict([(k, json.dumps(getattr(self, k), sort_keys=True)) for k in DATA_SECTIONS])
+        except (TypeError, ValueError) as e:
+            out.warn('** %s Unable to snapshot chute %s: %s\n' % (logPrefix(), self.name, str(e)))
+            self._baseline = None
+
+    def diffSections(self):
+        """
+            Works out what changed in the data sections since markSynced.
+            Returns:
+                None if there is no baseline to compare to (the whole chute should be sent)
+                A dict {'merge': {section: merge patch}, 'replace': {section: new value}} of only the changed sections,
+                dict sections go as a merge patch (see pdutils.mergePatch) unless the patch can't express the change
+                An empty dict if nothing changed
+        """
+        if(not self._baseline):
+            return None
+        merge = {}
+        replace = {}
+        for k in DATA_SECTIONS:
+            v = getattr(self, k)
+            try:
+                now = json.dumps(v, sort_keys=True)
+            except (TypeError, ValueError):
+                return None
+            if(now == self._baseline.get(k, None)):
+                continue
+            old = None
+            if(k in DICT_SECTIONS and isinstance(v, dict) and k in self._baseline):
+                old = json.loads(self._baseline[k])
+            if(isinstance(old, dict)):
+                patch = pdutils.mergePatch(old, v)
+                if(patch is not None):
+                    merge[k] = patch
+                    continue
+            replace[k] = v
+        if(not merge and not replace):
+            return {}
+        return {'merge': merge, 'replace': replace}
+
     def getInternalName(self):
         """Return the internal name we use "c####" based on the internalid defined."""
         return "c%s" % self.internalid
@@ -213,6 +283,92 @@ class Chute:
             except:
                 out.warn('** %s Error adding Chute attribute: %s\n' % (logPrefix(), k))
 
+# Manifests at least this big are mmapped and decoded a block at a time rather than read into memory whole
+MMAP_THRESHOLD = 1024 * 1024
+MANIFEST_BLOCK_SIZE = 256 * 1024
+
+def _mmapBlocks(mm, blockSize=MANIFEST_BLOCK_SIZE):
+    for i in xrange(0, len(mm), blockSize):
+        yield mm[i:i + blockSize]
+
+def _manifestValues(fd):
+    """
+        Yields the dicts in the open manifest file @fd, which holds one, a list of them, or (JSON only)
+        one after another as JSON lines. Raises ValueError if it is malformed.
+    """
+    import os, mmap
+    size = os.fstat(fd.fileno()).st_size
+    if(not size):
+        return
+    mm = None
+    try:
+        if(size >= MMAP_THRESHOLD):
+            mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            blocks = _mmapBlocks(mm)
+        else:
+            blocks = iter([fd.read()])
+        first = next(blocks)
+        
+        # Binary manifests are told apart by their first byte, and are decoded whole
+        ser = sniffSerializer(first)
+        if(ser.binary):
+            if(mm):
+                c = ser.loads(mm[:])
+            else:
+                c = ser.loads(first)
+            if(isinstance(c, list)):
+                for v in c:
+                    yield v
+            else:
+                yield c
+            return
+        
+        blocks = itertools.chain([first], blocks)
+        if(first.lstrip()[:1] == '['):
+            stream = JSONArrayStream(blocks)
+        else:
+            stream = JSONValueStream(blocks)
+        for v in stream:
+            yield v
+    finally:
+        if(mm):
+            mm.close()
+
+def iterManifest(chPath, chCat=None):
+    """
+        Yields a new Chute for each chute in the manifest file at @chPath, one at a time as they are decoded.
+        The file can hold a single chute (what storeManifest writes), a list of them (JSON or MessagePack),
+        or JSON lines of them (what storeManifests writes).
+        Arguments:
+            @chPath : the path to the manifest file
+            @chCat : the category to pull from, if None then pull everything
+        Stops early if the path is missing or there is an error in the syntax, after logging it.
+    """
+    import os
+    if(not os.path.exists(chPath)):
+        out.err('!! %s Missing path: %s\n' % (logPrefix(), chPath))
+        return
+    with open(chPath, 'rb') as fd:
+        values = _manifestValues(fd)
+        try:
+            while(True):
+                try:
+                    c = next(values)
+                except StopIteration:
+                    return
+                except Exception as e:
+                    out.err('!! %s Error loading chute data: %s\n' % (logPrefix(), str(e)))
+                    return
+                if(not isinstance(c, dict)):
+                    out.err('!! %s Error loading chute data: not dict type\n' % logPrefix())
+                    return
+                theChute = Chute()
+                theChute.merge(c, chCat)
+                yield theChute
+        finally:
+            values.close()
+
+@pdperf.timed()
 def loadManifest(chPath, theChute, chCat=None):
     """
         Loads a manifest from the specified file location into a Chute object.
@@ -221,26 +377,25 @@ def loadManifest(chPath, theChute, chCat=None):
             @theChute : the chute to add to, if None then do a new Chute
             @chCat : the category to pull from, if None then pull everything
         Returns:
-            A Chute object loaded based on manifest definition
+            A Chute object loaded based on manifest definition, the first one if the file holds more (see iterManifest)
             None if missing or error in syntax
     """
     import os
     if(not os.path.exists(chPath)):
         out.err('!! %s Missing path: %s\n' % (logPrefix(), chPath))
         return None
-    s = ""
-    with open(chPath, 'r') as fd:
-        while(True):
-            line = fd.readline().rstrip()
-            if(not line):
-                break
-            s += line
-    
-    # Convert str to json
-    try:
-        c = str2json(s)
-    except Exception as e:
-        out.err('!! %s Error loading chute data: %s\n' % (logPrefix(), str(e)))
+    with open(chPath, 'rb') as fd:
+        # Convert str to json
+        values = _manifestValues(fd)
+        try:
+            c = next(values, None)
+        except Exception as e:
+            out.err('!! %s Error loading chute data: %s\n' % (logPrefix(), str(e)))
+            return None
+        finally:
+            values.close()
+    if(not isinstance(c, dict)):
+        out.err('!! %s Error loading chute data: no chute in %s\n' % (logPrefix(), chPath))
         return None
     if(not theChute):
         theChute = Chute()
@@ -248,25 +403,56 @@ def loadManifest(chPath, theChute, chCat=None):
     theChute.merge(c, chCat)
     return theChute
 
-def storeManifest(ch, chPath):
+@pdperf.timed()
+def storeManifest(ch, chPath, serializer=None):
     """
         Stores a manifest based on the chute provided to the location specified.
         Arguments:
             @ch : the Chute object
             @chPath : the path to the manifest file
+            @serializer : Serializer to write it with (ie paradrop.MSGPACK), None for indented JSON
         Returns:
             True in failure
             False otherwise
     """
     import os, json
     if(os.path.exists(chPath)):
-        out.info('-- %s Manifest exists, overwriting\n' % (logPrefix()))
+        out.lazy('info', '-- %s Manifest exists, overwriting\n', LOGPREFIX)
     try:
-        s = json.dumps(ch.getAPIDataFormat(), sort_keys=True, indent=4, separators=(',', ': '))
-        fd = open(chPath, 'w')
+        if(serializer):
+            s = serializer.dumps(ch.getAPIDataFormat())
+        else:
+            s = json.dumps(ch.getAPIDataFormat(), sort_keys=True, indent=4, separators=(',', ': '))
+        fd = open(chPath, 'wb')
         fd.write(s)
         fd.flush()
         fd.close()
         return False
     except:
         return True
+
+def storeManifests(chutes, chPath, serializer=None):
+    """
+        Stores the manifests of many chutes in one file, for iterManifest to load.
+        Arguments:
+            @chutes : the Chute objects
+            @chPath : the path to the manifest file
+            @serializer : Serializer to write them with as a list (ie paradrop.MSGPACK), None for JSON lines
+        Returns:
+            True in failure
+            False otherwise
+    """
+    import os
+    if(os.path.exists(chPath)):
+        out.lazy('info', '-- %s Manifest exists, overwriting\n', LOGPREFIX)
+    try:
+        with open(chPath, 'wb') as fd:
+            if(serializer):
+                fd.write(serializer.dumps([ch.getAPIDataFormat() for ch in chutes]))
+            else:
+                for ch in chutes:
+                    fd.write(json.dumps(ch.getAPIDataFormat(), sort_keys=True, separators=(',', ':')))
+                    fd.write('\n')
+        return False
+    except:
+        return True
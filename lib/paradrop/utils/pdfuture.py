@@ -0,0 +1,240 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Futures and a bounded pool of worker threads to run blocking calls on.
+"""
+
+import time, threading, Queue
+
+from lib.paradrop import *
+from lib.paradrop.pderror import PDError
+
+PENDING = "pending"
+RUNNING = "running"
+CANCELLED = "cancelled"
+FINISHED = "finished"
+
+class Future:
+    """
+        Holds the result of a call that will finish at some later point.
+            Arguments:
+                @deadline : optional time.time() value after which waiting on the result gives up
+    """
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self._cond = threading.Condition()
+        self._state = PENDING
+        self._result = None
+        self._exc = None
+        self._callbacks = []
+
+    def __repr__(self):
+        return "<Future %s>" % self._state
+
+    def _finish(self, state):
+        """Move into a final state, wake everyone up and run the callbacks (caller holds the lock)."""
+        self._state = state
+        self._cond.notifyAll()
+        cbs = self._callbacks
+        self._callbacks = []
+        return cbs
+
+    def _runCallbacks(self, cbs):
+        for fn in cbs:
+            try:
+                fn(self)
+            except Exception as e:
+                out.err('!! %s Future callback failed: %s\n' % (logPrefix(), str(e)))
+
+    def cancel(self):
+        """Cancel the call if it has not started running yet.
+            Returns True if it was cancelled."""
+        with self._cond:
+            if(self._state != PENDING):
+                return self._state == CANCELLED
+            cbs = self._finish(CANCELLED)
+        self._runCallbacks(cbs)
+        return True
+
+    def cancelled(self):
+        return self._state == CANCELLED
+
+    def running(self):
+        return self._state == RUNNING
+
+    def done(self):
+        return self._state in (CANCELLED, FINISHED)
+
+    def setRunning(self):
+        """Called by whoever runs the call, returns False if the future was cancelled and shouldn't run."""
+        with self._cond:
+            if(self._state != PENDING):
+                return False
+            self._state = RUNNING
+            return True
+
+    def setResult(self, result):
+        with self._cond:
+            if(self.done()):
+                return
+            self._result = result
+            cbs = self._finish(FINISHED)
+        self._runCallbacks(cbs)
+
+    def setException(self, e):
+        with self._cond:
+            if(self.done()):
+                return
+            self._exc = e
+            cbs = self._finish(FINISHED)
+        self._runCallbacks(cbs)
+
+    def addDoneCallback(self, fn):
+        """Call fn(future) once the future is done, right away if it already is."""
+        with self._cond:
+            if(not self.done()):
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _wait(self, timeout):
+        """Wait until done, using the deadline if no timeout is given. Returns True if done."""
+        if(timeout is None and self.deadline is not None):
+            timeout = max(0, self.deadline - time.time())
+        with self._cond:
+            if(timeout is None):
+                while(not self.done()):
+                    # Waiting with a timeout keeps the wait interruptable by Ctrl-C
+                    self._cond.wait(3600)
+            else:
+                end = time.time() + timeout
+                while(not self.done()):
+                    left = end - time.time()
+                    if(left <= 0):
+                        break
+                    self._cond.wait(left)
+            return self.done()
+
+    def exception(self, timeout=None):
+        """Return the exception raised by the call, or None if it succeeded."""
+        if(not self._wait(timeout)):
+            raise PDError('TIMEOUT', 'Timed out waiting for result')
+        if(self._state == CANCELLED):
+            raise PDError('CANCELLED', 'Call was cancelled')
+        return self._exc
+
+    def result(self, timeout=None):
+        """Return the result of the call, raising whatever it raised.
+            Raises PDError TIMEOUT if it didn't finish in time, PDError CANCELLED if it was cancelled."""
+        if(not self._wait(timeout)):
+            raise PDError('TIMEOUT', 'Timed out waiting for result')
+        if(self._state == CANCELLED):
+            raise PDError('CANCELLED', 'Call was cancelled')
+        if(self._exc):
+            raise self._exc
+        return self._result
+
+def asCompleted(futures, timeout=None):
+    """
+        Generator which yields the futures provided as each one finishes.
+        Raises PDError TIMEOUT if they are not all done within @timeout seconds.
+    """
+    done = Queue.Queue()
+    futures = list(futures)
+    for f in futures:
+        f.addDoneCallback(done.put)
+    if(timeout is not None):
+        end = time.time() + timeout
+    for i in range(len(futures)):
+        if(timeout is None):
+            # Queue.get without a timeout can't be interrupted, so just wait in large steps
+            while(True):
+                try:
+                    f = done.get(True, 3600)
+                    break
+                except Queue.Empty:
+                    pass
+        else:
+            try:
+                f = done.get(True, max(0, end - time.time()))
+            except Queue.Empty:
+                raise PDError('TIMEOUT', '%d of %d calls still pending' % (len(futures) - i, len(futures)))
+        yield f
+
+def gather(futures, timeout=None):
+    """Wait for all the futures, returns a list of their results in the same order."""
+    if(timeout is not None):
+        end = time.time() + timeout
+    res = []
+    for f in futures:
+        if(timeout is None):
+            res.append(f.result())
+        else:
+            res.append(f.result(max(0, end - time.time())))
+    return res
+
+class WorkerPool:
+    """
+        Fixed number of daemon threads which run the calls submitted to them in order.
+            Arguments:
+                @workers : the maximum number of calls running at the same time
+                @name    : prefix of the thread names
+    """
+    def __init__(self, workers=8, name="pdworker"):
+        self.workers = workers
+        self.name = name
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def __repr__(self):
+        return "<WorkerPool %s %d threads, %d queued>" % (self.name, len(self._threads), self._queue.qsize())
+
+    def _startThreads(self):
+        """Threads are only started once there is work for them."""
+        with self._lock:
+            while(len(self._threads) < self.workers):
+                t = threading.Thread(target=self._run, name="%s-%d" % (self.name, len(self._threads)))
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+
+    def _run(self):
+        while(True):
+            item = self._queue.get()
+            if(item is None):
+                return
+            f, fn, args, kwargs = item
+            if(not f.setRunning()):
+                continue
+            if(f.deadline is not None and time.time() > f.deadline):
+                f.setException(PDError('TIMEOUT', 'Deadline passed before the call could start'))
+                continue
+            try:
+                f.setResult(fn(*args, **kwargs))
+            except Exception as e:
+                f.setException(e)
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) to run on the pool, returns a Future.
+            The special keyword @_deadline sets the deadline of the Future."""
+        if(self._shutdown):
+            raise PDError('WORKERPOOL', 'Pool has been shutdown')
+        f = Future(kwargs.pop('_deadline', None))
+        self._startThreads()
+        self._queue.put((f, fn, args, kwargs))
+        return f
+
+    def shutdown(self, wait=True):
+        """Stop the threads once the queued work is done."""
+        self._shutdown = True
+        for t in self._threads:
+            self._queue.put(None)
+        if(wait):
+            for t in self._threads:
+                t.join()
+        self._threads = []
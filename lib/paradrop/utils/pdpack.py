@@ -0,0 +1,221 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Pure python MessagePack encoding (http://msgpack.org) of the types the API and manifests use:
+    None, bool, int/long, float, str/unicode, list/tuple and dict.
+    Strings go out as the msgpack str type holding UTF-8 and always come back as str, the same as str2json gives.
+    No percent encoding is needed, so the strings are sent as is.
+"""
+
+import struct
+
+CONTENT_TYPE = 'application/x-msgpack'
+
+_u8 = struct.Struct('>B')
+_u16 = struct.Struct('>H')
+_u32 = struct.Struct('>I')
+_u64 = struct.Struct('>Q')
+_i8 = struct.Struct('>b')
+_i16 = struct.Struct('>h')
+_i32 = struct.Struct('>i')
+_i64 = struct.Struct('>q')
+_f32 = struct.Struct('>f')
+_f64 = struct.Struct('>d')
+
+def _packInt(n, parts):
+    if(0 <= n < 0x80):
+        parts.append(chr(n))
+    elif(-32 <= n < 0):
+        parts.append(chr(n & 0xff))
+    elif(n >= 0):
+        if(n <= 0xff):
+            parts.append('\xcc' + _u8.pack(n))
+        elif(n <= 0xffff):
+            parts.append('\xcd' + _u16.pack(n))
+        elif(n <= 0xffffffff):
+            parts.append('\xce' + _u32.pack(n))
+        elif(n <= 0xffffffffffffffff):
+            parts.append('\xcf' + _u64.pack(n))
+        else:
+            raise ValueError("Integer too large to pack: %d" % n)
+    else:
+        if(n >= -0x80):
+            parts.append('\xd0' + _i8.pack(n))
+        elif(n >= -0x8000):
+            parts.append('\xd1' + _i16.pack(n))
+        elif(n >= -0x80000000):
+            parts.append('\xd2' + _i32.pack(n))
+        elif(n >= -0x8000000000000000):
+            parts.append('\xd3' + _i64.pack(n))
+        else:
+            raise ValueError("Integer too small to pack: %d" % n)
+
+def _packStr(s, parts):
+    n = len(s)
+    if(n < 32):
+        parts.append(chr(0xa0 | n))
+    elif(n <= 0xff):
+        parts.append('\xd9' + _u8.pack(n))
+    elif(n <= 0xffff):
+        parts.append('\xda' + _u16.pack(n))
+    else:
+        parts.append('\xdb' + _u32.pack(n))
+    parts.append(s)
+
+def _pack(obj, parts):
+    t = type(obj)
+    if(t is str):
+        _packStr(obj, parts)
+    elif(t is dict):
+        n = len(obj)
+        if(n < 16):
+            parts.append(chr(0x80 | n))
+        elif(n <= 0xffff):
+            parts.append('\xde' + _u16.pack(n))
+        else:
+            parts.append('\xdf' + _u32.pack(n))
+        for k, v in obj.iteritems():
+            _pack(k, parts)
+            _pack(v, parts)
+    elif(t is list or t is tuple):
+        n = len(obj)
+        if(n < 16):
+            parts.append(chr(0x90 | n))
+        elif(n <= 0xffff):
+            parts.append('\xdc' + _u16.pack(n))
+        else:
+            parts.append('\xdd' + _u32.pack(n))
+        for v in obj:
+            _pack(v, parts)
+    elif(obj is None):
+        parts.append('\xc0')
+    elif(t is bool):
+        if(obj):
+            parts.append('\xc3')
+        else:
+            parts.append('\xc2')
+    elif(t is int or t is long):
+        _packInt(obj, parts)
+    elif(t is float):
+        parts.append('\xcb' + _f64.pack(obj))
+    elif(t is unicode):
+        _packStr(obj.encode('utf-8'), parts)
+    # Subclasses of the above, ie an OrderedDict
+    elif(isinstance(obj, dict)):
+        _pack(dict(obj), parts)
+    elif(isinstance(obj, (list, tuple))):
+        _pack(list(obj), parts)
+    elif(isinstance(obj, basestring)):
+        _pack(unicode(obj), parts)
+    elif(isinstance(obj, (int, long))):
+        _packInt(int(obj), parts)
+    elif(isinstance(obj, float)):
+        _pack(float(obj), parts)
+    else:
+        raise TypeError("Cannot pack %s" % t.__name__)
+
+def packb(obj):
+    """Returns @obj encoded as a MessagePack str."""
+    parts = []
+    _pack(obj, parts)
+    return ''.join(parts)
+
+class _Unpacker:
+    """Decodes one value from @data starting at @pos, use unpackb()."""
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def __repr__(self):
+        return "<_Unpacker at %d of %d>" % (self.pos, len(self.data))
+
+    def _take(self, n):
+        p = self.pos
+        end = p + n
+        if(end > len(self.data)):
+            raise ValueError("Truncated MessagePack data at %d" % p)
+        self.pos = end
+        return self.data[p:end]
+
+    def _struct(self, s):
+        p = self.pos
+        if(p + s.size > len(self.data)):
+            raise ValueError("Truncated MessagePack data at %d" % p)
+        self.pos = p + s.size
+        return s.unpack_from(self.data, p)[0]
+
+    def _array(self, n):
+        u = self.unpack
+        return [u() for i in xrange(n)]
+
+    def _map(self, n):
+        u = self.unpack
+        d = {}
+        for i in xrange(n):
+            k = u()
+            d[k] = u()
+        return d
+
+    def unpack(self):
+        if(self.pos >= len(self.data)):
+            raise ValueError("Truncated MessagePack data at %d" % self.pos)
+        b = ord(self.data[self.pos])
+        self.pos += 1
+        if(b <= 0x7f):
+            return b
+        if(b >= 0xe0):
+            return b - 0x100
+        if(b <= 0x8f):
+            return self._map(b & 0x0f)
+        if(b <= 0x9f):
+            return self._array(b & 0x0f)
+        if(b <= 0xbf):
+            return self._take(b & 0x1f)
+        if(b == 0xc0):
+            return None
+        if(b == 0xc2):
+            return False
+        if(b == 0xc3):
+            return True
+        if(b == 0xd9 or b == 0xc4):
+            return self._take(self._struct(_u8))
+        if(b == 0xda or b == 0xc5):
+            return self._take(self._struct(_u16))
+        if(b == 0xdb or b == 0xc6):
+            return self._take(self._struct(_u32))
+        if(b == 0xdc):
+            return self._array(self._struct(_u16))
+        if(b == 0xdd):
+            return self._array(self._struct(_u32))
+        if(b == 0xde):
+            return self._map(self._struct(_u16))
+        if(b == 0xdf):
+            return self._map(self._struct(_u32))
+        s = _SCALARS.get(b, None)
+        if(s):
+            return self._struct(s)
+        raise ValueError("Unsupported MessagePack type 0x%02x at %d" % (b, self.pos - 1))
+
+_SCALARS = {0xca: _f32, 0xcb: _f64, 0xcc: _u8, 0xcd: _u16, 0xce: _u32, 0xcf: _u64,
+            0xd0: _i8, 0xd1: _i16, 0xd2: _i32, 0xd3: _i64}
+
+def unpackb(data):
+    """Decodes the MessagePack str @data, raises ValueError if it is malformed or has anything after the value."""
+    u = _Unpacker(data)
+    obj = u.unpack()
+    if(u.pos != len(data)):
+        raise ValueError("Extra data after MessagePack value at %d" % u.pos)
+    return obj
+
+def isPacked(data):
+    """
+        Guess if @data is MessagePack rather than JSON from its first byte, the way manifests are told apart.
+        Only reliable for a dict or list value, which is all the API and manifests use.
+    """
+    if(not data):
+        return False
+    b = ord(data[0])
+    return (0x80 <= b <= 0x9f) or (0xdc <= b <= 0xdf)
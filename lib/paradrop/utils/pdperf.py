@@ -0,0 +1,174 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Timing of named code paths into fixed memory histograms, reported on the out.perf stream.
+        Example:
+            @pdperf.timed('chute.loadManifest')
+            def loadManifest(...):
+
+            with pdperf.timer('cli.%s' % cmd):
+                ...
+
+            pdperf.PerfReporter(interval=60).start()
+"""
+
+import time, threading, functools
+
+from lib.paradrop import *
+from lib.paradrop.utils.pdstats import Histogram, LATENCY_BUCKETS
+
+class PerfRegistry:
+    """
+        A Histogram of the seconds spent in each named code path, the memory used only grows with the number of names.
+        Nothing is recorded while @enabled is False.
+    """
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._timings = {}
+        self.started = time.time()
+
+    def __repr__(self):
+        return "<PerfRegistry %d names>" % len(self._timings)
+
+    def get(self, name):
+        """Returns the Histogram for @name."""
+        h = self._timings.get(name, None)
+        if(h is None):
+            with self._lock:
+                h = self._timings.get(name, None)
+                if(h is None):
+                    h = Histogram(self.bounds)
+                    self._timings[name] = h
+        return h
+
+    def record(self, name, seconds):
+        if(self.enabled):
+            self.get(name).observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._timings = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        """Returns a dict of name: {'count', 'sum', 'mean', 'min', 'max', 'p50', 'p95', 'p99'} in seconds."""
+        with self._lock:
+            timings = self._timings.items()
+        d = {}
+        for name, h in timings:
+            if(not h.count):
+                continue
+            d[name] = {'count': h.count, 'sum': h.sum, 'mean': h.mean(), 'min': h.min, 'max': h.max,
+                       'p50': h.quantile(0.5), 'p95': h.quantile(0.95), 'p99': h.quantile(0.99)}
+        return d
+
+# The registry everything records into unless told otherwise
+registry = PerfRegistry()
+
+class timer:
+    """
+        Context manager which records the time spent inside it under @name, whether or not it raises.
+        The seconds are also kept in @elapsed.
+    """
+    def __init__(self, name, reg=None):
+        self.name = name
+        self.reg = reg or registry
+        self.elapsed = None
+        self._start = None
+
+    def __repr__(self):
+        return "<timer %s>" % self.name
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.time() - self._start
+        self.reg.record(self.name, self.elapsed)
+        return False
+
+def timed(name=None, reg=None):
+    """
+        @decorator
+        Records the time of every call of the function under @name, by default MODULE.function.
+    """
+    def _decorator(func):
+        n = name
+        if(not n):
+            n = '%s.%s' % (func.__module__.split('.')[-1], func.__name__)
+
+        @functools.wraps(func)
+        def _timed(*args, **kwargs):
+            r = reg or registry
+            if(not r.enabled):
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                r.record(n, time.time() - start)
+        return _timed
+    return _decorator
+
+def formatSummary(snapshot, sortBy='sum'):
+    """A table of a PerfRegistry snapshot in milliseconds, the biggest @sortBy first."""
+    ms = lambda v: '%.2f' % (v * 1000) if v is not None else '-'
+    fmt = '%-32s %7s %10s %9s %9s %9s %9s %9s\n'
+    s = fmt % ('name', 'count', 'total ms', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms')
+    for name in sorted(snapshot.keys(), key=lambda k: snapshot[k][sortBy], reverse=True):
+        d = snapshot[name]
+        s += fmt % (name, d['count'], ms(d['sum']), ms(d['mean']), ms(d['p50']), ms(d['p95']), ms(d['p99']), ms(d['max']))
+    return s
+
+class PerfReporter:
+    """
+        Every @interval seconds sends a summary of @reg (the default registry if None) to out.perf,
+        or if @sink is given calls sink(snapshot) with the dict from PerfRegistry.snapshot() instead.
+        Set @reset to start each interval from zero rather than report everything since the start.
+    """
+    def __init__(self, reg=None, interval=60.0, sink=None, reset=False):
+        self.reg = reg or registry
+        self.interval = interval
+        self.sink = sink
+        self.reset = reset
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return "<PerfReporter every %ss>" % self.interval
+
+    def report(self):
+        snap = self.reg.snapshot()
+        if(self.reset):
+            self.reg.reset()
+        if(not snap):
+            return
+        if(self.sink):
+            try:
+                self.sink(snap)
+            except Exception as e:
+                out.warn('** %s Perf sink failed: %s\n' % (logPrefix(), str(e)))
+        elif(out.isLive('perf')):
+            out.perf('-- %s Timings:\n%s' % (logPrefix(), formatSummary(snap)))
+
+    def _run(self):
+        while(not self._stop.wait(self.interval)):
+            self.report()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="pdperf")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread and report one last time."""
+        self._stop.set()
+        if(self._thread):
+            self._thread.join()
+        self.report()
@@ -0,0 +1,106 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Fixed memory statistics: a Histogram keeps counts in a fixed set of buckets no matter how many values it sees.
+"""
+
+import bisect, threading
+
+from lib.paradrop import *
+from lib.paradrop.pderror import PDError
+
+# Seconds, from 100us up to 1 minute
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Bytes, powers of 4 from 64B up to 64MB
+SIZE_BUCKETS = tuple([64 * (4 ** i) for i in range(11)])
+
+class Histogram:
+    """
+        Counts values into buckets with fixed upper @bounds (plus one overflow bucket),
+        along with the count, sum, min and max of everything observed.
+        Quantiles are estimated by interpolating inside the bucket they fall in.
+    """
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(bounds))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __repr__(self):
+        return "<Histogram n=%d p50=%s p99=%s>" % (self.count, self.quantile(0.5), self.quantile(0.99))
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.bounds) + 1)
+            self.count = 0
+            self.sum = 0.0
+            self.min = None
+            self.max = None
+
+    def observe(self, v):
+        i = bisect.bisect_left(self.bounds, v)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += v
+            if(self.min is None or v < self.min):
+                self.min = v
+            if(self.max is None or v > self.max):
+                self.max = v
+
+    def merge(self, other):
+        """Add the counts of another Histogram with the same bounds into this one."""
+        if(other.bounds != self.bounds):
+            raise PDError('HISTOGRAM', 'Cannot merge histograms with different buckets')
+        with other._lock:
+            counts, count, total, lo, hi = list(other.counts), other.count, other.sum, other.min, other.max
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, counts)]
+            self.count += count
+            self.sum += total
+            if(lo is not None and (self.min is None or lo < self.min)):
+                self.min = lo
+            if(hi is not None and (self.max is None or hi > self.max)):
+                self.max = hi
+
+    def mean(self):
+        if(not self.count):
+            return None
+        return self.sum / self.count
+
+    def quantile(self, q):
+        """Estimate of the value below which @q (0-1) of the observations fall, None if nothing was observed."""
+        with self._lock:
+            if(not self.count):
+                return None
+            rank = q * self.count
+            seen = 0
+            for i, c in enumerate(self.counts):
+                if(c and seen + c >= rank):
+                    if(i == 0):
+                        lo = self.min
+                    else:
+                        lo = self.bounds[i - 1]
+                    if(i < len(self.bounds)):
+                        hi = self.bounds[i]
+                    else:
+                        hi = self.max
+                    # Never report outside of what was actually seen
+                    lo = max(lo, self.min)
+                    hi = min(hi, self.max)
+                    return lo + (hi - lo) * (rank - seen) / c
+                seen += c
+            return self.max
+
+    def snapshot(self):
+        """Returns a dict of the histogram, @buckets is a list of [upper bound, count] with None for the overflow bucket."""
+        with self._lock:
+            d = {'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max,
+                 'buckets': [[b, c] for b, c in zip(list(self.bounds) + [None], self.counts)]}
+        d['p50'] = self.quantile(0.5)
+        d['p90'] = self.quantile(0.9)
+        d['p99'] = self.quantile(0.99)
+        return d
@@ -148,3 +148,55 @@ def explode(pkt, *args):
     # Now just step through the args and pop off everything from the packet
     # If a key is missing, the pkt.get(a, None) returns None rather than raising an Exception
     return tuple([pkt.get(a, None) for a in args])
+
+def _canPatch(v):
+    """A merge patch can't carry a null value (it means delete), nor "null" which the JSON codec turns into one."""
+    if(v is None or v == 'null'):
+        return False
+    if(isinstance(v, dict)):
+        for x in v.itervalues():
+            if(not _canPatch(x)):
+                return False
+    elif(isinstance(v, list)):
+        for x in v:
+            if(not _canPatch(x)):
+                return False
+    return True
+
+def mergePatch(old, new):
+    """
+        Returns the JSON merge patch (RFC 7386) which turns the dict @old into the dict @new,
+        an empty dict if they are the same, or None if @new holds a null the patch could not express.
+    """
+    if(not _canPatch(new)):
+        return None
+    patch = {}
+    for k in old:
+        if(k not in new):
+            patch[k] = None
+    for k, v in new.iteritems():
+        o = old.get(k, None)
+        if(k in old and o == v):
+            continue
+        if(isinstance(v, dict) and isinstance(o, dict)):
+            sub = mergePatch(o, v)
+            if(sub):
+                patch[k] = sub
+        else:
+            patch[k] = v
+    return patch
+
+def applyMergePatch(target, patch):
+    """Returns @target with the JSON merge patch (RFC 7386) @patch applied, @target is not changed."""
+    if(not isinstance(patch, dict)):
+        return patch
+    if(isinstance(target, dict)):
+        result = dict(target)
+    else:
+        result = {}
+    for k, v in patch.iteritems():
+        if(v is None):
+            result.pop(k, None)
+        else:
+            result[k] = applyMergePatch(result.get(k, None), v)
+    return result
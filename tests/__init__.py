@@ -0,0 +1,9 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+"""
+    Tests of the API client against the local stand-in server, run from the top of the tree with:
+        python -m unittest discover tests
+"""
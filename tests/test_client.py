@@ -0,0 +1,87 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+import os, shutil, tempfile, unittest
+
+from lib.paradrop.api.localserver import LocalAPIServer
+from lib.paradrop.api.fakeapi import FakeParaDropAPI
+from lib.paradrop.api.client import ParaDropAPIClient
+
+class ClientTestCase(unittest.TestCase):
+    """Runs each test against a FakeParaDropAPI with one AP and a chute, served on a LocalAPIServer."""
+    def setUp(self):
+        self.api = FakeParaDropAPI()
+        self.api.addUser('dev', 'pw')
+        apid = self.api.addAP('ap')
+        self.chid = self.api.addChute(apid, 'ch')
+        self.server = LocalAPIServer(self.api)
+        self.client = ParaDropAPIClient('dev', 'pw', url=self.server.start())
+        self.client.signin()
+        self.tmpdir = tempfile.mkdtemp(prefix='pdtest')
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def writeFile(self, name, data):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as fd:
+            fd.write(data)
+        return path
+
+class UploadTest(ClientTestCase):
+    def serverData(self, name):
+        return self.api.files[self.chid][name]['data']
+
+    def testSkipAfterBufferedUpload(self):
+        path = self.writeFile('a.txt', 'v1' * 100)
+        self.client.putChuteFile(self.chid, path, stream=True)
+        self.writeFile('a.txt', 'v2' * 100)
+        self.client.putChuteFile(self.chid, path)
+        self.assertEqual(self.serverData('a.txt'), 'v2' * 100)
+
+        # Back to what was streamed first, the server still holds v2 so it has to be sent
+        self.writeFile('a.txt', 'v1' * 100)
+        resp = self.client.putChuteFile(self.chid, path, skipUnchanged=True)
+        self.assertFalse(resp.get('skipped', False))
+        self.assertEqual(self.serverData('a.txt'), 'v1' * 100)
+
+    def testFailedUploadDropsRecord(self):
+        path = self.writeFile('b.txt', 'data')
+        self.client.putChuteFile(self.chid, path)
+        self.assertTrue(self.client.uploads.get(self.chid, 'b.txt'))
+        self.api.inject('.*/file/', errorRate=1.0)
+        self.assertTrue(self.client.putChuteFile(self.chid, path) is True)
+        self.assertEqual(self.client.uploads.get(self.chid, 'b.txt'), None)
+
+class HeaderTest(ClientTestCase):
+    def setUp(self):
+        ClientTestCase.setUp(self)
+        self.sent = []
+        dispatch = self.api.dispatch
+        def record(httpMethod, method, body, headers):
+            self.sent.append((method, headers.get('Content-Type', None)))
+            return dispatch(httpMethod, method, body, headers)
+        self.api.dispatch = record
+
+    def contentType(self, method):
+        return [ct for m, ct in self.sent if m.startswith(method)][-1]
+
+    def testDefaultContentType(self):
+        self.client.putChuteFile(self.chid, self.writeFile('c.txt', 'data'))
+        self.assertEqual(self.contentType('chute/%s/file/' % self.chid), 'TODO')
+        ch = self.client.getChuteData(self.chid)
+        self.client.setChuteData(ch, full=True)
+        self.assertEqual(self.contentType('chute/%s/data' % self.chid), 'application/json')
+
+    def testBinaryContentType(self):
+        self.client.binary = True
+        ch = self.client.getChuteData(self.chid)
+        self.client.setChuteData(ch, full=True)
+        self.assertEqual(self.contentType('chute/%s/data' % self.chid), 'application/x-msgpack')
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,40 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+import unittest
+
+from lib.paradrop import str2json
+from lib.paradrop.api.jsonstream import JSONArrayStream, JSONValueStream
+
+def blocks(s, size):
+    return [s[i:i + size] for i in range(0, len(s), size)]
+
+# Values which str2json decodes differently depending on where they sit in the document
+VALUES = [
+    '["null", "a%20b", {"k": "null", "l": ["null"]}, 1.5]',
+    '{"k": "null", "l": ["null", {"m": "null"}], "n": "a%20b"}',
+    '"null"',
+    '[]',
+    '12345678901234567890',
+]
+
+class JSONValueStreamTest(unittest.TestCase):
+    def testSameAsStr2json(self):
+        doc = '\n'.join(VALUES)
+        for size in (1, 3, 7, len(doc)):
+            self.assertEqual(list(JSONValueStream(blocks(doc, size))), [str2json(v) for v in VALUES])
+
+    def testTopLevelArray(self):
+        v = VALUES[0]
+        self.assertEqual(list(JSONValueStream([v])), [str2json(v)])
+
+class JSONArrayStreamTest(unittest.TestCase):
+    def testSameAsStr2json(self):
+        doc = '[%s]' % ', '.join(VALUES)
+        for size in (1, 5, len(doc)):
+            self.assertEqual(list(JSONArrayStream(blocks(doc, size))), str2json(doc))
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,50 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+import unittest
+
+from lib.paradrop import Output, EventRing, IOutput, FAKE_OUTPUT, LOGPREFIX
+
+class Recorder(IOutput):
+    """A live stream which keeps what it is sent."""
+    def __init__(self):
+        self.msgs = []
+
+    def __call__(self, args):
+        self.msgs.append(args)
+
+class Unformattable(object):
+    def __str__(self):
+        raise AssertionError('formatted for a disabled stream')
+
+class EventRingTest(unittest.TestCase):
+    def testAttachKeepsDisabledStreamsFake(self):
+        o = Output(verbose=FAKE_OUTPUT)
+        ring = EventRing(16)
+        ring.attach(o)
+        self.assertFalse(o.isLive('verbose'))
+        o.lazy('verbose', '-- %s %s\n', LOGPREFIX, Unformattable())
+        self.assertEqual(ring.events(), [])
+
+    def testAttachRecordsLiveStreams(self):
+        info = Recorder()
+        o = Output(info=info)
+        ring = EventRing(16)
+        ring.attach(o)
+        self.assertTrue(o.isLive('info'))
+        o.lazy('info', 'hello %d\n', 1)
+        self.assertEqual([e['msg'] for e in ring.events()], ['hello 1\n'])
+        self.assertEqual(info.msgs, ['hello 1\n'])
+
+    def testAttachDisabledOnRequest(self):
+        o = Output(verbose=FAKE_OUTPUT)
+        ring = EventRing(16)
+        ring.attach(o, disabled=True)
+        self.assertTrue(o.isLive('verbose'))
+        o.lazy('verbose', 'quiet\n')
+        self.assertEqual([e['msg'] for e in ring.events()], ['quiet\n'])
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,70 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+import socket, threading, unittest, zlib
+
+from lib.paradrop.api.localserver import LocalAPIServer, EchoAPI
+from lib.paradrop.api.pool import HTTPConnectionPool
+
+class BodyError(Exception):
+    pass
+
+def failingBody():
+    yield 'first block'
+    raise BodyError('read failed')
+
+class PoolErrorTest(unittest.TestCase):
+    """A request that fails part way for any reason must not leave its connection open."""
+    def setUp(self):
+        self.pool = HTTPConnectionPool()
+        self.conns = []
+        newConn = self.pool._newConn
+        def record(key):
+            conn = newConn(key)
+            self.conns.append(conn)
+            return conn
+        self.pool._newConn = record
+
+    def tearDown(self):
+        self.pool.close()
+
+    def testBodyStreamFails(self):
+        server = LocalAPIServer(EchoAPI())
+        url = server.start()
+        try:
+            self.assertRaises(BodyError, self.pool.urlopen, 'PUT', url + 'x', failingBody())
+            self.assertEqual(self.conns[0].sock, None)
+        finally:
+            server.stop()
+
+    def testBadGzipResponse(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        listener.settimeout(5)
+        def serve():
+            s, addr = listener.accept()
+            s.settimeout(5)
+            s.recv(65536)
+            body = 'not gzip at all'
+            s.sendall('HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body))
+            # Returns once the client closes its end
+            try:
+                s.recv(1)
+            except socket.timeout:
+                pass
+            s.close()
+        t = threading.Thread(target=serve)
+        t.start()
+        try:
+            url = 'http://127.0.0.1:%d/' % listener.getsockname()[1]
+            self.assertRaises(zlib.error, self.pool.urlopen, 'GET', url)
+            self.assertEqual(self.conns[0].sock, None)
+        finally:
+            t.join()
+            listener.close()
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,61 @@
+###################################################################
+# Copyright 2013-2014 All Rights Reserved
+# Authors: The Paradrop Team
+###################################################################
+
+import unittest
+
+from lib.paradrop.chute import Chute
+from lib.paradrop.api.client import ParaDropAPIClient
+from lib.paradrop.api.watcher import UpdateWatcher
+from tests.test_client import ClientTestCase
+
+class WatcherTest(ClientTestCase):
+    def setUp(self):
+        ClientTestCase.setUp(self)
+        self.chute = Chute('ch', self.chid)
+        self.watcher = UpdateWatcher(self.client, minInterval=0.05, maxInterval=0.2, timeout=2.0)
+
+    def tearDown(self):
+        self.watcher.stop()
+        ClientTestCase.tearDown(self)
+
+    def otherClient(self):
+        c = ParaDropAPIClient('dev', 'pw', url=self.server.url)
+        c.signin()
+        return c
+
+    def testServerClockBehind(self):
+        self.api.clockOffset = -60.0
+        self.client.disableChute(self.chute)
+        data = self.watcher.watchChute(self.chid).result()
+        self.assertEqual(data['action'], 'disable')
+
+    def testServerClockAhead(self):
+        self.api.clockOffset = 60.0
+        self.client.disableChute(self.chute)
+        data = self.watcher.watchChute(self.chid).result()
+        self.assertEqual(data['action'], 'disable')
+
+    def testEarlierUpdateIgnored(self):
+        self.api.clockOffset = -60.0
+        self.api.updates[('chute', self.chid)] = {'action': 'enable', 'status': 'done', 'time': self.api.now() - 30}
+        self.client.getChuteStatus(self.chid)
+        f = self.watcher.watchChute(self.chid, timeout=0.5)
+        self.assertRaises(Exception, f.result)
+
+        # A change made after the watch started settles it, even from another session
+        f = self.watcher.watchChute(self.chid)
+        self.otherClient().disableChute(self.chute)
+        self.assertEqual(f.result()['action'], 'disable')
+
+    def testOwnPredicates(self):
+        self.client.disableChute(self.chute)
+        done = self.watcher.watchChute(self.chid)
+        never = self.watcher.watchChute(self.chid, settled=lambda d: False, timeout=0.3)
+        self.assertEqual(done.result()['action'], 'disable')
+        self.assertRaises(Exception, never.result)
+        self.assertEqual(self.watcher.pending(), 0)
+
+if(__name__ == '__main__'):
+    unittest.main()